@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+import sys
+from typing import Optional
+
+from benchmarks import bench_client, bench_timer  # noqa: F401
+from benchmarks.environment import Environment
+from benchmarks.harness import (
+    baselines_path,
+    load_baselines,
+    machine,
+    regressed,
+    REPEAT,
+    report,
+    run,
+    save_baselines,
+    TOLERANCE,
+)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description='Time the client hot paths offline against the emulator',
+    )
+    parser.add_argument('names', nargs='*', help='benchmarks to run')
+    parser.add_argument(
+        '--update', action='store_true', help='save the results as baselines'
+    )
+    parser.add_argument(
+        '--quick', action='store_true', help='run everything once, no timing'
+    )
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument(
+        '--machine',
+        default=machine(),
+        help='whose baselines to compare with, by default this machine\'s',
+    )
+    parser.add_argument(
+        '--baselines', type=Path, help='baselines file, overrides --machine'
+    )
+    args = parser.parse_args(argv)
+
+    if args.baselines is None:
+        args.baselines = baselines_path(args.machine)
+    baselines = load_baselines(args.baselines)
+    with Environment() as env:
+        results = run(env, args.names, baselines, args.repeat, args.quick)
+    print(report(results, args.tolerance))
+    if args.quick:
+        return 0
+    if args.update:
+        save_baselines(results, args.baselines)
+        print(f'Saved baselines to {args.baselines}')
+        return 0
+    return int(any(regressed(result, args.tolerance) for result in results))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
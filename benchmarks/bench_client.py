@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+from datetime import timedelta
+
+from PySide2 import QtCore
+
+from benchmarks.environment import Environment
+from benchmarks.harness import benchmark
+from usc_lr_timer import google_sheets, talk_to_google
+
+
+@benchmark('service_cold', number=5)
+def service_cold(env: Environment):
+    # Parsing the discovery document and building the service and its
+    # values resource, what the first request after launch pays
+    def operation():
+        google_sheets.get_discovery_document.cache_clear()
+        google_sheets.invalidate_services()
+        google_sheets.get_spreadsheets_values(env.spreadsheet_id)
+
+    return operation
+
+
+@benchmark('service_warm', number=10000)
+def service_warm(env: Environment):
+    google_sheets.get_spreadsheets_values(env.spreadsheet_id)
+    return lambda: google_sheets.get_spreadsheets_values(env.spreadsheet_id)
+
+
+@benchmark('read_sheet', number=500)
+def read_sheet(env: Environment):
+    return lambda: google_sheets.read_sheet(
+        env.spreadsheet_id, google_sheets.NAMES_RANGE
+    )
+
+
+@benchmark('get_categories', number=500)
+def get_categories(env: Environment):
+    return lambda: google_sheets.get_categories(env.spreadsheet_id)
+
+
+@benchmark('get_bootstrap', number=500)
+def get_bootstrap(env: Environment):
+    return lambda: google_sheets.get_bootstrap(env.spreadsheet_id)
+
+
+@benchmark('get_submission_ids', number=50)
+def get_submission_ids(env: Environment):
+    return lambda: google_sheets.get_submission_ids(env.spreadsheet_id)
+
+
+@benchmark('add_row', number=500)
+def add_row(env: Environment):
+    row = google_sheets.time_row('Editor 0', 'Fall', timedelta(hours=1), 'a')
+    return lambda: google_sheets.add_row(
+        env.spreadsheet_id, google_sheets.SUBMISSIONS_SHEET, row
+    )
+
+
+@benchmark('add_time', number=500)
+def add_time(env: Environment):
+    # One submission from the timer, per second is submissions per second
+    return lambda: google_sheets.add_time(
+        env.spreadsheet_id,
+        'Editor 0',
+        'Fall',
+        timedelta(hours=1),
+        'Category 0',
+    )
+
+
+def _wait(future: talk_to_google.Future):
+    loop = QtCore.QEventLoop()
+    future.add_done_callback(lambda *_: loop.quit())
+    if not future.done():
+        loop.exec_()
+
+
+@benchmark('dispatch', number=500)
+def dispatch(env: Environment):
+    # A call that does nothing: the pool, the worker and the queued signal
+    # back to the GUI thread
+    return lambda: _wait(talk_to_google._start(talk_to_google._Worker(int)))
+
+
+@benchmark('submit_get_names', number=500)
+def submit_get_names(env: Environment):
+    return lambda: _wait(
+        talk_to_google.submit(google_sheets.get_names, env.spreadsheet_id)
+    )
@@ -0,0 +1,21 @@
+from __future__ import annotations
+
+import time
+
+from benchmarks.environment import Environment
+from benchmarks.harness import benchmark
+
+
+@benchmark('model_duration', number=10000, clock=time.process_time)
+def model_duration(env: Environment):
+    model = env.window().view.model
+    model.start_timer()
+    return lambda: model.duration
+
+
+@benchmark('tick', number=2000, clock=time.process_time)
+def tick(env: Environment):
+    # CPU of one display refresh while the timer runs
+    window = env.window()
+    window.start_timer()
+    return window.update_duration
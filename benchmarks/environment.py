@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import os
+import tempfile
+from typing import Optional
+
+from PySide2 import QtWidgets
+
+from usc_lr_timer import google_sheets
+from usc_lr_timer.constants import DATA_DIR_ENV
+from usc_lr_timer.emulator import Emulator, EmulatorHttp, SheetsBackend
+
+SPREADSHEET_ID = 'benchmark'
+# About the size of a journal's spreadsheet at the end of a semester
+NAMES = 60
+CATEGORIES = 15
+SUBMISSIONS = 2000
+# Only the client is measured, the rate limit would be the benchmark
+UNLIMITED = 1e9
+
+
+def _seed(backend: SheetsBackend):
+    names = {f'Editor {i}': f'{i:04d}' for i in range(NAMES)}
+    categories = [f'Category {i}' for i in range(CATEGORIES)]
+    submissions = [
+        [
+            f'Editor {i % NAMES}',
+            'Fall',
+            0.04,
+            '10/24/2020 12:13:14',
+            categories[i % CATEGORIES],
+            f'{i:032x}',
+        ]
+        for i in range(SUBMISSIONS)
+    ]
+    backend.create(SPREADSHEET_ID, names, categories, submissions)
+
+
+class Environment(object):
+    # Everything the benchmarks need, offline: google_sheets talks to an
+    # in process emulator through EmulatorHttp and app data goes to a
+    # temporary directory
+    def __init__(self):
+        self.spreadsheet_id = SPREADSHEET_ID
+        self.backend = SheetsBackend()
+        _seed(self.backend)
+        self.emulator = Emulator(self.backend)
+        self._data_dir = None
+        self._old_data_dir = None
+        self._window = None
+
+    def __enter__(self) -> Environment:
+        self._data_dir = tempfile.TemporaryDirectory()
+        self._old_data_dir = os.environ.get(DATA_DIR_ENV)
+        os.environ[DATA_DIR_ENV] = self._data_dir.name
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        if QtWidgets.QApplication.instance() is None:
+            self.app = QtWidgets.QApplication([])
+        else:
+            self.app = QtWidgets.QApplication.instance()
+        google_sheets.configure_endpoint('http://emulator/')
+        google_sheets.configure_http_pool(
+            factory=lambda: EmulatorHttp(self.emulator)
+        )
+        google_sheets.configure_rate_limit(UNLIMITED, UNLIMITED)
+        return self
+
+    def __exit__(self, *exc_info):
+        from usc_lr_timer.talk_to_google import shutdown_thread_pool
+
+        if self._window is not None:
+            self._window.close()
+            self._window = None
+        shutdown_thread_pool(timeout=None)
+        google_sheets.configure_endpoint(None)
+        google_sheets.configure_http_pool()
+        google_sheets.configure_rate_limit()
+        if self._old_data_dir is None:
+            os.environ.pop(DATA_DIR_ENV, None)
+        else:
+            os.environ[DATA_DIR_ENV] = self._old_data_dir
+        self._data_dir.cleanup()
+
+    def window(self) -> Optional[QtWidgets.QMainWindow]:
+        # The timer window, logged in with categories from the login dialog
+        if self._window is None:
+            from usc_lr_timer.app import MainWindow
+            from usc_lr_timer.model import Model
+
+            categories = google_sheets.get_categories(self.spreadsheet_id)
+            model = Model(
+                'Benchmark Review', self.spreadsheet_id, 'Editor 0', categories
+            )
+            self._window = MainWindow(model)
+        return self._window
@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+from collections import namedtuple
+from collections.abc import Callable
+import json
+import os
+from pathlib import Path
+import platform
+import time
+from typing import Optional
+
+# Baselines are only comparable on the machine that saved them, so every
+# machine, a CI runner or a developer's, has its own file here named after
+# MACHINE_ENV or else the host name
+BASELINES_DIR = Path(__file__).parent / 'baselines'
+MACHINE_ENV = 'BENCHMARK_MACHINE'
+# A benchmark regresses when it is this much slower than its baseline. Runs
+# on a busy machine can differ by up to a third.
+TOLERANCE = 0.5
+# and slower by more than this many seconds per call. Calls of a fraction of
+# a millisecond can double from scheduling alone.
+NOISE_FLOOR = 100e-6
+# Each benchmark is timed this many times and the fastest run is kept, the
+# slower ones measure whatever else the machine was doing
+REPEAT = 5
+
+Benchmark = namedtuple('Benchmark', ['name', 'setup', 'number', 'clock'])
+Result = namedtuple('Result', ['name', 'seconds', 'baseline'])
+
+_benchmarks = []
+
+
+def benchmark(
+    name: str, number: int = 100, clock: Callable = time.perf_counter
+) -> Callable:
+    # Registers a setup function. It gets the environment the suite runs in
+    # and returns the operation to time, which is called number times per
+    # run. Use time.process_time as the clock to measure CPU instead.
+    def register(setup: Callable) -> Callable:
+        _benchmarks.append(Benchmark(name, setup, number, clock))
+        return setup
+
+    return register
+
+
+def benchmarks() -> list[Benchmark]:
+    return _benchmarks[:]
+
+
+def measure(
+    operation: Callable,
+    number: int,
+    clock: Callable = time.perf_counter,
+    repeat: int = REPEAT,
+) -> float:
+    # Seconds per call of the fastest run
+    best = None
+    for _ in range(repeat):
+        start = clock()
+        for _ in range(number):
+            operation()
+        elapsed = (clock() - start) / number
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def machine() -> str:
+    return os.environ.get(MACHINE_ENV) or platform.node()
+
+
+def baselines_path(name: Optional[str] = None) -> Path:
+    return BASELINES_DIR / f'{name or machine()}.json'
+
+
+def load_baselines(path: Path) -> dict[str, float]:
+    try:
+        with open(path, encoding='utf-8') as stream:
+            return json.load(stream)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baselines(results: list[Result], path: Path):
+    baselines = load_baselines(path)
+    path.parent.mkdir(exist_ok=True)
+    baselines.update({result.name: result.seconds for result in results})
+    with open(path, 'w', encoding='utf-8') as stream:
+        json.dump(dict(sorted(baselines.items())), stream, indent=2)
+        stream.write('\n')
+
+
+def regressed(result: Result, tolerance: float = TOLERANCE) -> bool:
+    if result.baseline is None:
+        return False
+    slower = result.seconds - result.baseline
+    return slower > result.baseline * tolerance and slower > NOISE_FLOOR
+
+
+def _duration(seconds: float) -> str:
+    for unit, scale in [('s', 1), ('ms', 1e3), ('us', 1e6)]:
+        if seconds * scale >= 1:
+            return f'{seconds * scale:.2f} {unit}'
+    return f'{seconds * 1e9:.0f} ns'
+
+
+def report(results: list[Result], tolerance: float = TOLERANCE) -> str:
+    lines = [
+        f'{"benchmark":<24} {"per call":>12} {"per second":>12} '
+        f'{"baseline":>12} {"change":>8}'
+    ]
+    for result in results:
+        per_second = 1 / result.seconds if result.seconds else float('inf')
+        if result.baseline is None:
+            baseline, change = '-', '-'
+        else:
+            baseline = _duration(result.baseline)
+            change = f'{result.seconds / result.baseline - 1:+.0%}'
+        flag = '  REGRESSED' if regressed(result, tolerance) else ''
+        lines.append(
+            f'{result.name:<24} {_duration(result.seconds):>12} '
+            f'{per_second:>12,.0f} {baseline:>12} {change:>8}{flag}'
+        )
+    return '\n'.join(lines)
+
+
+def run(
+    environment: object,
+    names: Optional[list[str]] = None,
+    baselines: Optional[dict[str, float]] = None,
+    repeat: int = REPEAT,
+    quick: bool = False,
+) -> list[Result]:
+    # quick calls every operation once, to check the suite still works
+    baselines = baselines or {}
+    results = []
+    for bench in _benchmarks:
+        if names and bench.name not in names:
+            continue
+        operation = bench.setup(environment)
+        if quick:
+            seconds = measure(operation, 1, bench.clock, 1)
+        else:
+            seconds = measure(operation, bench.number, bench.clock, repeat)
+        results.append(Result(bench.name, seconds, baselines.get(bench.name)))
+    return results
@@ -0,0 +1,416 @@
+from __future__ import annotations
+
+import argparse
+from collections import Counter, namedtuple
+from collections.abc import Callable
+import math
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Optional
+
+from PySide2 import QtCore
+import httplib2
+
+from usc_lr_timer import google_sheets, metrics, talk_to_google
+from usc_lr_timer.constants import DATA_DIR_ENV
+from usc_lr_timer.emulator import (
+    Emulator,
+    Faults,
+    SheetsBackend,
+    SUBMISSIONS_SHEET,
+)
+from usc_lr_timer.model import Model
+from usc_lr_timer.outbox import OutboxFlusher, RETRY_INTERVAL
+
+SPREADSHEET_ID = 'load'
+JOURNAL = 'Load'
+USERS = 10
+CATEGORIES = 15
+# A shift is compressed into this many seconds, editors submit on average
+# every INTERVAL seconds of it
+SHIFT = 60.0
+INTERVAL = 5.0
+# Once the shift is over editors keep flushing their outbox this long
+DRAIN = 30.0
+PERCENTILES = (50, 95, 99)
+
+Shift = namedtuple(
+    'Shift',
+    [
+        'endpoint',
+        'spreadsheet_id',
+        'duration',
+        'interval',
+        'drain',
+        'retry_interval',
+        'seed',
+    ],
+)
+Sample = namedtuple(
+    'Sample', ['method', 'status', 'duration', 'requests', 'retries']
+)
+UserResult = namedtuple(
+    'UserResult', ['samples', 'statuses', 'submitted', 'unsent']
+)
+
+
+class _CountingHttp(httplib2.Http):
+    # Counts the status of every response, each editor sends one request at
+    # a time so no lock is needed
+    def __init__(self, statuses: Counter):
+        super().__init__(timeout=google_sheets.REQUEST_TIMEOUT)
+        self.statuses = statuses
+
+    def request(self, *args, **kwargs) -> tuple:
+        response, content = super().request(*args, **kwargs)
+        self.statuses[response.status] += 1
+        return response, content
+
+
+def _call(fn: Callable, *args, **kwargs) -> Optional[object]:
+    # Like a call on the thread pool: recorded, and failures are a result
+    try:
+        with metrics.record(metrics.method_name(fn)):
+            return fn(*args, **kwargs)
+    except Exception:
+        return None
+
+
+def _login(shift: Shift, end: float) -> list[str]:
+    # The login dialog and then the main window each fetch the bootstrap.
+    # An editor whose login fails tries again until the shift is over.
+    while time.monotonic() < end:
+        login = _call(google_sheets.get_bootstrap, shift.spreadsheet_id)
+        if login is not None:
+            refreshed = _call(google_sheets.get_bootstrap, shift.spreadsheet_id)
+            return (refreshed or login)['categories']
+        time.sleep(shift.retry_interval)
+    return []
+
+
+def _submit(model: Model, rng: random.Random) -> str:
+    # What the main window does when an editor submits time entered by hand
+    seconds = round(rng.uniform(60, 60 * 60))
+    model.set_category_index(rng.randrange(1, len(model.categories)))
+    model.set_manual_hours(seconds // 3600)
+    model.set_manual_minutes(seconds // 60 % 60)
+    model.set_manual_seconds(seconds % 60)
+    model.submit(manual=True)
+    row = model.outbox.pending()[-1].row
+    return row[google_sheets.SUBMISSION_ID_COLUMN]
+
+
+def _work(
+    app: QtCore.QCoreApplication,
+    shift: Shift,
+    model: Model,
+    rng: random.Random,
+    end: float,
+) -> list[str]:
+    # Submits until the shift ends, then lets the outbox drain. The flusher
+    # sends the rows, as it does in the app.
+    flusher = OutboxFlusher(model.outbox, retry_interval=shift.retry_interval)
+    submitted = []
+    submissions = QtCore.QTimer()
+    submissions.setSingleShot(True)
+
+    def wait(seconds: float) -> int:
+        return max(int(seconds * 1000), 0)
+
+    def submit():
+        submitted.append(_submit(model, rng))
+        flusher.schedule()
+        submissions.start(wait(rng.expovariate(1 / shift.interval)))
+
+    def over():
+        submissions.stop()
+        if not len(model.outbox):
+            app.quit()
+
+    def pending_changed(pending: int):
+        if not pending and time.monotonic() >= end:
+            app.quit()
+
+    submissions.timeout.connect(submit)
+    flusher.pending_changed.connect(pending_changed)
+    submissions.start(wait(rng.expovariate(1 / shift.interval)))
+    QtCore.QTimer.singleShot(wait(end - time.monotonic()), over)
+    QtCore.QTimer.singleShot(
+        wait(end + shift.drain - time.monotonic()), app.quit
+    )
+    app.exec_()
+    return submitted
+
+
+def simulate_user(shift: Shift, user: int) -> UserResult:
+    # One editor's shift, run in a process of its own like the app would be
+    google_sheets.configure_endpoint(shift.endpoint)
+    statuses = Counter()
+    google_sheets.configure_http_pool(factory=lambda: _CountingHttp(statuses))
+    samples = []
+
+    def sample(call: metrics.Call):
+        samples.append(
+            Sample(
+                call.method,
+                call.status,
+                call.duration,
+                call.requests,
+                call.retries,
+            )
+        )
+
+    seed = None if shift.seed is None else shift.seed + user
+    rng = random.Random(seed)
+    app = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+    metrics.add_hook(sample)
+    submitted = []
+    unsent = []
+    # The app imports the client while the login dialog is shown
+    google_sheets.warm_up()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            # The editor's outbox and cache
+            os.environ[DATA_DIR_ENV] = directory
+            end = time.monotonic() + shift.duration
+            categories = _login(shift, end)
+            if categories:
+                model = Model(
+                    JOURNAL,
+                    shift.spreadsheet_id,
+                    f'Editor {user}',
+                    categories,
+                )
+                model.set_categories()
+                submitted = _work(app, shift, model, rng, end)
+                # Requests still running when the drain ran out
+                talk_to_google.shutdown_thread_pool(None)
+                unsent = [
+                    entry.row[google_sheets.SUBMISSION_ID_COLUMN]
+                    for entry in model.outbox.pending()
+                ]
+                model.outbox.close()
+    finally:
+        metrics.remove_hook(sample)
+    return UserResult(samples, dict(statuses), submitted, unsent)
+
+
+def percentile(values: list[float], percent: float) -> float:
+    # Nearest rank
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+class Report(object):
+    def __init__(
+        self,
+        results: list[UserResult],
+        sheet_ids: list[str],
+        seconds: float,
+    ):
+        self.users = len(results)
+        self.seconds = seconds
+        self.samples = [
+            sample for result in results for sample in result.samples
+        ]
+        self.statuses = Counter()
+        for result in results:
+            self.statuses.update(result.statuses)
+        submitted = [id_ for result in results for id_ in result.submitted]
+        unsent = {id_ for result in results for id_ in result.unsent}
+        # Only rows of this run count, the sheet may have others
+        submitted_ids = set(submitted)
+        written = Counter(id_ for id_ in sheet_ids if id_ in submitted_ids)
+        self.submitted = len(submitted)
+        self.written = len(written)
+        self.unsent = len(unsent)
+        self.duplicates = sum(count - 1 for count in written.values())
+        self.lost = len(submitted_ids - set(written) - unsent)
+
+    @property
+    def requests(self) -> int:
+        return sum(self.statuses.values())
+
+    @property
+    def errors(self) -> int:
+        return sum(1 for sample in self.samples if sample.status != 'success')
+
+    @property
+    def throttled(self) -> int:
+        return self.statuses.get(429, 0)
+
+    @property
+    def server_errors(self) -> int:
+        return sum(
+            count for status, count in self.statuses.items() if status >= 500
+        )
+
+    @property
+    def ok(self) -> bool:
+        return not self.duplicates and not self.lost
+
+    def latencies(self) -> dict[str, list[float]]:
+        latencies = {}
+        for sample in self.samples:
+            latencies.setdefault(sample.method, []).append(sample.duration)
+        return latencies
+
+    def text(self) -> str:
+        def rate(count: int, total: int) -> str:
+            return f'{count} ({count / total:.1%})' if total else str(count)
+
+        per_second = 1 / self.seconds if self.seconds else 0.0
+        lines = [
+            f'{self.users} editors in {self.seconds:.1f} s',
+            f'{"method":<18} {"calls":>6} {"errors":>6} '
+            + ' '.join(f'{f"p{p}":>8}' for p in PERCENTILES)
+            + f' {"max":>8}',
+        ]
+        errors = Counter(
+            s.method for s in self.samples if s.status != 'success'
+        )
+        for method, durations in sorted(self.latencies().items()):
+            lines.append(
+                f'{method:<18} {len(durations):>6} {errors[method]:>6} '
+                + ' '.join(
+                    f'{percentile(durations, p) * 1e3:>6.0f}ms'
+                    for p in PERCENTILES
+                )
+                + f' {max(durations) * 1e3:>6.0f}ms'
+            )
+        retries = sum(sample.retries for sample in self.samples)
+        lines += [
+            f'calls: {len(self.samples)} '
+            f'({len(self.samples) * per_second:.2f}/s), '
+            f'errors {rate(self.errors, len(self.samples))}',
+            f'requests: {self.requests} ({self.requests * per_second:.2f}/s), '
+            f'429 {rate(self.throttled, self.requests)}, '
+            f'5xx {rate(self.server_errors, self.requests)}, '
+            f'retries {retries}',
+            f'rows: {self.submitted} submitted, {self.written} written '
+            f'({self.written * per_second:.2f}/s), {self.unsent} unsent, '
+            f'{self.lost} lost, {self.duplicates} duplicated',
+        ]
+        return '\n'.join(lines)
+
+
+def _sheet_ids(shift: Shift, backend: Optional[SheetsBackend]) -> list[str]:
+    # The emulator's own spreadsheet is read directly, the load may have
+    # used up its quota
+    if backend is not None:
+        column = google_sheets.SUBMISSION_ID_COLUMN
+        rows = backend.rows(shift.spreadsheet_id, SUBMISSIONS_SHEET)[1:]
+        return [row[column] for row in rows if len(row) > column]
+    google_sheets.configure_endpoint(shift.endpoint)
+    rows = google_sheets.read_sheet(
+        shift.spreadsheet_id, google_sheets.SUBMISSION_IDS_RANGE
+    )
+    return [row[0] for row in rows if row]
+
+
+def run(
+    shift: Shift,
+    users: int = USERS,
+    backend: Optional[SheetsBackend] = None,
+) -> Report:
+    # Every editor gets a process of its own, so none of them share the
+    # rate limiter, the submission index or connections, as on the staff's
+    # own machines. backend is the emulator's, when it serves the endpoint.
+    context = multiprocessing.get_context('spawn')
+    start = time.monotonic()
+    with context.Pool(users, maxtasksperchild=1) as pool:
+        results = pool.starmap(
+            simulate_user, [(shift, user) for user in range(users)], 1
+        )
+    seconds = time.monotonic() - start
+    return Report(results, _sheet_ids(shift, backend), seconds)
+
+
+def _emulator(args: argparse.Namespace) -> Emulator:
+    backend = SheetsBackend()
+    backend.create(
+        args.spreadsheet,
+        {f'Editor {user}': f'{user:04d}' for user in range(args.users)},
+        [f'Category {i}' for i in range(CATEGORIES)],
+    )
+    faults = Faults(
+        args.latency,
+        args.jitter,
+        args.error_rate,
+        args.late_error_rate,
+        args.quota,
+        args.seed,
+    )
+    return Emulator(backend, faults)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.load',
+        description='Simulate a staff shift of editors submitting time',
+    )
+    parser.add_argument('--users', type=int, default=USERS)
+    parser.add_argument(
+        '--shift', type=float, default=SHIFT, help='seconds the shift lasts'
+    )
+    parser.add_argument(
+        '--interval',
+        type=float,
+        default=INTERVAL,
+        help='average seconds between one editor\'s submissions',
+    )
+    parser.add_argument('--drain', type=float, default=DRAIN)
+    parser.add_argument('--retry-interval', type=float, default=RETRY_INTERVAL)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument(
+        '--endpoint',
+        help='Sheets API stand in to load, by default a local emulator with '
+        'the faults below',
+    )
+    parser.add_argument('--spreadsheet', default=SPREADSHEET_ID)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--late-error-rate', type=float, default=0.0)
+    parser.add_argument('--quota', type=int)
+    args = parser.parse_args(argv)
+
+    emulator = None
+    endpoint = args.endpoint
+    if endpoint is None:
+        emulator = _emulator(args)
+        emulator.start()
+        endpoint = emulator.url
+    shift = Shift(
+        endpoint,
+        args.spreadsheet,
+        args.shift,
+        args.interval,
+        args.drain,
+        args.retry_interval,
+        args.seed,
+    )
+    try:
+        report = run(shift, args.users, emulator and emulator.backend)
+    finally:
+        if emulator is not None:
+            emulator.stop()
+    print(report.text())
+    if emulator is not None:
+        stats = emulator.stats
+        print(
+            f'emulator: {stats["requests"]} requests, '
+            f'{stats["throttled"]} throttled, {stats["errors"]} failed'
+        )
+    return int(not report.ok)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -46,8 +46,10 @@ def clean(c):
 def format(c):
     c.run('black usc_lr_timer')
     c.run('black tests')
+    c.run('black benchmarks')
     c.run('isort usc_lr_timer')
     c.run('isort tests')
+    c.run('isort benchmarks')
 
 
 @task
@@ -55,8 +57,80 @@ def lint(c):
     results = []
     results.append(c.run('black --check usc_lr_timer', warn=True))
     results.append(c.run('black --check tests', warn=True))
+    results.append(c.run('black --check benchmarks', warn=True))
     results.append(c.run('isort --check usc_lr_timer', warn=True))
     results.append(c.run('isort --check tests', warn=True))
+    results.append(c.run('isort --check benchmarks', warn=True))
     results.append(c.run('flake8 usc_lr_timer', warn=True))
     results.append(c.run('flake8 tests', warn=True))
-    return sys.exit(int(sum(res.exited for res in results) > 0))
\ No newline at end of file
+    results.append(c.run('flake8 benchmarks', warn=True))
+    return sys.exit(int(sum(res.exited for res in results) > 0))
+
+
+@task
+def check_discovery(c):
+    from usc_lr_timer.google_sheets import check_discovery_document
+
+    current, pinned, latest = check_discovery_document()
+    if current:
+        print(f'Sheets discovery document is up to date ({pinned})')
+    else:
+        print(f'Sheets discovery document is stale: {pinned} < {latest}')
+    return sys.exit(int(not current))
+
+
+@task
+def poll_journals(c):
+    import asyncio
+    import json
+
+    from usc_lr_timer.async_sheets import AsyncSheetsClient
+    from usc_lr_timer.constants import RESOURCES
+
+    with open(RESOURCES / 'journal_mapping.json') as stream:
+        journals = json.load(stream)
+
+    async def poll():
+        async with AsyncSheetsClient() as client:
+            return await client.bootstraps(list(journals.values()))
+
+    results = asyncio.get_event_loop().run_until_complete(poll())
+    failed = 0
+    for journal, spreadsheet_id in journals.items():
+        result = results[spreadsheet_id]
+        if isinstance(result, Exception):
+            failed += 1
+            print(f'{journal}: {result!r}')
+        else:
+            names = len(result['names'])
+            categories = len(result['categories'])
+            print(f'{journal}: {names} names, {categories} categories')
+    return sys.exit(int(failed > 0))
+
+
+@task
+def emulator(c, port=8080, latency=0.0, error_rate=0.0, quota=None):
+    from usc_lr_timer.emulator import main
+
+    argv = ['--port', str(port), '--latency', str(latency)]
+    argv += ['--error-rate', str(error_rate)]
+    if quota is not None:
+        argv += ['--quota', str(quota)]
+    main(argv)
+
+
+@task
+def benchmark(c, update=False, quick=False):
+    args = ' --update' if update else ''
+    args += ' --quick' if quick else ''
+    c.run(f'python -m benchmarks{args}')
+
+
+@task
+def load(c, users=10, shift=60.0, error_rate=0.0, quota=None, endpoint=None):
+    args = f' --users {users} --shift {shift} --error-rate {error_rate}'
+    if quota is not None:
+        args += f' --quota {quota}'
+    if endpoint is not None:
+        args += f' --endpoint {endpoint}'
+    c.run(f'python -m benchmarks.load{args}')
@@ -29,6 +29,7 @@ def model(mocker: MockFixture, mock_journals) -> Model:
     def set_names(*args, **kwargs):
         model._names = ['', 'Vincent']
         model._name_mapping = {'Vincent': '1234'}
+        return True
 
     mock_set_names.side_effect = set_names
     return model
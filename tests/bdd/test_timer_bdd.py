@@ -1,4 +1,5 @@
 """Timer feature tests."""
+from collections.abc import Callable
 from datetime import timedelta
 from unittest.mock import Mock
 
@@ -19,41 +20,43 @@ NAME = 'Vincent Vargas'
 
 
 @pytest.fixture
-def mock_progress(mocker: MockFixture, qtbot: QtBot):
-    progress = QtWidgets.QProgressDialog('test', 'test', 0, 0)
+def mock_submit(mocker: MockFixture, make_future: Callable):
+    mock_submit = mocker.patch(
+        'usc_lr_timer.model.talk_to_google.submit', autospec=True,
+    )
 
-    def exec_(*args, **kwargs):
-        while progress.result() != progress.Accepted:
-            qtbot.wait(200)
+    def submit(method, *args, **kwargs):
+        if method is google_sheets.get_bootstrap:
+            return make_future(
+                Results.success,
+                {'names': {}, 'categories': ['testing', 'other']},
+            )
+        else:
+            raise NotImplementedError
 
-    mocker.patch.object(progress, 'exec_', side_effect=exec_)
-    mock_Progress = mocker.patch(
-        'usc_lr_timer.model.talk_to_google.QtWidgets.QProgressDialog',
-        return_value=progress,
-    )
-    return mock_Progress
+    mock_submit.side_effect = submit
+    return mock_submit
 
 
 @pytest.fixture
-def mock_talk_to_google(mocker: MockFixture, mock_progress: Mock):
-    mock_talk_to_google = mocker.patch(
-        'usc_lr_timer.model.talk_to_google.talk_to_google', autospec=True,
+def mock_in_background(mocker: MockFixture):
+    mock_in_background = mocker.patch(
+        'usc_lr_timer.outbox.talk_to_google.talk_to_google_in_background',
+        autospec=True,
     )
 
-    def talk_to_google(method, *args, **kwargs):
-        if method is google_sheets.get_categories:
-            return Results.success, ['testing', 'other']
-        elif method is google_sheets.add_time:
-            return Results.success, None
+    def in_background(method, callback, *args, **kwargs):
+        if method is google_sheets.add_submissions:
+            callback(Results.success, {})
         else:
             raise NotImplementedError
 
-    mock_talk_to_google.side_effect = talk_to_google
-    return mock_talk_to_google
+    mock_in_background.side_effect = in_background
+    return mock_in_background
 
 
 @pytest.fixture
-def model(mock_talk_to_google: Mock):
+def model(mock_submit: Mock, mock_in_background: Mock):
     model = Model(JOURNAL, SHEET_ID, NAME)
     return model
 
@@ -71,6 +74,9 @@ def window(model: Model, qtbot: QtBot, mocker: MockFixture):
     mocker.patch(message_box.format('information'))
     window = MainWindow(model)
     qtbot.add_widget(window)
+    # The duration display only runs while it can be seen
+    window.show()
+    qtbot.wait_exposed(window)
     return window
 
 
@@ -167,24 +173,29 @@ def the_timer_is(state: str, window: MainWindow, model: Model):
 
 @then(parsers.parse('the app submits the duration of {dur} seconds'))
 def the_app_submits_the_duration(
-    dur: str, mock_talk_to_google: Mock, mocker: MockFixture
+    dur: str,
+    mock_in_background: Mock,
+    model: Model,
+    mocker: MockFixture,
+    qtbot: QtBot,
 ):
     dur = dur.lower().strip()
     if dur == 'any':
-        duration = mocker.ANY
+        days = mocker.ANY
     else:
-        duration = timedelta(seconds=int(dur))
-    mock_talk_to_google.assert_called_with(
-        google_sheets.add_time,
-        spreadsheet_id=SHEET_ID,
-        name=NAME,
-        semester='Fall',
-        duration=duration,
-        category='testing',
+        days = timedelta(seconds=int(dur)) / timedelta(days=1)
+    qtbot.waitUntil(lambda: mock_in_background.called, 5000)
+    mock_in_background.assert_called_with(
+        google_sheets.add_submissions,
+        mocker.ANY,
+        SHEET_ID,
+        [[NAME, 'Fall', days, mocker.ANY, 'testing', mocker.ANY]],
+        deduplicate=False,
     )
     if dur == 'any':
-        call = mock_talk_to_google.call_args_list[-1]
-        assert call[1]['duration'].total_seconds() > 0
+        call = mock_in_background.call_args_list[-1]
+        assert call[0][3][0][2] > 0
+    assert len(model.outbox) == 0
 
 
 @then('the fields are reset')
@@ -1,23 +1,56 @@
+from collections.abc import Callable
+from typing import Any, Optional
 from unittest.mock import Mock
 
+from py._path.local import LocalPath
 import pytest
 from pytest_mock.plugin import MockFixture
 from pytestqt.qtbot import QtBot
 
 from usc_lr_timer.app import MainWindow
+from usc_lr_timer.constants import DATA_DIR_ENV
 from usc_lr_timer.model import Model
-from usc_lr_timer.talk_to_google import Results
+from usc_lr_timer.talk_to_google import Future, Results, shutdown_thread_pool
+
+
+@pytest.fixture(autouse=True)
+def data_dir(monkeypatch: pytest.MonkeyPatch, tmpdir: LocalPath) -> LocalPath:
+    data_dir = tmpdir.join('data')
+    monkeypatch.setenv(DATA_DIR_ENV, str(data_dir))
+    return data_dir
+
+
+@pytest.fixture(autouse=True)
+def thread_pool():
+    # Don't leave requests running into the next test
+    yield
+    shutdown_thread_pool(timeout=None)
+
+
+@pytest.fixture
+def make_future() -> Callable:
+    # A future that has already finished
+    def make_future(
+        status: Results, result: Any = None, error: Optional[Exception] = None
+    ) -> Future:
+        future = Future()
+        future._resolve(status, result, error)
+        return future
+
+    return make_future
 
 
 @pytest.fixture
-def model_mock_ttg(mocker: MockFixture):
-    mock_ttg = mocker.patch('usc_lr_timer.model.talk_to_google.talk_to_google')
-    mock_ttg.return_value = Results.success, ['testing']
-    return mock_ttg
+def model_mock_submit(mocker: MockFixture, make_future: Callable):
+    mock_submit = mocker.patch('usc_lr_timer.model.talk_to_google.submit')
+    mock_submit.return_value = make_future(
+        Results.success, {'names': {}, 'categories': ['testing']}
+    )
+    return mock_submit
 
 
 @pytest.fixture
-def model(model_mock_ttg: Mock):
+def model(model_mock_submit: Mock):
     model = Model('Law Review', 'abc123', 'Vincent')
     return model
 
@@ -0,0 +1,113 @@
+import json
+import subprocess
+import sys
+
+from pytest_mock.plugin import MockFixture
+from pytestqt.qtbot import QtBot
+
+from usc_lr_timer import app, google_sheets
+from usc_lr_timer.app import MainWindow
+from usc_lr_timer.model import Model
+
+GOOGLE_MODULES = ['google.auth', 'google.oauth2', 'googleapiclient', 'httplib2']
+# The app's own import may cost this many times the Qt import it builds on,
+# the Google client alone would cost about three
+IMPORT_RATIO = 2.0
+# Below this the timings are too small to compare
+IMPORT_FLOOR = 0.1
+IMPORT_SCRIPT = '''
+import json
+import sys
+import time
+
+start = time.perf_counter()
+import PySide2.QtWidgets
+qt = time.perf_counter() - start
+start = time.perf_counter()
+import usc_lr_timer.app
+app = time.perf_counter() - start
+print(json.dumps({'qt': qt, 'app': app, 'modules': list(sys.modules)}))
+'''
+
+
+def test_schedule_duration_update(
+    window: MainWindow, model: Model, qtbot: QtBot, mocker: MockFixture
+):
+    mock_monotonic = mocker.patch('usc_lr_timer.model.time.monotonic')
+    mock_monotonic.return_value = 100.0
+    window.start_timer()
+    # Nothing to refresh while the window is hidden
+    assert not window._timer.isActive()
+    window.show()
+    qtbot.wait_exposed(window)
+    assert window._timer.isActive()
+    assert window._timer.isSingleShot()
+    assert window._timer.interval() == 1000 + app.DISPLAY_SLACK
+    mock_monotonic.return_value = 100.25
+    window.update_duration()
+    assert window._timer.interval() == 750 + app.DISPLAY_SLACK
+    window.pause_timer()
+    assert not window._timer.isActive()
+
+
+def test_duration_hidden(window: MainWindow, model: Model, qtbot: QtBot):
+    window.show()
+    qtbot.wait_exposed(window)
+    window.start_timer()
+    assert window._timer.isActive()
+    window._tab_widget.setCurrentIndex(1)
+    assert not window._timer.isActive()
+    window._tab_widget.setCurrentIndex(0)
+    assert window._timer.isActive()
+    window.hide()
+    assert not window._timer.isActive()
+    assert model.running
+
+
+def test_duration_minimized(
+    window: MainWindow, qtbot: QtBot, mocker: MockFixture
+):
+    window.show()
+    qtbot.wait_exposed(window)
+    window.start_timer()
+    mocker.patch.object(window, 'isMinimized', return_value=True)
+    window.changeEvent(app.QtCore.QEvent(app.QtCore.QEvent.WindowStateChange))
+    assert not window._timer.isActive()
+    window.isMinimized.return_value = False
+    window.changeEvent(app.QtCore.QEvent(app.QtCore.QEvent.WindowStateChange))
+    assert window._timer.isActive()
+
+
+def test_import_budget():
+    # A fresh interpreter, so nothing the tests imported counts
+    output = subprocess.run(
+        [sys.executable, '-c', IMPORT_SCRIPT],
+        check=True,
+        stdout=subprocess.PIPE,
+    ).stdout
+    timings = json.loads(output)
+    # The Google client is loaded on a pool thread after startup
+    assert not set(GOOGLE_MODULES).intersection(timings['modules'])
+    # Compared with Qt in the same process so a slow machine slows both
+    budget = max(IMPORT_RATIO * timings['qt'], IMPORT_FLOOR)
+    assert timings['app'] < budget
+
+
+def test_main_warm_up(mocker: MockFixture):
+    mocker.patch('usc_lr_timer.app.QtWidgets.QApplication')
+    mock_submit = mocker.patch('usc_lr_timer.app.talk_to_google.submit')
+
+    def login():
+        # Started before the dialog, not after
+        mock_submit.assert_called_once_with(google_sheets.warm_up)
+        return False, None, None, None, []
+
+    mock_login = mocker.patch('usc_lr_timer.app.login', side_effect=login)
+    app.main([])
+    mock_login.assert_called_once_with()
+
+
+def test_close_stops_flusher(window: MainWindow, mocker: MockFixture):
+    mock_stop = mocker.patch.object(window._flusher, 'stop')
+    window.close()
+    mock_stop.assert_called_once_with()
@@ -0,0 +1,131 @@
+import asyncio
+import threading
+
+import pytest
+from pytest_mock.plugin import MockFixture
+
+from usc_lr_timer import async_sheets, cancel, google_sheets
+
+PATH = 'usc_lr_timer.async_sheets.{}'
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+@pytest.fixture
+def client():
+    client = async_sheets.AsyncSheetsClient(max_workers=4)
+    yield client
+    client.close()
+
+
+def test_get(client: async_sheets.AsyncSheetsClient, mocker: MockFixture):
+    mock_read = mocker.patch(PATH.format('google_sheets.read_sheet'))
+    mock_read.return_value = [['a']]
+    assert run(client.get('abc123', 'A1')) == [['a']]
+    mock_read.assert_called_once_with('abc123', 'A1')
+
+
+def test_batch_get(
+    client: async_sheets.AsyncSheetsClient, mocker: MockFixture
+):
+    mock_read = mocker.patch(PATH.format('google_sheets.read_sheets'))
+    mock_read.return_value = [[['a']], []]
+    assert run(client.batch_get('abc123', ['A1', 'B1'])) == [[['a']], []]
+    mock_read.assert_called_once_with('abc123', ['A1', 'B1'])
+
+
+def test_append(client: async_sheets.AsyncSheetsClient, mocker: MockFixture):
+    mock_add = mocker.patch(PATH.format('google_sheets.add_rows'))
+    mock_add.return_value = {'updates': {}}
+    result = run(client.append('abc123', 'Submissions', [[1, 2]]))
+    assert result == {'updates': {}}
+    mock_add.assert_called_once_with('abc123', 'Submissions', [[1, 2]])
+
+
+def test_bootstraps(
+    client: async_sheets.AsyncSheetsClient, mocker: MockFixture
+):
+    # All spreadsheets are requested at once
+    barrier = threading.Barrier(3, timeout=2)
+    error = RuntimeError('Test Exception')
+
+    def get_bootstrap(spreadsheet_id):
+        barrier.wait()
+        if spreadsheet_id == 'bad':
+            raise error
+        return {'names': {}, 'categories': [spreadsheet_id]}
+
+    mocker.patch(
+        PATH.format('google_sheets.get_bootstrap'), side_effect=get_bootstrap
+    )
+    results = run(client.bootstraps(['a', 'bad', 'c']))
+    assert results == {
+        'a': {'names': {}, 'categories': ['a']},
+        'bad': error,
+        'c': {'names': {}, 'categories': ['c']},
+    }
+
+
+def test_cancel(client: async_sheets.AsyncSheetsClient, mocker: MockFixture):
+    started = threading.Event()
+    tokens = []
+
+    def read_sheet(spreadsheet_id, sheet_range):
+        tokens.append(cancel.current())
+        started.set()
+        cancel.sleep(10)
+
+    mocker.patch(
+        PATH.format('google_sheets.read_sheet'), side_effect=read_sheet
+    )
+
+    async def main():
+        task = asyncio.ensure_future(client.get('abc123', 'A1'))
+        await asyncio.get_event_loop().run_in_executor(None, started.wait, 2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    run(main())
+    assert tokens[0].canceled
+
+
+def test_context_manager(mocker: MockFixture):
+    async def main():
+        async with async_sheets.AsyncSheetsClient() as client:
+            mock_close = mocker.patch.object(client, 'close')
+        mock_close.assert_called_once_with()
+
+    run(main())
+
+
+def test_max_workers(mocker: MockFixture):
+    shared = google_sheets.HttpPool(
+        lambda: mocker.Mock(connections={}), 2, 60
+    )
+    mocker.patch.object(google_sheets, '_http_pool', shared)
+    client = async_sheets.AsyncSheetsClient(max_workers=8)
+    assert client.max_workers == 8
+    # More requests at once than the shared pool allows
+    barrier = threading.Barrier(8, timeout=2)
+
+    def read_sheet(spreadsheet_id, sheet_range):
+        pool = google_sheets.http_pool()
+        with pool.connection():
+            barrier.wait()
+        return pool
+
+    mocker.patch(PATH.format('google_sheets.read_sheet'), read_sheet)
+
+    async def get_all():
+        return await asyncio.gather(
+            *[client.get('abc123', f'A{i}') for i in range(8)]
+        )
+
+    pools = run(get_all())
+    client.close()
+    assert len(set(pools)) == 1
+    assert pools[0] is not shared
+    assert google_sheets.http_pool() is shared
@@ -0,0 +1,40 @@
+from pathlib import Path
+
+from py._path.local import LocalPath
+import pytest
+
+from benchmarks import harness
+from benchmarks.__main__ import main
+from benchmarks.harness import Result
+
+
+def test_quick(capsys: pytest.CaptureFixture):
+    assert main(['--quick']) == 0
+    output = capsys.readouterr().out
+    names = [bench.name for bench in harness.benchmarks()]
+    assert names
+    for name in names:
+        assert name in output
+
+
+def test_baselines(tmpdir: LocalPath):
+    path = harness.baselines_path('ci')
+    assert path == harness.BASELINES_DIR / 'ci.json'
+    path = Path(tmpdir) / 'baselines' / 'ci.json'
+    assert harness.load_baselines(path) == {}
+    harness.save_baselines([Result('tick', 0.5, None)], path)
+    assert harness.load_baselines(path) == {'tick': 0.5}
+
+
+def test_machine(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv(harness.MACHINE_ENV, 'travis')
+    assert harness.machine() == 'travis'
+    assert harness.baselines_path().name == 'travis.json'
+
+
+def test_regressed():
+    assert not harness.regressed(Result('a', 1.0, None))
+    assert harness.regressed(Result('a', 1.0, 0.5))
+    assert not harness.regressed(Result('a', 1.0, 0.8))
+    # Slower by more than half, but by less than the noise floor
+    assert not harness.regressed(Result('a', 100e-6, 50e-6))
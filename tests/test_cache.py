@@ -0,0 +1,51 @@
+import os
+
+from py._path.local import LocalPath
+import pytest
+from pytest_mock.plugin import MockFixture
+
+from usc_lr_timer import cache, constants
+
+DATA = {'names': {'a': '1'}, 'categories': ['x']}
+
+
+def test_data_dir(data_dir: LocalPath):
+    assert not data_dir.exists()
+    assert str(constants.data_dir()) == str(data_dir)
+    assert data_dir.isdir()
+
+
+def test_load_missing():
+    assert cache.load('abc123') == (None, False)
+
+
+def test_save_load(data_dir: LocalPath):
+    cache.save('abc123', DATA)
+    assert data_dir.join('cache', 'abc123.json').isfile()
+    assert not data_dir.join('cache', 'abc123.tmp').exists()
+    assert cache.load('abc123') == (DATA, True)
+    assert cache.load('xyz789') == (None, False)
+
+
+@pytest.mark.skipif(os.name == 'nt', reason='POSIX permissions')
+def test_save_private(data_dir: LocalPath):
+    data_dir.join('cache').ensure(dir=True).chmod(0o755)
+    cache.save('abc123', DATA)
+    assert data_dir.join('cache').stat().mode & 0o777 == 0o700
+    assert data_dir.join('cache', 'abc123.json').stat().mode & 0o777 == 0o600
+
+
+def test_load_stale(mocker: MockFixture):
+    mock_time = mocker.patch('usc_lr_timer.cache.time.time')
+    mock_time.return_value = 1000
+    cache.save('abc123', DATA)
+    mock_time.return_value = 1000 + cache.CACHE_TTL + 1
+    assert cache.load('abc123') == (DATA, False)
+    assert cache.load('abc123', ttl=cache.CACHE_TTL * 2) == (DATA, True)
+
+
+def test_load_corrupt(data_dir: LocalPath):
+    data_dir.join('cache', 'abc123.json').write('{"saved', ensure=True)
+    assert cache.load('abc123') == (None, False)
+    data_dir.join('cache', 'abc123.json').write('{"data": {}}')
+    assert cache.load('abc123') == (None, False)
@@ -0,0 +1,77 @@
+import threading
+import time
+
+import pytest
+from pytest_mock.plugin import MockFixture
+
+from usc_lr_timer import cancel
+
+
+def test_cancel_token(mocker: MockFixture):
+    token = cancel.CancelToken()
+    assert not token.canceled
+    token.check()
+    callback = mocker.Mock()
+    with token.on_cancel(callback):
+        token.cancel()
+        callback.assert_called_once_with()
+    assert token.canceled
+    token.cancel()
+    callback.assert_called_once_with()
+    with pytest.raises(cancel.Canceled) as info:
+        token.check(sent=True)
+    assert info.value.sent
+    with pytest.raises(cancel.Canceled):
+        with token.on_cancel(callback):
+            pass
+
+
+def test_cancel_token_callback_removed(mocker: MockFixture):
+    token = cancel.CancelToken()
+    callback = mocker.Mock()
+    with token.on_cancel(callback):
+        pass
+    token.cancel()
+    callback.assert_not_called()
+
+
+def test_cancel_token_timeout():
+    token = cancel.CancelToken(timeout=0.05)
+    assert not token.canceled
+    start = time.monotonic()
+    with pytest.raises(cancel.Canceled):
+        token.sleep(10)
+    assert time.monotonic() - start < 1
+    assert token.canceled
+
+
+def test_cancel_token_sleep():
+    token = cancel.CancelToken()
+    threading.Timer(0.05, token.cancel).start()
+    start = time.monotonic()
+    with pytest.raises(cancel.Canceled) as info:
+        token.sleep(10)
+    assert time.monotonic() - start < 1
+    assert not info.value.sent
+
+
+def test_bind(mocker: MockFixture):
+    assert cancel.current() is None
+    cancel.check()
+    mock_sleep = mocker.patch('usc_lr_timer.cancel.time.sleep')
+    cancel.sleep(1)
+    mock_sleep.assert_called_once_with(1)
+    token = cancel.CancelToken()
+    with cancel.bind(token):
+        assert cancel.current() is token
+        other = cancel.CancelToken()
+        with cancel.bind(other):
+            assert cancel.current() is other
+        assert cancel.current() is token
+        token.cancel()
+        with pytest.raises(cancel.Canceled):
+            cancel.check()
+        with pytest.raises(cancel.Canceled):
+            cancel.sleep(1)
+    assert cancel.current() is None
+    mock_sleep.assert_called_once_with(1)
@@ -0,0 +1,146 @@
+from datetime import timedelta
+import json
+
+from py._path.local import LocalPath
+import pytest
+from pytest_mock.plugin import MockFixture
+
+from usc_lr_timer import checkpoint
+from usc_lr_timer.checkpoint import Checkpointer
+from usc_lr_timer.model import Model
+
+PATH = 'usc_lr_timer.checkpoint.{}'
+
+
+@pytest.fixture
+def state() -> dict:
+    return {
+        'spreadsheet_id': 'abc123',
+        'name': 'Vincent',
+        'duration': 65.0,
+        'running': False,
+        'started': None,
+        'semester': 'Spring',
+        'category': 'testing',
+    }
+
+
+@pytest.fixture
+def path(data_dir: LocalPath) -> LocalPath:
+    data_dir.ensure(dir=True)
+    return LocalPath(checkpoint._checkpoint_file('abc123', 'Vincent'))
+
+
+@pytest.fixture
+def mock_fsync(mocker: MockFixture):
+    return mocker.patch(PATH.format('os.fsync'))
+
+
+def test_save_load(path: LocalPath, state: dict, mock_fsync):
+    assert checkpoint.load('abc123', 'Vincent') is None
+    checkpoint.save(state)
+    mock_fsync.assert_not_called()
+    assert path.isfile()
+    assert not path.new(ext='.tmp').exists()
+    loaded = checkpoint.load('abc123', 'Vincent')
+    assert loaded.pop('saved')
+    assert loaded == state
+    checkpoint.save(state, sync=True)
+    mock_fsync.assert_called_once()
+    # Somebody else's time isn't theirs to submit
+    assert checkpoint.load('abc123', 'Pat') is None
+    assert checkpoint.load('def456', 'Vincent') is None
+    checkpoint.clear('abc123', 'Vincent')
+    assert not path.exists()
+    assert checkpoint.load('abc123', 'Vincent') is None
+    checkpoint.clear('abc123', 'Vincent')
+
+
+def test_users_sharing_a_machine(path: LocalPath, state: dict):
+    checkpoint.save(state)
+    other = dict(state, name='Pat', duration=10.0)
+    checkpoint.save(other)
+    assert checkpoint.load('abc123', 'Pat')['duration'] == 10.0
+    # Pat resetting their timer doesn't touch Vincent's checkpoint
+    checkpoint.clear('abc123', 'Pat')
+    assert checkpoint.load('abc123', 'Pat') is None
+    assert checkpoint.load('abc123', 'Vincent')['duration'] == 65.0
+
+
+def test_load_corrupt(path: LocalPath, state: dict):
+    path.write('{"spreadsheet_id')
+    assert checkpoint.load('abc123', 'Vincent') is None
+    path.write('{"name": "Vincent"}')
+    assert checkpoint.load('abc123', 'Vincent') is None
+    # Running, but without the times to count it up
+    path.write(json.dumps(dict(state, running=True, started=1000.0)))
+    assert checkpoint.load('abc123', 'Vincent') is None
+    path.write(json.dumps(dict(state, running=True, started=None, saved=1.0)))
+    assert checkpoint.load('abc123', 'Vincent') is None
+
+
+def test_load_running(path: LocalPath, state: dict):
+    state.update(running=True, started=1000.0, saved=1030.0)
+    path.write(json.dumps(state))
+    # Only the time up to the last checkpoint counts
+    loaded = checkpoint.load('abc123', 'Vincent')
+    assert loaded['duration'] == 95.0
+    assert not loaded['running']
+
+
+class TestCheckpointer:
+    @pytest.fixture
+    def checkpointer(self, model: Model, data_dir: LocalPath, mock_fsync):
+        data_dir.ensure(dir=True)
+        return Checkpointer(model)
+
+    def test_restore(self, checkpointer: Checkpointer, model: Model, state):
+        assert not checkpointer.restore()
+        checkpoint.save(state)
+        assert checkpointer.restore()
+        assert model.duration == timedelta(seconds=65)
+        assert model.semester == 'Spring'
+
+    def test_start_stop(
+        self,
+        checkpointer: Checkpointer,
+        model: Model,
+        path: LocalPath,
+        mock_fsync,
+    ):
+        model.start_timer()
+        checkpointer.start()
+        assert checkpointer.active
+        assert mock_fsync.call_count == 1
+        loaded = checkpoint.load('abc123', 'Vincent')
+        assert loaded['duration'] >= 0
+        # Between syncs the file is only replaced
+        checkpointer.checkpoint()
+        assert mock_fsync.call_count == 1
+        model.pause_timer()
+        checkpointer.stop()
+        assert not checkpointer.active
+        assert mock_fsync.call_count == 2
+        assert path.isfile()
+        model.reset_duration()
+        checkpointer.checkpoint(sync=True)
+        assert not path.exists()
+
+    def test_sync_interval(
+        self,
+        checkpointer: Checkpointer,
+        model: Model,
+        mock_fsync,
+        mocker: MockFixture,
+    ):
+        mock_monotonic = mocker.patch(PATH.format('time.monotonic'))
+        mock_monotonic.return_value = 1000.0
+        model.start_timer()
+        checkpointer.checkpoint()
+        assert mock_fsync.call_count == 1
+        mock_monotonic.return_value = 1000.0 + checkpoint.SYNC_INTERVAL - 1
+        checkpointer.checkpoint()
+        assert mock_fsync.call_count == 1
+        mock_monotonic.return_value = 1000.0 + checkpoint.SYNC_INTERVAL
+        checkpointer.checkpoint()
+        assert mock_fsync.call_count == 2
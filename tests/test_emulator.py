@@ -0,0 +1,279 @@
+from datetime import timedelta
+import gzip
+import json
+import threading
+import time
+from urllib.request import Request, urlopen
+
+from googleapiclient.errors import HttpError
+import pytest
+from pytest_mock.plugin import MockFixture
+
+from usc_lr_timer import cancel, emulator, google_sheets, retry
+from usc_lr_timer.emulator import (
+    Emulator,
+    EmulatorHttp,
+    Faults,
+    mask,
+    parse_range,
+    Range,
+    SheetsBackend,
+    SheetsError,
+)
+from usc_lr_timer.rate_limit import RateLimiter
+
+PATH = 'usc_lr_timer.emulator.{}'
+
+
+@pytest.fixture
+def backend() -> SheetsBackend:
+    backend = SheetsBackend()
+    backend.create(
+        'abc123',
+        names={'Vincent': '1234', 'Pat': '0000'},
+        categories=['Cite checking', 'Editing'],
+    )
+    return backend
+
+
+@pytest.fixture
+def server(backend: SheetsBackend, mocker: MockFixture):
+    mocker.patch.object(
+        google_sheets, '_rate_limiter', RateLimiter(sleep=lambda _: None)
+    )
+    with Emulator(backend) as server:
+        google_sheets.configure_endpoint(server.url)
+        yield server
+    google_sheets.configure_endpoint(None)
+
+
+def test_parse_range():
+    assert parse_range('Names!A2:B') == Range('Names', 1, 0, None, 2)
+    ids = Range('Submissions', 1, 5, None, 6)
+    assert parse_range('Submissions!F2:F') == ids
+    assert parse_range('Submissions') == Range('Submissions', 0, 0, None, None)
+    assert parse_range('Names!B3') == Range('Names', 2, 1, 3, 2)
+    quoted = Range('My Sheet', 0, 26, None, 28)
+    assert parse_range("'My Sheet'!AA1:AB") == quoted
+    with pytest.raises(SheetsError):
+        parse_range('Names!A-1')
+
+
+def test_get(backend: SheetsBackend):
+    result = backend.get('abc123', 'Names!A2:B')
+    assert result == {
+        'range': 'Names!A2:B',
+        'majorDimension': 'ROWS',
+        'values': [['Vincent', '1234'], ['Pat', '0000']],
+    }
+    result = backend.get('abc123', 'Categories!A2:A', 'COLUMNS')
+    assert result['values'] == [['Cite checking', 'Editing']]
+    # Empty ranges have no values
+    assert 'values' not in backend.get('abc123', 'Submissions!A2:F')
+    with pytest.raises(SheetsError) as error:
+        backend.get('xyz789', 'Names!A2:B')
+    assert error.value.code == 404
+    with pytest.raises(SheetsError) as error:
+        backend.get('abc123', 'Nope!A2:B')
+    assert error.value.code == 400
+
+
+def test_batch_get(backend: SheetsBackend):
+    result = backend.batch_get('abc123', ['Names!A3:A', 'Categories!A2:A'])
+    assert result['spreadsheetId'] == 'abc123'
+    assert [value_range['values'] for value_range in result['valueRanges']] == [
+        [['Pat']],
+        [['Cite checking'], ['Editing']],
+    ]
+
+
+def test_append(backend: SheetsBackend):
+    result = backend.append('abc123', 'Submissions', [['a', 'b'], ['c']])
+    assert result['updates']['updatedRange'] == 'Submissions!A2:B3'
+    assert result['updates']['updatedRows'] == 2
+    assert result['updates']['updatedCells'] == 3
+    backend.append('abc123', 'Submissions', [['d']])
+    rows = backend.rows('abc123', 'Submissions')
+    assert rows[1:] == [['a', 'b'], ['c'], ['d']]
+
+
+def test_mask(backend: SheetsBackend):
+    result = backend.append('abc123', 'Submissions', [['a', 'b']])
+    updated_rows = {'updates': {'updatedRows': 1}}
+    assert mask(result, 'updates/updatedRows') == updated_rows
+    assert mask(result, 'spreadsheetId,updates(updatedRows,updatedCells)') == {
+        'spreadsheetId': 'abc123',
+        'updates': {'updatedRows': 1, 'updatedCells': 2},
+    }
+    result = backend.batch_get('abc123', ['Names!A3:A', 'Submissions!F2:F'])
+    assert mask(result, 'valueRanges/values') == {
+        'valueRanges': [{'values': [['Pat']]}, {}]
+    }
+    with pytest.raises(SheetsError):
+        mask(result, 'valueRanges(values')
+
+
+def test_faults(mocker: MockFixture):
+    faults = Faults(latency=0.5, jitter=0.25, quota=2, seed=1)
+    assert 0.5 <= faults.delay() <= 0.75
+    assert not faults.throttled(now=100.0)
+    assert not faults.throttled(now=101.0)
+    assert faults.throttled(now=102.0)
+    assert not faults.throttled(now=100.0 + emulator.QUOTA_WINDOW)
+    assert not Faults(error_rate=0).fail()
+    assert Faults(error_rate=1).fail()
+    assert Faults(late_error_rate=1).fail_late()
+
+
+def test_handle(backend: SheetsBackend):
+    server = Emulator(backend)
+    path = '/v4/spreadsheets/abc123/values/Names%21A2%3AA'
+    status, result = server.handle('GET', path, {}, b'')
+    assert status == 200
+    assert result['values'] == [['Vincent'], ['Pat']]
+    path = '/v4/spreadsheets/abc123/values/Submissions:append'
+    body = json.dumps({'values': [['x']]}).encode()
+    status, result = server.handle('POST', path, {}, body)
+    assert status == 400
+    query = {'valueInputOption': ['RAW']}
+    status, result = server.handle('POST', path, query, body)
+    assert status == 200
+    server.faults = Faults(quota=0)
+    status, result = server.handle('GET', path, {}, b'')
+    assert status == 429
+    assert result['error']['status'] == 'RESOURCE_EXHAUSTED'
+    server.faults = Faults(late_error_rate=1)
+    status, result = server.handle('POST', path, query, body)
+    assert status == 503
+    # The row was written even though the response says it wasn't
+    assert backend.rows('abc123', 'Submissions')[-2:] == [['x'], ['x']]
+    assert server.stats == {'requests': 5, 'throttled': 1, 'errors': 1}
+    with pytest.raises(RuntimeError):
+        server.url
+
+
+def test_handle_fields(backend: SheetsBackend):
+    server = Emulator(backend)
+    path = '/v4/spreadsheets/abc123/values/Names%21A2%3AA'
+    status, result = server.handle('GET', path, {'fields': ['values']}, b'')
+    assert status == 200
+    assert result == {'values': [['Vincent'], ['Pat']]}
+
+
+def test_gzip(server: Emulator):
+    url = f'{server.url}/v4/spreadsheets/abc123/values/Names%21A2%3AA'
+    request = Request(url, headers={'Accept-Encoding': 'gzip, deflate'})
+    with urlopen(request) as response:
+        assert response.headers['Content-Encoding'] == 'gzip'
+        result = json.loads(gzip.decompress(response.read()))
+    assert result['values'] == [['Vincent'], ['Pat']]
+    with urlopen(url) as response:
+        assert response.headers['Content-Encoding'] is None
+        assert json.load(response)['values'] == [['Vincent'], ['Pat']]
+
+
+def test_google_sheets(server: Emulator, backend: SheetsBackend):
+    bootstrap = google_sheets.get_bootstrap('abc123')
+    assert bootstrap == {
+        'names': {'Vincent': '1234', 'Pat': '0000'},
+        'categories': ['Cite checking', 'Editing'],
+    }
+    row = google_sheets.time_row(
+        'Vincent', 'Fall', timedelta(hours=1), 'Editing', 'id1'
+    )
+    result = google_sheets.add_submissions('abc123', [row])
+    assert result == {'updates': {'updatedRows': 1}}
+    assert backend.rows('abc123', 'Submissions')[1] == row
+    assert google_sheets.get_submission_ids('abc123') == {'id1'}
+    assert server.stats['requests'] == 3
+
+
+def test_deduplicate_other_writer(
+    server: Emulator, backend: SheetsBackend, mocker: MockFixture
+):
+    mocker.patch.object(
+        google_sheets, '_submission_index', google_sheets.SubmissionIndex()
+    )
+    mine, theirs = [
+        google_sheets.time_row(
+            'Vincent', 'Fall', timedelta(hours=1), 'Editing', submission_id
+        )
+        for submission_id in ['mine', 'theirs']
+    ]
+    google_sheets.add_submissions('abc123', [mine], deduplicate=True)
+    # Another app instance appends its row, then this one takes it over
+    backend.append('abc123', 'Submissions!A:F', [theirs])
+    google_sheets.add_submissions('abc123', [theirs], deduplicate=True)
+    ids = [row[-1] for row in backend.rows('abc123', 'Submissions')[1:]]
+    assert ids == ['mine', 'theirs']
+
+
+def test_cancel_append_in_flight(server: Emulator, backend: SheetsBackend):
+    # Build the service first so the append is on the wire when canceled
+    google_sheets.get_names('abc123')
+    server.faults = Faults(latency=0.5)
+    token = cancel.CancelToken()
+    threading.Timer(0.2, token.cancel).start()
+    with pytest.raises(cancel.Canceled) as error, cancel.bind(token):
+        google_sheets.add_time(
+            'abc123', 'Vincent', 'Fall', timedelta(hours=1), 'Editing', 'id1'
+        )
+    assert error.value.sent
+    # The emulator finishes the append it got, and only that one
+    time.sleep(0.6)
+    assert server.stats['requests'] == 2
+    assert len(backend.rows('abc123', 'Submissions')) == 2
+
+
+def test_google_sheets_errors(server: Emulator, mocker: MockFixture):
+    policy = retry.RetryPolicy(max_attempts=1)
+    mocker.patch.object(google_sheets, '_retry_policy', policy)
+    server.faults = Faults(quota=0)
+    with pytest.raises(HttpError) as error:
+        google_sheets.get_names('abc123')
+    assert error.value.resp.status == 429
+    server.faults = Faults()
+    with pytest.raises(HttpError) as error:
+        google_sheets.get_names('xyz789')
+    assert error.value.resp.status == 404
+
+
+def test_emulator_http(backend: SheetsBackend, mocker: MockFixture):
+    mocker.patch.object(
+        google_sheets, '_rate_limiter', RateLimiter(sleep=lambda _: None)
+    )
+    server = Emulator(backend)
+    google_sheets.configure_endpoint('http://emulator')
+    google_sheets.configure_http_pool(factory=lambda: EmulatorHttp(server))
+    try:
+        categories = google_sheets.get_categories('abc123')
+        assert categories == ['Cite checking', 'Editing']
+        with pytest.raises(HttpError) as error:
+            google_sheets.get_names('xyz789')
+        assert error.value.resp.status == 404
+        assert server.stats['requests'] == 2
+    finally:
+        google_sheets.configure_endpoint(None)
+        google_sheets.configure_http_pool()
+
+
+def test_main(mocker: MockFixture, capsys: pytest.CaptureFixture):
+    servers = []
+
+    def serve_forever(server: Emulator):
+        servers.append(server)
+        raise KeyboardInterrupt
+
+    mocker.patch.object(
+        Emulator, 'serve_forever', autospec=True, side_effect=serve_forever
+    )
+    emulator.main(['--port', '0', '--spreadsheet', 'abc123'])
+    (server,) = servers
+    try:
+        # Bound before the address is printed
+        out = capsys.readouterr().out
+        assert out == f'Serving abc123 at {server.url}\n'
+    finally:
+        server.stop()
+    with pytest.raises(RuntimeError):
+        server.url
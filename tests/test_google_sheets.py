@@ -1,18 +1,36 @@
 from datetime import timedelta
+import json
+import socket
+import threading
+import time
 from unittest.mock import Mock
 
 from freezegun import freeze_time
 from google.oauth2.service_account import Credentials
+from googleapiclient.errors import HttpError
+import httplib2
+from py._path.local import LocalPath
 import pytest
 from pytest_mock.plugin import MockFixture
 
-from usc_lr_timer import google_sheets
+from usc_lr_timer import cancel, google_sheets, metrics, retry
+from usc_lr_timer.rate_limit import RateLimiter
 
 PATH = 'usc_lr_timer.google_sheets.{}'
 
 
 @pytest.fixture
-def mock_values(mocker: MockFixture):
+def mock_pool(mocker: MockFixture):
+    pool = google_sheets.HttpPool(lambda: mocker.Mock(connections={}), 2, 60)
+    mocker.patch(PATH.format('_http_pool'), pool)
+    return pool
+
+
+@pytest.fixture
+def mock_values(mocker: MockFixture, mock_pool: google_sheets.HttpPool):
+    mocker.patch(
+        PATH.format('_rate_limiter'), RateLimiter(sleep=lambda _: None),
+    )
     mock_values = mocker.NonCallableMock()
     mocker.patch(
         PATH.format('get_spreadsheets_values'), return_value=mock_values,
@@ -22,7 +40,7 @@ def mock_values(mocker: MockFixture):
 
 def test_get_credentials(mocker: MockFixture):
     mock_from_service_account_file = mocker.patch(
-        PATH.format('service_account.Credentials.from_service_account_file')
+        'google.oauth2.service_account.Credentials.from_service_account_file'
     )
     google_sheets.get_credentials()
     mock_from_service_account_file.assert_called_once_with(
@@ -31,24 +49,383 @@ def test_get_credentials(mocker: MockFixture):
     )
 
 
-def test_get_spreadsheets_values(mocker: MockFixture):
+@pytest.fixture
+def mock_build(mocker: MockFixture):
     mock_creds = mocker.create_autospec(Credentials, instance=True)
     mocker.patch(PATH.format('get_credentials'), return_value=mock_creds)
-    mock_resource = mocker.NonCallableMock()
-    mock_build = mocker.patch(PATH.format('build'), return_value=mock_resource)
-    mock_values = mock_resource.spreadsheets().values()
-    values = google_sheets.get_spreadsheets_values()
-    assert values is mock_values
-    mock_build.assert_called_once_with('sheets', 'v4', credentials=mock_creds)
+    mock_build = mocker.patch(
+        'googleapiclient.discovery.build_from_document',
+        side_effect=lambda *a, **k: mocker.Mock(),
+    )
+    google_sheets.invalidate_services()
+    yield mock_build
+    google_sheets.invalidate_services()
+
+
+def test_get_discovery_document():
+    document = google_sheets.get_discovery_document()
+    assert document['name'] == 'sheets'
+    assert document['version'] == 'v4'
+    assert 'values' in document['resources']['spreadsheets']['resources']
+    assert google_sheets.get_discovery_document() is document
+
+
+def test_check_discovery_document(mocker: MockFixture):
+    pinned = google_sheets.get_discovery_document()['revision']
+    mock_urlopen = mocker.patch(PATH.format('urlopen'))
+    response = mock_urlopen.return_value.__enter__.return_value
+    response.read.return_value = json.dumps({'revision': pinned})
+    assert google_sheets.check_discovery_document() == (True, pinned, pinned)
+    mock_urlopen.assert_called_once_with(
+        google_sheets.DISCOVERY_URL, timeout=10,
+    )
+    response.read.return_value = json.dumps({'revision': '99999999'})
+    result = google_sheets.check_discovery_document()
+    assert result == (False, pinned, '99999999')
+
+
+def test_get_service(mock_build: Mock):
+    service = google_sheets.get_service('abc123')
+    assert google_sheets.get_service('abc123') is service
+    assert google_sheets.get_service('xyz789') is not service
+    mock_build.assert_called_with(
+        google_sheets.get_discovery_document(),
+        credentials=google_sheets.get_credentials(),
+    )
+    assert mock_build.call_count == 2
+
+
+def test_warm_up(mock_build: Mock):
+    google_sheets.warm_up()
+    mock_build.assert_called_once()
+    google_sheets.get_service()
+    mock_build.assert_called_once()
+
+
+def test_invalidate_services(mock_build: Mock):
+    service = google_sheets.get_service('abc123')
+    other = google_sheets.get_service('xyz789')
+    google_sheets.invalidate_services('abc123')
+    assert google_sheets.get_service('abc123') is not service
+    assert google_sheets.get_service('xyz789') is other
+    google_sheets.invalidate_services()
+    assert google_sheets.get_service('xyz789') is not other
 
 
-def test_read_sheet(mocker: MockFixture, mock_values: Mock):
+def test_get_spreadsheets_values(mock_build: Mock):
+    values = google_sheets.get_spreadsheets_values('abc123')
+    service = google_sheets.get_service('abc123')
+    assert values is service.spreadsheets().values()
+    # The resource is built once per service
+    service.spreadsheets.reset_mock()
+    assert google_sheets.get_spreadsheets_values('abc123') is values
+    service.spreadsheets.assert_not_called()
+    google_sheets.invalidate_services('abc123')
+    assert google_sheets.get_spreadsheets_values('abc123') is not values
+
+
+def test_authorized_http(mocker: MockFixture):
+    mock_creds = mocker.create_autospec(Credentials, instance=True)
+    mocker.patch(PATH.format('get_credentials'), return_value=mock_creds)
+    http = google_sheets._authorized_http()
+    assert http.credentials is mock_creds
+    assert http.http.timeout == google_sheets.REQUEST_TIMEOUT
+    assert google_sheets._authorized_http() is not http
+
+
+def test_http_pool_reuse(mocker: MockFixture):
+    factory = mocker.Mock(side_effect=lambda: mocker.Mock(connections={}))
+    pool = google_sheets.HttpPool(factory, 2, 60)
+    assert pool.size == 2
+    assert pool.idle_timeout == 60
+    with pool.connection() as http:
+        assert pool.idle_count == 0
+    assert pool.idle_count == 1
+    with pool.connection() as other:
+        assert other is http
+    with pool.connection() as first, pool.connection() as second:
+        assert first is not second
+    assert factory.call_count == 2
+    assert pool.idle_count == 2
+
+
+def test_http_pool_abort(mocker: MockFixture):
+    connection = mocker.Mock()
+    http = mocker.Mock(connections={'https:sheets': connection})
+    pool = google_sheets.HttpPool(mocker.Mock(side_effect=[http, 'new']), 1, 60)
+    google_sheets.HttpPool.abort(http)
+    connection.sock.shutdown.assert_called_once_with(socket.SHUT_RDWR)
+    connection.close.assert_not_called()
+    # httplib2 must not send the request again on a new socket
+    with pytest.raises(cancel.Canceled) as error:
+        connection.connect()
+    assert error.value.sent
+    # An aborted transport is closed instead of going back to the pool
+    with pytest.raises(cancel.Canceled):
+        with pool.connection():
+            raise cancel.Canceled(sent=True)
+    connection.close.assert_called_once_with()
+    assert pool.idle_count == 0
+    with pool.connection() as other:
+        assert other == 'new'
+
+
+def test_http_pool_size(mocker: MockFixture):
+    pool = google_sheets.HttpPool(mocker.Mock, 2, 60)
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def work():
+        with pool.connection():
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            time.sleep(0.05)
+            with lock:
+                active.pop()
+
+    threads = [threading.Thread(target=work) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(peak) == 2
+    with pytest.raises(ValueError):
+        google_sheets.HttpPool(mocker.Mock, 0, 60)
+
+
+def test_http_pool_idle_timeout(mocker: MockFixture):
+    connection = mocker.Mock()
+    http = mocker.Mock(connections={'https:sheets': connection})
+    pool = google_sheets.HttpPool(mocker.Mock(side_effect=[http, 'new']), 1, 5)
+    mock_monotonic = mocker.patch(PATH.format('time.monotonic'))
+    mock_monotonic.return_value = 100
+    with pool.connection():
+        pass
+    mock_monotonic.return_value = 106
+    with pool.connection() as new_http:
+        assert new_http == 'new'
+    connection.close.assert_called_once_with()
+    assert http.connections == {}
+
+
+def test_http_pool_clear(mocker: MockFixture):
+    connection = mocker.Mock()
+    pool = google_sheets.HttpPool(
+        lambda: mocker.Mock(connections={'https:sheets': connection}), 1, 60,
+    )
+    with pool.connection():
+        pass
+    pool.clear()
+    assert pool.idle_count == 0
+    connection.close.assert_called_once_with()
+
+
+def test_http_pool_distinct_transports(mocker: MockFixture):
+    # Concurrent calls must never share an httplib2 transport
+    mocker.patch(PATH.format('get_credentials'))
+    pool = google_sheets.HttpPool(google_sheets._new_http, 2, 60)
+    with pool.connection() as first, pool.connection() as second:
+        assert first is not second
+        assert first.http is not second.http
+
+
+def test_configure_http_pool(mocker: MockFixture, mock_pool):
+    pool = google_sheets.configure_http_pool(size=8, idle_timeout=30)
+    assert google_sheets._http_pool is pool
+    assert pool.size == 8
+    assert pool.idle_timeout == 30
+
+
+def test_read_sheet(
+    mocker: MockFixture, mock_values: Mock, mock_pool: google_sheets.HttpPool
+):
     mock_request = mocker.Mock()
     mock_values.get.return_value = mock_request
     mock_request.execute.return_value = {'values': [1, 2, 3]}
     assert google_sheets.read_sheet('abc123', 'A1:A3') == [1, 2, 3]
     mock_values.get.assert_called_with(
-        spreadsheetId='abc123', range='A1:A3',
+        spreadsheetId='abc123',
+        range='A1:A3',
+        majorDimension='ROWS',
+        valueRenderOption='FORMATTED_VALUE',
+        fields='values',
+    )
+    mock_request.execute.assert_called_once_with(http=mocker.ANY)
+    assert mock_pool.idle_count == 1
+
+
+def test_read_sheet_empty(mocker: MockFixture, mock_values: Mock):
+    mock_request = mocker.Mock()
+    mock_values.get.return_value = mock_request
+    mock_request.execute.return_value = {'range': 'A1:A3'}
+    result = google_sheets.read_sheet(
+        'abc123', 'A1:A3', 'COLUMNS', 'UNFORMATTED_VALUE', fields=None
+    )
+    assert result == []
+    mock_values.get.assert_called_with(
+        spreadsheetId='abc123',
+        range='A1:A3',
+        majorDimension='COLUMNS',
+        valueRenderOption='UNFORMATTED_VALUE',
+        fields=None,
+    )
+
+
+def test_read_sheet_metrics(mocker: MockFixture, mock_values: Mock):
+    mock_request = mocker.Mock(body=None)
+    mock_values.get.return_value = mock_request
+    mock_request.execute.side_effect = lambda http: mock_request.postproc(
+        {}, b'{"values": [[1]]}'
+    )
+    mock_request.postproc.return_value = {'values': [[1]]}
+    with metrics.record('get_names') as call:
+        assert google_sheets.read_sheet('abc123', 'A1') == [[1]]
+    assert call.requests == 1
+    assert call.bytes_sent == 0
+    assert call.decoded_bytes_received == 17
+    assert call.spreadsheet_ids == {'abc123'}
+
+
+def test_configure_retry(mocker: MockFixture):
+    policy = retry.RetryPolicy()
+    mocker.patch(PATH.format('_retry_policy'))
+    assert google_sheets.configure_retry(policy) is policy
+    assert google_sheets._retry_policy is policy
+
+
+@pytest.mark.parametrize(
+    'status, calls', [(429, 2), (503, 1)],
+)
+def test_add_row_retry(
+    mocker: MockFixture, mock_values: Mock, status: int, calls: int
+):
+    mocker.patch(
+        PATH.format('_retry_policy'), retry.RetryPolicy(sleep=mocker.Mock()),
+    )
+    mock_request = mocker.Mock()
+    mock_values.append.return_value = mock_request
+    error = HttpError(httplib2.Response({'status': status}), b'{}')
+    mock_request.execute.side_effect = [error, {}]
+    if calls == 1:
+        with pytest.raises(HttpError):
+            google_sheets.add_row('abc123', 'Sheet', [1])
+    else:
+        assert google_sheets.add_row('abc123', 'Sheet', [1]) == {}
+    assert mock_request.execute.call_count == calls
+
+
+def test_read_sheet_retry(mocker: MockFixture, mock_values: Mock):
+    mocker.patch(
+        PATH.format('_retry_policy'), retry.RetryPolicy(sleep=mocker.Mock()),
+    )
+    mock_request = mocker.Mock()
+    mock_values.get.return_value = mock_request
+    error = HttpError(httplib2.Response({'status': 503}), b'{}')
+    mock_request.execute.side_effect = [error, error, {'values': [[1]]}]
+    with metrics.record('get_names') as call:
+        assert google_sheets.read_sheet('abc123', 'A1') == [[1]]
+    assert mock_request.execute.call_count == 3
+    # The bodies of the failed attempts count too
+    assert call.decoded_bytes_received == 4
+
+
+def test_configure_rate_limit(mocker: MockFixture, data_dir: LocalPath):
+    mocker.patch(PATH.format('_rate_limiter'))
+    limiter = google_sheets.configure_rate_limit(rate=2, capacity=4)
+    assert google_sheets._rate_limiter is limiter
+    assert not limiter.shared
+    limiter = google_sheets.configure_rate_limit(shared=True)
+    assert limiter.shared
+    bucket = limiter.bucket('abc123')
+    assert str(bucket.path) == str(data_dir.join('rate_limit', 'abc123.bucket'))
+
+
+def test_execute_rate_limit(mocker: MockFixture, mock_values: Mock):
+    mock_limiter = mocker.patch(PATH.format('_rate_limiter'))
+    mock_request = mocker.Mock()
+    mock_values.get.return_value = mock_request
+    mock_request.execute.return_value = {'values': []}
+    google_sheets.read_sheet('abc123', 'A1')
+    mock_limiter.acquire.assert_called_once_with('abc123')
+
+
+def test_execute_canceled(mocker: MockFixture, mock_values: Mock):
+    mock_request = mocker.Mock()
+    mock_values.get.return_value = mock_request
+    token = cancel.CancelToken()
+    token.cancel()
+    with cancel.bind(token):
+        with pytest.raises(cancel.Canceled) as info:
+            google_sheets.read_sheet('abc123', 'A1')
+    assert not info.value.sent
+    mock_request.execute.assert_not_called()
+
+
+def test_execute_canceled_in_flight(
+    mocker: MockFixture, mock_values: Mock, mock_pool: google_sheets.HttpPool
+):
+    mock_abort = mocker.patch(PATH.format('HttpPool.abort'))
+    mock_request = mocker.Mock()
+    mock_values.get.return_value = mock_request
+    token = cancel.CancelToken()
+
+    def execute(http):
+        token.cancel()
+        mock_abort.assert_called_once_with(http)
+        raise ConnectionResetError
+
+    mock_request.execute.side_effect = execute
+    with cancel.bind(token):
+        with pytest.raises(cancel.Canceled) as info:
+            google_sheets.read_sheet('abc123', 'A1')
+    assert info.value.sent
+    assert isinstance(info.value.__cause__, ConnectionResetError)
+    # Not retried
+    mock_request.execute.assert_called_once()
+    assert mock_pool.idle_count == 0
+
+
+def test_execute_not_canceled(mocker: MockFixture, mock_values: Mock):
+    mock_request = mocker.Mock()
+    mock_values.get.return_value = mock_request
+    mock_request.execute.side_effect = [ValueError, {'values': [[1]]}]
+    with cancel.bind(cancel.CancelToken()):
+        with pytest.raises(ValueError):
+            google_sheets.read_sheet('abc123', 'A1')
+        assert google_sheets.read_sheet('abc123', 'A1') == [[1]]
+
+
+def test_requests_accept_gzip():
+    # Google only compresses responses for user agents that mention gzip
+    google_sheets.configure_endpoint('http://emulator/')
+    try:
+        values = google_sheets.get_spreadsheets_values('abc123')
+        request = values.get(spreadsheetId='abc123', range='A1')
+    finally:
+        google_sheets.configure_endpoint(None)
+    assert 'gzip' in request.headers['accept-encoding']
+    assert 'gzip' in request.headers['user-agent']
+
+
+def test_read_sheets(mocker: MockFixture, mock_values: Mock):
+    mock_request = mocker.Mock()
+    mock_values.batchGet.return_value = mock_request
+    mock_request.execute.return_value = {
+        'valueRanges': [
+            {'range': 'A1:A3', 'values': [[1], [2]]},
+            {'range': 'B1:B3'},
+        ]
+    }
+    result = google_sheets.read_sheets('abc123', ['A1:A3', 'B1:B3'])
+    assert result == [[[1], [2]], []]
+    mock_values.batchGet.assert_called_once_with(
+        spreadsheetId='abc123',
+        ranges=['A1:A3', 'B1:B3'],
+        majorDimension='ROWS',
+        valueRenderOption='FORMATTED_VALUE',
+        fields='valueRanges/values',
     )
 
 
@@ -61,11 +438,29 @@ def test_add_row(mocker: MockFixture, mock_values: Mock):
         spreadsheetId='abc123',
         range='A1:A3',
         valueInputOption='RAW',
+        includeValuesInResponse=False,
+        fields='updates/updatedRows',
         body={'values': [[1, 2, 3]]},
     )
     assert result == {'values': [1, 2, 3]}
 
 
+def test_add_rows(mocker: MockFixture, mock_values: Mock):
+    mock_request = mocker.Mock()
+    mock_values.append.return_value = mock_request
+    mock_request.execute.return_value = {'updates': {}}
+    result = google_sheets.add_rows('abc123', 'Sheet', [[1, 2], [3, 4]])
+    mock_values.append.assert_called_once_with(
+        spreadsheetId='abc123',
+        range='Sheet',
+        valueInputOption='RAW',
+        includeValuesInResponse=False,
+        fields='updates/updatedRows',
+        body={'values': [[1, 2], [3, 4]]},
+    )
+    assert result == {'updates': {}}
+
+
 def test_get_names(mocker: MockFixture, mock_values: Mock):
     mock_request = mocker.Mock()
     mock_values.get.return_value = mock_request
@@ -74,35 +469,213 @@ def test_get_names(mocker: MockFixture, mock_values: Mock):
     }
     assert google_sheets.get_names('abc123') == {'a': '1', 'b': '2', 'c': '3'}
     mock_values.get.assert_called_once_with(
-        spreadsheetId='abc123', range='Names!A2:B',
+        spreadsheetId='abc123',
+        range='Names!A2:B',
+        majorDimension='ROWS',
+        valueRenderOption='FORMATTED_VALUE',
+        fields='values',
     )
 
 
 def test_get_categories(mocker: MockFixture, mock_values: Mock):
     mock_request = mocker.Mock()
     mock_values.get.return_value = mock_request
-    mock_request.execute.return_value = {'values': [['a'], ['b'], ['c']]}
+    mock_request.execute.return_value = {'values': [['a', 'b', '', 'c']]}
     assert google_sheets.get_categories('abc123') == ['a', 'b', 'c']
     mock_values.get.assert_called_once_with(
-        spreadsheetId='abc123', range='Categories!A2:A',
+        spreadsheetId='abc123',
+        range='Categories!A2:A',
+        majorDimension='COLUMNS',
+        valueRenderOption='FORMATTED_VALUE',
+        fields='values',
+    )
+    mock_request.execute.return_value = {'range': 'Categories!A2:A'}
+    assert google_sheets.get_categories('abc123') == []
+
+
+def test_flatten():
+    assert google_sheets._flatten([]) == []
+    assert google_sheets._flatten([['a'], [], ['b', 'c']]) == ['a', 'b', 'c']
+    rows = [[str(i)] for i in range(10000)]
+    assert google_sheets._flatten(rows) == [str(i) for i in range(10000)]
+
+
+def test_get_bootstrap(mocker: MockFixture, mock_values: Mock):
+    mock_request = mocker.Mock()
+    mock_values.batchGet.return_value = mock_request
+    mock_request.execute.return_value = {
+        'valueRanges': [
+            {'values': [['a', '1'], ['b', '2']]},
+            {'values': [['x'], ['y']]},
+            {'values': [['Fall'], ['Spring']]},
+        ]
+    }
+    result = google_sheets.get_bootstrap(
+        'abc123', extra_ranges={'semesters': 'Semesters!A2:A'},
+    )
+    assert result == {
+        'names': {'a': '1', 'b': '2'},
+        'categories': ['x', 'y'],
+        'semesters': [['Fall'], ['Spring']],
+    }
+    mock_values.batchGet.assert_called_once_with(
+        spreadsheetId='abc123',
+        ranges=['Names!A2:B', 'Categories!A2:A', 'Semesters!A2:A'],
+        majorDimension='ROWS',
+        valueRenderOption='FORMATTED_VALUE',
+        fields='valueRanges/values',
+    )
+    mock_request.execute.return_value = {'valueRanges': [{}, {}]}
+    result = google_sheets.get_bootstrap('abc123')
+    assert result == {'names': {}, 'categories': []}
+
+
+@pytest.fixture
+def mock_index(mocker: MockFixture):
+    index = google_sheets.SubmissionIndex()
+    mocker.patch(PATH.format('_submission_index'), index)
+    return index
+
+
+def test_get_submission_ids(mocker: MockFixture):
+    mock_read_sheets = mocker.patch(PATH.format('read_sheets'))
+    mock_read_sheets.return_value = [[['a', '', 'b']]]
+    assert google_sheets.get_submission_ids('abc123') == {'a', 'b'}
+    mock_read_sheets.assert_called_once_with(
+        'abc123', ['Submissions!F2:F'], 'COLUMNS'
+    )
+    mock_read_sheets.return_value = [[]]
+    assert google_sheets.get_submission_ids('abc123') == set()
+
+
+def test_submission_index(mocker: MockFixture):
+    mock_get_ids = mocker.patch(PATH.format('get_submission_ids'))
+    mock_get_ids.return_value = {'a'}
+    index = google_sheets.SubmissionIndex()
+    assert index.known('abc123', ['a', 'b']) == {'a'}
+    assert mock_get_ids.call_count == 1
+    index.add('abc123', ['b'])
+    index.add('xyz789', ['c'])
+    assert index.known('abc123', ['a', 'b']) == {'a', 'b'}
+    assert mock_get_ids.call_count == 1
+
+    # Someone else may have written an id that is not cached
+    mock_get_ids.return_value = {'a', 'b', 'd'}
+    assert index.known('abc123', ['a', 'd']) == {'a', 'd'}
+    assert mock_get_ids.call_count == 2
+    assert index.known('abc123', ['c']) == set()
+    assert mock_get_ids.call_count == 3
+    assert index.known('abc123', ['d']) == {'d'}
+    assert mock_get_ids.call_count == 3
+
+    index.clear()
+    index.known('abc123', ['a'])
+    assert mock_get_ids.call_count == 4
+
+
+@freeze_time('2020-10-24 12:13:14')
+def test_time_row(mocker: MockFixture):
+    mocker.patch(PATH.format('uuid4'), return_value=mocker.Mock(hex='f00'))
+    row = google_sheets.time_row('Vincent', 'Fall', timedelta(days=1), 'x')
+    assert row == ['Vincent', 'Fall', 1.0, '10/24/2020 12:13:14', 'x', 'f00']
+    row = google_sheets.time_row('Vincent', 'Fall', timedelta(), 'x', 'bar')
+    assert row[-1] == 'bar'
+
+
+def test_add_submission(mocker: MockFixture):
+    mock_add_submissions = mocker.patch(PATH.format('add_submissions'))
+    result = google_sheets.add_submission('abc123', [1, 2, 3])
+    mock_add_submissions.assert_called_once_with('abc123', [[1, 2, 3]])
+    assert result is mock_add_submissions.return_value
+
+
+def test_add_submissions(mocker: MockFixture, mock_index: Mock):
+    mock_add_rows = mocker.patch(PATH.format('add_rows'))
+    mock_get_ids = mocker.patch(PATH.format('get_submission_ids'))
+    mock_get_ids.return_value = set()
+    rows = [[1, 2, 3, 4, 5, 'a'], [1, 2, 3, 4, 5, 'b']]
+    result = google_sheets.add_submissions('abc123', rows)
+    mock_add_rows.assert_called_once_with('abc123', 'Submissions', rows)
+    assert result is mock_add_rows.return_value
+    mock_get_ids.assert_not_called()
+    assert mock_index.known('abc123', ['a', 'b']) == set()
+    assert google_sheets.add_submissions('abc123', rows[:1])
+    assert mock_index.known('abc123', ['a', 'b']) == {'a'}
+
+
+def test_add_submissions_deduplicate(mocker: MockFixture, mock_index: Mock):
+    mock_add_rows = mocker.patch(PATH.format('add_rows'))
+    mock_get_ids = mocker.patch(PATH.format('get_submission_ids'))
+    mock_get_ids.return_value = set()
+    rows = [[1, 2, 3, 4, 5, 'a'], [1, 2, 3, 4, 5, 'b']]
+
+    mock_add_rows.side_effect = TimeoutError
+    with pytest.raises(TimeoutError):
+        google_sheets.add_submissions('abc123', rows)
+    mock_get_ids.assert_not_called()
+
+    # Google wrote the first row even though the request timed out
+    mock_get_ids.return_value = {'a'}
+    mock_add_rows.side_effect = None
+    google_sheets.add_submissions('abc123', rows, deduplicate=True)
+    mock_get_ids.assert_called_once_with('abc123')
+    mock_add_rows.assert_called_with('abc123', 'Submissions', rows[1:])
+
+    mock_add_rows.reset_mock()
+    result = google_sheets.add_submissions('abc123', rows, deduplicate=True)
+    assert result == {}
+    mock_add_rows.assert_not_called()
+    assert mock_get_ids.call_count == 1
+
+
+def test_add_submissions_taken_over(mocker: MockFixture, mock_index: Mock):
+    mock_add_rows = mocker.patch(PATH.format('add_rows'))
+    mock_get_ids = mocker.patch(PATH.format('get_submission_ids'))
+    mock_get_ids.return_value = set()
+    google_sheets.add_submissions(
+        'abc123', [[1, 2, 3, 4, 5, 'a']], deduplicate=True
+    )
+    # Another app instance wrote b, this one took the row over after that
+    # instance died before removing it from the outbox
+    mock_get_ids.return_value = {'a', 'b'}
+    mock_add_rows.reset_mock()
+    result = google_sheets.add_submissions(
+        'abc123', [[1, 2, 3, 4, 5, 'b']], deduplicate=True
     )
+    assert result == {}
+    mock_add_rows.assert_not_called()
+    assert mock_get_ids.call_count == 2
 
 
 @freeze_time('2020-10-24 12:13:14')
-def test_add_time(mocker: MockFixture, mock_values: Mock):
+def test_add_time(mocker: MockFixture, mock_values: Mock, mock_index: Mock):
     mock_request = mocker.Mock()
     mock_values.append.return_value = mock_request
     mock_request.execute.return_value = {'values': [1, 2, 3]}
     result = google_sheets.add_time(
-        'abc123', 'Vincent', 'Fall', timedelta(days=1), 'testing',
+        spreadsheet_id='abc123',
+        name='Vincent',
+        semester='Fall',
+        duration=timedelta(days=1),
+        category='testing',
+        submission_id='f00',
     )
     mock_values.append.assert_called_with(
         spreadsheetId='abc123',
         range='Submissions',
         valueInputOption='RAW',
+        includeValuesInResponse=False,
+        fields='updates/updatedRows',
         body={
             'values': [
-                ['Vincent', 'Fall', 1.0, '10/24/2020 12:13:14', 'testing']
+                [
+                    'Vincent',
+                    'Fall',
+                    1.0,
+                    '10/24/2020 12:13:14',
+                    'testing',
+                    'f00',
+                ]
             ]
         },
     )
@@ -0,0 +1,59 @@
+from benchmarks.load import percentile, Report, run, Sample, Shift, UserResult
+from usc_lr_timer.emulator import Emulator, SheetsBackend
+
+
+def test_percentile():
+    assert percentile([], 50) == 0.0
+    values = [4.0, 1.0, 3.0, 2.0]
+    assert percentile(values, 50) == 2.0
+    assert percentile(values, 95) == 4.0
+    assert percentile(values, 0) == 1.0
+
+
+def test_report():
+    results = [
+        UserResult(
+            [Sample('add_submissions', 'success', 0.1, 1, 0)],
+            {200: 1},
+            ['a', 'b'],
+            [],
+        ),
+        UserResult(
+            [Sample('add_submissions', 'error', 0.2, 2, 1)],
+            {429: 1, 503: 1},
+            ['c', 'd', 'e'],
+            ['e'],
+        ),
+    ]
+    report = Report(results, ['z', 'a', 'b', 'b', 'c'], 2.0)
+    assert report.users == 2
+    assert report.submitted == 5
+    assert report.written == 3
+    assert report.duplicates == 1
+    assert report.unsent == 1
+    assert report.lost == 1
+    assert report.requests == 3
+    assert report.errors == 1
+    assert report.throttled == 1
+    assert report.server_errors == 1
+    assert not report.ok
+    assert report.latencies() == {'add_submissions': [0.1, 0.2]}
+    assert '5 submitted, 3 written' in report.text()
+
+
+def test_run():
+    backend = SheetsBackend()
+    backend.create(
+        'load',
+        names={'Editor 0': '0000', 'Editor 1': '0001'},
+        categories=['Cite checking', 'Editing'],
+    )
+    with Emulator(backend) as server:
+        shift = Shift(server.url, 'load', 2.0, 0.5, 30.0, 1.0, 1)
+        report = run(shift, 2, backend)
+    assert report.users == 2
+    assert report.submitted > 0
+    assert report.written == report.submitted
+    assert report.duplicates == 0
+    assert report.unsent == 0
+    assert report.ok
@@ -1,23 +1,27 @@
+from collections.abc import Callable
 import json
 from unittest.mock import Mock
 
 from py._path.local import LocalPath
 import pytest
 from pytest_mock.plugin import MockFixture
+from pytestqt.qtbot import QtBot
 
-from usc_lr_timer.login import LoginDialog, Model
-from usc_lr_timer.talk_to_google import Results
+from usc_lr_timer import cache, google_sheets
+from usc_lr_timer.login import LoginDialog, Model, View
+from usc_lr_timer.talk_to_google import Future, Results
 
 PATH = 'usc_lr_timer.login.{}'
 
 
 @pytest.fixture
-def mock_ttg(mocker: MockFixture):
-    mock_ttg = mocker.patch(
-        PATH.format('talk_to_google.talk_to_google'), autospec=True,
+def mock_submit(mocker: MockFixture, make_future: Callable):
+    mock_submit = mocker.patch(PATH.format('talk_to_google.submit'))
+    mock_submit.return_value = make_future(
+        Results.success,
+        {'names': {'a': '1', 'b': '2'}, 'categories': ['x', 'y']},
     )
-    mock_ttg.return_value = Results.success, [['a', '1'], ['b', '2']]
-    return mock_ttg
+    return mock_submit
 
 
 @pytest.fixture
@@ -34,7 +38,11 @@ def model():
 
 
 @pytest.fixture
-def dialog(model: Model, mock_journals: Mock, mock_ttg: Mock):
+def dialog(
+    model: Model, mock_journals: Mock, mock_submit: Mock, qtbot: QtBot
+):
+    dialog = LoginDialog(model)
+    qtbot.add_widget(dialog)
     return dialog
 
 
@@ -78,13 +86,87 @@ class TestModel(object):
         model._pin = '1234'
         assert model.pin == '1234'
 
-    def test_set_names(self, model: Model, mock_ttg: Mock):
+    def test_categories(self, model: Model):
+        assert model.categories == []
+        model._categories = ['x', 'y']
+        assert model.categories == ['x', 'y']
+        assert model.categories is not model._categories
+
+    def test_set_names(self, model: Model, mock_submit: Mock):
+        # Nothing is fetched here, the view refreshes when this returns False
+        model._journals = ['', 'c', 'd']
+        model._journal_mapping = {'c': 'e', 'd': 'f'}
+        model._journal_index = 1
+        model._set_bootstrap({'names': {'a': '1'}, 'categories': ['x']})
+        assert not model.set_names()
+        assert model.names == []
+        assert model.categories == []
+        model._journal_index = 0
+        assert model.set_names()
+        assert model.names == []
+        mock_submit.assert_not_called()
+
+    def test_set_names_cached(self, model: Model, mock_submit: Mock):
         model._journals = ['', 'c', 'd']
         model._journal_mapping = {'c': 'e', 'd': 'f'}
         model._journal_index = 1
-        model.set_names()
+        cache.save('e', {'names': {'a': '1', 'b': '2'}, 'categories': ['x']})
+        assert model.set_names()
         assert model.names == ['', 'a', 'b']
-        assert model._name_mapping == {'a': '1', 'b': '2'}
+        assert model.categories == ['x']
+        mock_submit.assert_not_called()
+
+    def test_set_names_stale(
+        self, model: Model, mock_submit: Mock, mocker: MockFixture
+    ):
+        model._journals = ['', 'c', 'd']
+        model._journal_mapping = {'c': 'e', 'd': 'f'}
+        model._journal_index = 1
+        cache.save('e', {'names': {'z': '9'}, 'categories': []})
+        mocker.patch(PATH.format('cache.CACHE_TTL'), -1)
+        assert not model.set_names()
+        assert model.names == ['', 'z']
+        mock_submit.assert_not_called()
+
+    def test_refresh_names(
+        self, model: Model, mock_submit: Mock, mocker: MockFixture
+    ):
+        future = mock_submit.return_value = mocker.Mock()
+        model._journals = ['', 'c', 'd']
+        model._journal_mapping = {'c': 'e', 'd': 'f'}
+        model._journal_index = 1
+        model._set_bootstrap({'names': {'a': '1'}, 'categories': ['x']})
+        model.set_name_index(1)
+        callback = mocker.Mock()
+        assert model.refresh_names(callback) is future
+        mock_submit.assert_called_once_with(google_sheets.get_bootstrap, 'e')
+        relay = future.add_done_callback.call_args[0][0]
+
+        relay(Results.error, None)
+        callback.assert_not_called()
+
+        relay(Results.success, {'names': {'a': '1'}, 'categories': ['x']})
+        callback.assert_called_once_with(False)
+
+        result = {'names': {'b': '2', 'a': '1'}, 'categories': ['x']}
+        relay(Results.success, result)
+        callback.assert_called_with(True)
+        assert model.names == ['', 'b', 'a']
+        assert model.name == 'a'
+        assert model.name_index == 2
+        assert cache.load('e') == (result, True)
+
+        relay(Results.success, {'names': {'b': '2'}, 'categories': ['y']})
+        assert model.names == ['', 'b']
+        assert model.categories == ['y']
+        assert model.name_index == 0
+
+        callback.reset_mock()
+        model.set_journal_index(2)
+        relay(Results.success, {'names': {'c': '3'}, 'categories': []})
+        callback.assert_not_called()
+        assert model.names == ['', 'b']
+        assert cache.load('e')[0] == {'names': {'c': '3'}, 'categories': []}
 
     def test_set_journals(self, model: Model, mock_journals: Mock):
         model.set_journals()
@@ -112,3 +194,62 @@ class TestModel(object):
         assert model.login()
         model.set_pin('5678')
         assert not model.login()
+
+
+class TestView(object):
+    def test_set_names_stale(
+        self, view: View, model: Model, mocker: MockFixture
+    ):
+        cache.save('x', {'names': {'a': '1'}, 'categories': []})
+        mocker.patch(PATH.format('cache.CACHE_TTL'), -1)
+        mock_refresh = mocker.patch.object(model, 'refresh_names')
+        view.widget.journals_cb.setCurrentIndex(1)
+        assert view.widget.names_cb.count() == 2
+        mock_refresh.assert_called_once_with(view.names_refreshed)
+
+    def test_set_names_loading(
+        self, view: View, model: Model, mock_submit: Mock
+    ):
+        first = mock_submit.return_value = Future()
+        view.widget.journals_cb.setCurrentIndex(1)
+        names_cb = view.widget.names_cb
+        assert names_cb.count() == 0
+        assert not names_cb.isEnabled()
+        # Switching journals while loading abandons the first request
+        second = mock_submit.return_value = Future()
+        view.widget.journals_cb.setCurrentIndex(2)
+        assert first.status == Results.canceled
+        assert not names_cb.isEnabled()
+        second._resolve(
+            Results.success, {'names': {'a': '1'}, 'categories': ['x']}
+        )
+        assert names_cb.isEnabled()
+        assert names_cb.count() == 2
+        assert model.categories == ['x']
+
+    def test_set_names_error(
+        self, view: View, model: Model, mock_submit: Mock, mocker: MockFixture
+    ):
+        mock_critical = mocker.patch(PATH.format('QtWidgets.QMessageBox'))
+        future = mock_submit.return_value = Future()
+        view.widget.journals_cb.setCurrentIndex(1)
+        future._resolve(Results.error, None, RuntimeError('Offline'))
+        assert view.widget.names_cb.isEnabled()
+        assert view.widget.names_cb.count() == 0
+        mock_critical.critical.assert_called_once_with(
+            view.widget, 'Error', 'Offline'
+        )
+
+    def test_names_refreshed(self, view: View, model: Model):
+        view.widget.journals_cb.setCurrentIndex(1)
+        view.set_name_index(2)
+        view.names_refreshed(False)
+        assert view.widget.names_cb.count() == 3
+        model._set_bootstrap({'names': {'c': '3', 'b': '2'}, 'categories': []})
+        model.set_name_index(2)
+        view.names_refreshed(True)
+        names_cb = view.widget.names_cb
+        items = [names_cb.itemText(i) for i in range(names_cb.count())]
+        assert items == ['', 'c', 'b']
+        assert names_cb.currentIndex() == 2
+        assert model.name == 'b'
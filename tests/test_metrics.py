@@ -0,0 +1,167 @@
+import json
+
+from py._path.local import LocalPath
+import pytest
+from pytest_mock.plugin import MockFixture
+
+from usc_lr_timer import metrics
+from usc_lr_timer.cancel import Canceled
+from usc_lr_timer.metrics import Call, Histogram, Metrics
+
+PATH = 'usc_lr_timer.metrics.{}'
+
+
+@pytest.fixture
+def calls() -> list:
+    calls = []
+    metrics.add_hook(calls.append)
+    yield calls
+    metrics.remove_hook(calls.append)
+
+
+def make_call(method: str = 'get_names', **fields) -> Call:
+    call = Call(method, fields.pop('queued', 0.0))
+    call.status = 'success'
+    for name, value in fields.items():
+        setattr(call, name, value)
+    return call
+
+
+def test_histogram():
+    histogram = Histogram((0.1, 1.0))
+    for value in [0.05, 0.1, 0.5, 2.0]:
+        histogram.observe(value)
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.sum == 2.65
+    assert histogram.count == 4
+    assert histogram.cumulative() == [('0.1', 2), ('1.0', 3), ('+Inf', 4)]
+
+
+def test_record(calls: list, mocker: MockFixture):
+    mock_monotonic = mocker.patch(PATH.format('time.monotonic'))
+    mock_monotonic.side_effect = [10.0, 12.5]
+    assert metrics.current() is None
+    with metrics.record('get_names', queued=0.25) as call:
+        assert metrics.current() is call
+        metrics.count_request('abc123', '{"values": []}', 0.5)
+        metrics.count_retry()
+        metrics.count_request('abc123', None, 0.0)
+        metrics.count_received(b'{}')
+    assert metrics.current() is None
+    assert calls == [call]
+    assert call.method == 'get_names'
+    assert call.status == 'success'
+    assert call.queued == 0.25
+    assert call.duration == 2.5
+    assert call.requests == 2
+    assert call.retries == 1
+    assert call.bytes_sent == 14
+    assert call.decoded_bytes_received == 2
+    assert call.throttled == 0.5
+    assert call.spreadsheet_ids == {'abc123'}
+
+
+def test_record_failed(calls: list):
+    with pytest.raises(Canceled):
+        with metrics.record('get_names'):
+            raise Canceled()
+    with pytest.raises(RuntimeError):
+        with metrics.record('get_names'):
+            raise RuntimeError()
+    assert [call.status for call in calls] == ['canceled', 'error']
+
+
+def test_unbound():
+    # Requests made outside a call are not counted anywhere
+    metrics.count_request('abc123', 'body', 1.0)
+    metrics.count_retry()
+    metrics.count_received(b'{}')
+
+
+def test_metrics():
+    registry = Metrics(buckets=(1.0,))
+    registry(make_call(requests=2, retries=1, bytes_sent=10, duration=0.5))
+    registry(make_call(spreadsheet_ids={'abc123'}, duration=2.0, queued=0.1))
+    registry(make_call('add_submissions', status='canceled'))
+    assert registry.counter('calls_total', method='get_names') == 0
+    success = registry.counter(
+        'calls_total', method='get_names', status='success'
+    )
+    assert success == 2
+    canceled = registry.counter(
+        'calls_total', method='add_submissions', status='canceled'
+    )
+    assert canceled == 1
+    assert registry.counter('requests_total', method='get_names') == 2
+    assert registry.counter('retries_total', method='get_names') == 1
+    assert registry.counter('sent_bytes_total', method='get_names') == 10
+    latency = registry.histogram('call_seconds', method='get_names')
+    assert latency.cumulative() == [('1.0', 1), ('+Inf', 2)]
+    wait = registry.histogram('queue_wait_seconds', method='get_names')
+    assert wait.sum == 0.1
+    by_sheet = registry.histogram(
+        'spreadsheet_call_seconds', spreadsheet_id='abc123'
+    )
+    assert by_sheet.count == 1
+    registry.clear()
+    assert registry.histogram('call_seconds', method='get_names') is None
+
+
+def test_to_json():
+    registry = Metrics(buckets=(1.0,))
+    registry(make_call(duration=0.5))
+    result = registry.to_json()
+    assert result['counters']['calls_total'] == [
+        {'labels': {'method': 'get_names', 'status': 'success'}, 'value': 1}
+    ]
+    assert result['histograms']['call_seconds'] == [
+        {
+            'labels': {'method': 'get_names'},
+            'buckets': {'1.0': 1, '+Inf': 1},
+            'sum': 0.5,
+            'count': 1,
+        }
+    ]
+
+
+def test_to_prometheus():
+    registry = Metrics(buckets=(1.0,))
+    registry(make_call(duration=0.5))
+    lines = registry.to_prometheus().splitlines()
+    assert '# TYPE usc_lr_timer_calls_total counter' in lines
+    total = 'usc_lr_timer_calls_total{method="get_names",status="success"} 1'
+    assert total in lines
+    assert '# TYPE usc_lr_timer_call_seconds histogram' in lines
+    prefix = 'usc_lr_timer_call_seconds_'
+    assert [line for line in lines if line.startswith(prefix)] == [
+        'usc_lr_timer_call_seconds_bucket{method="get_names",le="1.0"} 1',
+        'usc_lr_timer_call_seconds_bucket{method="get_names",le="+Inf"} 1',
+        'usc_lr_timer_call_seconds_sum{method="get_names"} 0.5',
+        'usc_lr_timer_call_seconds_count{method="get_names"} 1',
+    ]
+
+
+def test_write(tmpdir: LocalPath):
+    registry = Metrics()
+    registry(make_call())
+    registry.write(tmpdir.join('metrics.json'))
+    result = json.loads(tmpdir.join('metrics.json').read())
+    assert result == registry.to_json()
+    registry.write(tmpdir.join('metrics.prom'))
+    assert tmpdir.join('metrics.prom').read() == registry.to_prometheus()
+    assert not tmpdir.join('metrics.prom.tmp').exists()
+
+
+def test_configure_metrics(
+    mocker: MockFixture, monkeypatch: pytest.MonkeyPatch, tmpdir: LocalPath
+):
+    mock_register = mocker.patch(PATH.format('atexit.register'))
+    monkeypatch.delenv(metrics.METRICS_ENV, raising=False)
+    assert metrics.configure_metrics() is None
+    mock_register.assert_not_called()
+    path = tmpdir.join('metrics.prom')
+    monkeypatch.setenv(metrics.METRICS_ENV, str(path))
+    assert str(metrics.configure_metrics()) == str(path)
+    mock_register.assert_called_once_with(
+        metrics.registry().write, mocker.ANY
+    )
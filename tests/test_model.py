@@ -1,10 +1,13 @@
 from datetime import timedelta
+from unittest import mock
 from unittest.mock import Mock
 
+from freezegun import freeze_time
 from pytest_mock.plugin import MockFixture
 
-from usc_lr_timer import google_sheets
+from usc_lr_timer import cache, google_sheets
 from usc_lr_timer.model import Model, SubmitResult
+from usc_lr_timer.outbox import Outbox
 from usc_lr_timer.talk_to_google import Results
 
 
@@ -12,17 +15,83 @@ def test_duration(model: Model):
     assert model.duration == timedelta()
 
 
-def test_increment_duration(model: Model):
-    model.increment_duration(1)
-    assert model.duration == timedelta(seconds=1)
-    model.increment_duration(2)
+def test_start_pause_timer(model: Model, mocker: MockFixture):
+    mock_monotonic = mocker.patch('usc_lr_timer.model.time.monotonic')
+    mock_monotonic.return_value = 100.0
+    assert not model.running
+    model.start_timer()
+    assert model.running
+    # Ticks don't matter, only the clock does
+    mock_monotonic.return_value = 101.5
+    assert model.duration == timedelta(seconds=1.5)
+    model.start_timer()
+    mock_monotonic.return_value = 103.0
+    model.pause_timer()
+    assert not model.running
+    mock_monotonic.return_value = 200.0
     assert model.duration == timedelta(seconds=3)
+    model.pause_timer()
+    model.start_timer()
+    mock_monotonic.return_value = 3800.0
+    assert model.duration == timedelta(hours=1, seconds=3)
 
 
-def test_reset_duration(model: Model):
+def test_reset_duration(model: Model, mocker: MockFixture):
+    mock_monotonic = mocker.patch('usc_lr_timer.model.time.monotonic')
+    mock_monotonic.return_value = 100.0
     model._duration = timedelta(seconds=5)
     model.reset_duration()
     assert model.duration == timedelta()
+    model.start_timer()
+    mock_monotonic.return_value = 110.0
+    model.reset_duration()
+    assert model.running
+    assert model.duration == timedelta()
+    mock_monotonic.return_value = 112.0
+    assert model.duration == timedelta(seconds=2)
+
+
+def test_checkpoint(model: Model, mocker: MockFixture):
+    mocker.patch('usc_lr_timer.model.time.monotonic', return_value=100.0)
+    mocker.patch('usc_lr_timer.model.time.time', return_value=5000.0)
+    model._duration = timedelta(seconds=5)
+    model._categories = ['', 'a']
+    model.set_category_index(1)
+    state = {
+        'spreadsheet_id': 'abc123',
+        'name': 'Vincent',
+        'duration': 5.0,
+        'running': False,
+        'started': None,
+        'semester': 'Fall',
+        'category': 'a',
+    }
+    assert model.checkpoint() == state
+    model.start_timer()
+    model._started = 90.0
+    state.update(running=True, started=4990.0)
+    assert model.checkpoint() == state
+
+
+def test_restore(model: Model):
+    model.start_timer()
+    state = {'duration': 65.0, 'semester': 'Spring', 'category': 'b'}
+    model.restore(state)
+    assert not model.running
+    assert model.duration == timedelta(seconds=65)
+    assert model.semester == 'Spring'
+    # The category is picked once the categories load
+    assert model.category is None
+    model._categories = []
+    model._preloaded_categories = ['a', 'b']
+    model.set_categories()
+    assert model.category == 'b'
+    model.restore({'duration': 0.0, 'semester': 'Summer', 'category': 'c'})
+    assert model.semester == 'Spring'
+    assert model.category is None
+    # Picking a category drops the restored one
+    model.set_category_index(1)
+    assert model._restored_category is None
 
 
 def test_semesters(model: Model):
@@ -105,16 +174,58 @@ def test_set_manual_seconds(model: Model):
     assert model.manual_seconds == 1
 
 
-def test_set_categories(model: Model, model_mock_ttg: Mock):
-    model.set_categories()
-    #
-    assert model.categories == ['', 'testing']
-    model_mock_ttg.assert_called_once_with(
-        google_sheets.get_categories, 'abc123',
-    )
-    model_mock_ttg.return_value = Results.error, None
-    model.set_categories()
+def test_set_categories(model: Model, model_mock_submit: Mock):
+    # Nothing is fetched here, the view refreshes when this returns False
+    model._categories = ['', 'a']
+    assert not model.set_categories()
+    assert model.categories == []
+    model_mock_submit.assert_not_called()
+
+
+def test_set_categories_preloaded(model_mock_submit: Mock):
+    model = Model('Law Review', 'abc123', 'Vincent', ['a', 'b'])
+    assert model.set_categories()
+    assert model.categories == ['', 'a', 'b']
+    assert not model.set_categories()
     assert model.categories == []
+    model_mock_submit.assert_not_called()
+
+
+def test_set_categories_cached(model: Model, model_mock_submit: Mock):
+    cache.save('abc123', {'names': {}, 'categories': ['a', 'b']})
+    assert model.set_categories()
+    assert model.categories == ['', 'a', 'b']
+    model_mock_submit.assert_not_called()
+    mock_ttl = 'usc_lr_timer.cache.CACHE_TTL'
+    with mock.patch(mock_ttl, -1):
+        assert not model.set_categories()
+
+
+def test_refresh_categories(
+    model: Model, model_mock_submit: Mock, mocker: MockFixture
+):
+    future = model_mock_submit.return_value = mocker.Mock()
+    model._categories = ['', 'a', 'b']
+    model.set_category_index(2)
+    callback = mocker.Mock()
+    assert model.refresh_categories(callback) is future
+    model_mock_submit.assert_called_once_with(
+        google_sheets.get_bootstrap, 'abc123'
+    )
+    relay = future.add_done_callback.call_args[0][0]
+    relay(Results.error, None)
+    callback.assert_not_called()
+    relay(Results.success, {'names': {}, 'categories': ['a', 'b']})
+    callback.assert_called_once_with(False)
+    result = {'names': {}, 'categories': ['b', 'c']}
+    relay(Results.success, result)
+    callback.assert_called_with(True)
+    assert model.categories == ['', 'b', 'c']
+    assert model.category == 'b'
+    assert model.category_index == 1
+    assert cache.load('abc123') == (result, True)
+    relay(Results.success, {'names': {}, 'categories': ['c']})
+    assert model.category_index == 0
 
 
 def test_set_semester_index(model: Model):
@@ -130,9 +241,17 @@ def test_set_category_index(model: Model):
     assert model.category == 'a'
 
 
+def test_outbox(model: Model):
+    assert isinstance(model.outbox, Outbox)
+    assert len(model.outbox) == 0
+    outbox = Outbox()
+    model = Model('Law Review', 'abc123', 'Vincent', outbox=outbox)
+    assert model.outbox is outbox
+
+
+@freeze_time('2020-10-24 12:13:14')
 def test_submit(model: Model, mocker: MockFixture):
     mock_ttg = mocker.patch('usc_lr_timer.model.talk_to_google.talk_to_google')
-    mock_ttg.return_value = Results.success, None
     model._name = None
     assert model.submit(True) == SubmitResult(None, 'Name not chosen')
     model._name = 'Vincent'
@@ -148,24 +267,16 @@ def test_submit(model: Model, mocker: MockFixture):
     assert model.submit(True) == result
     model.set_manual_seconds(0)
     assert model.submit(True) == SubmitResult(None, 'No time recorded')
-    model.set_manual_seconds(42)
+    assert len(model.outbox) == 0
+    model.set_manual_hours(24)
     assert model.submit(True) == SubmitResult(Results.success, None)
-    mock_ttg.assert_called_with(
-        google_sheets.add_time,
-        spreadsheet_id='abc123',
-        name='Vincent',
-        semester='Fall',
-        duration=timedelta(seconds=42),
-        category='testing',
-    )
+    row = ['Vincent', 'Fall', 1.0, '10/24/2020 12:13:14', 'testing']
+    assert [e.row[:5] for e in model.outbox.pending()] == [row]
     assert model.submit(False) == SubmitResult(None, 'No time recorded')
-    model.increment_duration(24)
+    model._duration = timedelta(hours=12)
     assert model.submit(False) == SubmitResult(Results.success, None)
-    mock_ttg.assert_called_with(
-        google_sheets.add_time,
-        spreadsheet_id='abc123',
-        name='Vincent',
-        semester='Fall',
-        duration=timedelta(seconds=24),
-        category='testing',
-    )
+    entries = model.outbox.pending()
+    assert [e.spreadsheet_id for e in entries] == ['abc123', 'abc123']
+    assert entries[1].row[2] == 0.5
+    assert entries[0].row[5] != entries[1].row[5]
+    mock_ttg.assert_not_called()
@@ -0,0 +1,319 @@
+import sqlite3
+from typing import Callable
+from unittest.mock import Mock
+
+from py._path.local import LocalPath
+import pytest
+from pytest_mock.plugin import MockFixture
+from pytestqt.qtbot import QtBot
+
+from usc_lr_timer import google_sheets
+from usc_lr_timer.outbox import CLAIM_TIMEOUT, Entry, Outbox, OutboxFlusher
+from usc_lr_timer.talk_to_google import Future, Results
+
+PATH = 'usc_lr_timer.outbox.{}'
+
+
+@pytest.fixture
+def outbox() -> Outbox:
+    outbox = Outbox()
+    yield outbox
+    outbox.close()
+
+
+@pytest.fixture
+def mock_background(mocker: MockFixture) -> Mock:
+    return mocker.patch(
+        PATH.format('talk_to_google.talk_to_google_in_background')
+    )
+
+
+@pytest.fixture
+def make_flusher(outbox: Outbox, qtbot: QtBot) -> Callable:
+    flushers = []
+
+    def make_flusher(**kwargs) -> OutboxFlusher:
+        flusher = OutboxFlusher(outbox, **kwargs)
+        flushers.append(flusher)
+        return flusher
+
+    yield make_flusher
+    # A timer firing after the outbox is closed would fail a later test
+    for flusher in flushers:
+        flusher.stop()
+        flusher.deleteLater()
+
+
+@pytest.fixture
+def flusher(make_flusher: Callable) -> OutboxFlusher:
+    return make_flusher()
+
+
+class TestOutbox(object):
+    def test_path(self, outbox: Outbox, data_dir: LocalPath):
+        assert str(outbox.path) == str(data_dir.join('outbox.sqlite3'))
+
+    def test_add(self, outbox: Outbox):
+        assert len(outbox) == 0
+        first = outbox.add('abc123', ['a', 1.5])
+        second = outbox.add('xyz789', ['b', 2])
+        assert len(outbox) == 2
+        assert outbox.pending() == [
+            Entry(first, 'abc123', ['a', 1.5], 0),
+            Entry(second, 'xyz789', ['b', 2], 0),
+        ]
+        entry = Entry(first, 'abc123', ['a', 1.5], 0)
+        assert outbox.pending(limit=1) == [entry]
+
+    def test_mark_attempted(self, outbox: Outbox):
+        first = outbox.add('abc123', ['a'])
+        outbox.add('abc123', ['b'])
+        outbox.mark_attempted([first])
+        outbox.mark_attempted([first])
+        assert [e.attempts for e in outbox.pending()] == [2, 0]
+
+    def test_pending_spreadsheet(self, outbox: Outbox):
+        outbox.add('abc123', ['a'])
+        outbox.add('xyz789', ['b'])
+        outbox.add('abc123', ['c'])
+        entries = outbox.pending(spreadsheet_id='abc123')
+        assert [e.row for e in entries] == [['a'], ['c']]
+        entries = outbox.pending(limit=1, spreadsheet_id='abc123')
+        assert [e.row for e in entries] == [['a']]
+
+    def test_remove(self, outbox: Outbox):
+        first = outbox.add('abc123', ['a'])
+        second = outbox.add('abc123', ['b'])
+        outbox.remove([first])
+        assert [e.id for e in outbox.pending()] == [second]
+
+    def test_persistent(self, outbox: Outbox):
+        outbox.add('abc123', ['a'])
+        outbox.close()
+        other = Outbox()
+        assert [e.row for e in other.pending()] == [['a']]
+        other.close()
+
+    def test_claim(self, outbox: Outbox):
+        first = outbox.add('abc123', ['a'])
+        outbox.add('xyz789', ['b'])
+        second = outbox.add('abc123', ['c'])
+        entries = outbox.claim()
+        assert entries == [
+            Entry(first, 'abc123', ['a'], 0),
+            Entry(second, 'abc123', ['c'], 0),
+        ]
+        assert [e.row for e in outbox.claim()] == [['b']]
+        assert outbox.claim() == []
+        assert len(outbox) == 3
+
+    def test_claim_limit(self, outbox: Outbox):
+        outbox.add('abc123', ['a'])
+        outbox.add('abc123', ['b'])
+        assert [e.row for e in outbox.claim(1)] == [['a']]
+        assert [e.row for e in outbox.claim(1)] == [['b']]
+
+    def test_claim_other_instance(self, outbox: Outbox):
+        outbox.add('abc123', ['a'])
+        other = Outbox()
+        assert [e.row for e in outbox.claim()] == [['a']]
+        assert other.claim() == []
+        other.add('abc123', ['b'])
+        assert [e.row for e in other.claim()] == [['b']]
+        other.close()
+
+    def test_mark_attempted_releases_claim(self, outbox: Outbox):
+        first = outbox.add('abc123', ['a'])
+        outbox.claim()
+        outbox.mark_attempted([first])
+        assert outbox.claim() == [Entry(first, 'abc123', ['a'], 1)]
+
+    def test_claim_timed_out(self, outbox: Outbox, mocker: MockFixture):
+        first = outbox.add('abc123', ['a'])
+        time = mocker.patch(PATH.format('time.time'), return_value=1000.0)
+        outbox.claim()
+        time.return_value += CLAIM_TIMEOUT
+        assert outbox.claim() == []
+        time.return_value += 1
+        # The instance that claimed the row may have sent it
+        assert outbox.claim() == [Entry(first, 'abc123', ['a'], 1)]
+        assert outbox.pending() == [Entry(first, 'abc123', ['a'], 1)]
+
+    def test_migrate(self, data_dir: LocalPath):
+        data_dir.mkdir()
+        connection = sqlite3.connect(str(data_dir.join('outbox.sqlite3')))
+        with connection:
+            connection.execute(
+                'CREATE TABLE submissions ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'spreadsheet_id TEXT NOT NULL, '
+                'row TEXT NOT NULL, '
+                'attempts INTEGER NOT NULL DEFAULT 0, '
+                'created REAL NOT NULL)'
+            )
+            connection.execute(
+                'INSERT INTO submissions (spreadsheet_id, row, created) '
+                'VALUES (?, ?, ?)',
+                ('abc123', '["a"]', 0.0),
+            )
+        connection.close()
+        outbox = Outbox()
+        assert [e.row for e in outbox.claim()] == [['a']]
+        assert outbox.claim() == []
+        outbox.close()
+
+
+class TestOutboxFlusher(object):
+    def test_flush_empty(self, flusher: OutboxFlusher, mock_background: Mock):
+        flusher.flush()
+        mock_background.assert_not_called()
+        assert not flusher.busy
+
+    def test_flush(
+        self,
+        flusher: OutboxFlusher,
+        outbox: Outbox,
+        mock_background: Mock,
+        qtbot: QtBot,
+    ):
+        outbox.add('abc123', ['a'])
+        outbox.add('xyz789', ['b'])
+        outbox.add('abc123', ['c'])
+        with qtbot.wait_signal(flusher.pending_changed) as blocker:
+            flusher.flush()
+        assert blocker.args == [3]
+        assert flusher.busy
+        fn, callback, spreadsheet_id, rows = mock_background.call_args[0]
+        assert fn is google_sheets.add_submissions
+        assert (spreadsheet_id, rows) == ('abc123', [['a'], ['c']])
+        assert mock_background.call_args[1] == {'deduplicate': False}
+        flusher.flush()
+        assert mock_background.call_count == 1
+
+        callback(Results.success, {})
+        assert mock_background.call_count == 2
+        fn, callback, spreadsheet_id, rows = mock_background.call_args[0]
+        assert (spreadsheet_id, rows) == ('xyz789', [['b']])
+        with qtbot.wait_signal(flusher.pending_changed) as blocker:
+            callback(Results.success, {})
+        assert blocker.args == [0]
+        assert len(outbox) == 0
+        assert not flusher.busy
+
+    def test_flush_claimed_elsewhere(
+        self,
+        flusher: OutboxFlusher,
+        outbox: Outbox,
+        mock_background: Mock,
+        qtbot: QtBot,
+        mocker: MockFixture,
+    ):
+        mocker.patch(PATH.format('RETRY_INTERVAL'), 0.1)
+        first = outbox.add('abc123', ['a'])
+        other = Outbox()
+        other.claim()
+        flusher.flush()
+        mock_background.assert_not_called()
+        # Tried again once the other instance gives the row up
+        other.mark_attempted([first])
+        other.close()
+        qtbot.waitUntil(lambda: mock_background.called, 1000)
+        assert mock_background.call_args[1] == {'deduplicate': True}
+
+    def test_stop(
+        self, flusher: OutboxFlusher, outbox: Outbox, mock_background: Mock
+    ):
+        def background(fn, callback, *args, **kwargs):
+            future = Future()
+            future.add_done_callback(callback)
+            return future
+
+        mock_background.side_effect = background
+        first = outbox.add('abc123', ['a'])
+        flusher.flush()
+        assert flusher.busy
+        flusher.stop()
+        assert not flusher.busy
+        assert not flusher._retry_timer.isActive()
+        # The next instance can send the row right away
+        other = Outbox()
+        assert other.claim() == [Entry(first, 'abc123', ['a'], 1)]
+        other.close()
+
+    def test_flush_batch_size(
+        self, outbox: Outbox, mock_background: Mock, make_flusher: Callable
+    ):
+        flusher = make_flusher(max_batch_size=2)
+        assert flusher.max_batch_size == 2
+        for row in 'abc':
+            outbox.add('abc123', [row])
+        flusher.flush()
+        rows = mock_background.call_args[0][3]
+        assert rows == [['a'], ['b']]
+        mock_background.call_args[0][1](Results.success, {})
+        rows = mock_background.call_args[0][3]
+        assert rows == [['c']]
+
+    def test_schedule(
+        self,
+        outbox: Outbox,
+        mock_background: Mock,
+        make_flusher: Callable,
+        qtbot: QtBot,
+    ):
+        flusher = make_flusher(max_batch_size=3, linger=0.2)
+        assert flusher.linger == 0.2
+        outbox.add('abc123', ['a'])
+        flusher.schedule()
+        outbox.add('abc123', ['b'])
+        flusher.schedule()
+        mock_background.assert_not_called()
+        qtbot.waitUntil(lambda: mock_background.called, 1000)
+        assert mock_background.call_args[0][3] == [['a'], ['b']]
+        mock_background.call_args[0][1](Results.success, {})
+
+        for row in 'cde':
+            outbox.add('abc123', [row])
+        flusher.schedule()
+        assert mock_background.call_count == 2
+        assert mock_background.call_args[0][3] == [['c'], ['d'], ['e']]
+
+    def test_flush_retry(
+        self,
+        flusher: OutboxFlusher,
+        outbox: Outbox,
+        mock_background: Mock,
+        qtbot: QtBot,
+        mocker: MockFixture,
+    ):
+        mocker.patch(PATH.format('RETRY_INTERVAL'), 0.1)
+        mocker.patch(PATH.format('MAX_RETRY_INTERVAL'), 0.3)
+        outbox.add('abc123', ['a'])
+        flusher.flush()
+        callback = mock_background.call_args[0][1]
+        callback(Results.error, None)
+        assert not flusher.busy
+        assert outbox.pending()[0].attempts == 1
+        assert flusher.retry_interval == 0.1
+        qtbot.waitUntil(lambda: mock_background.call_count == 2, 1000)
+        assert mock_background.call_args[1] == {'deduplicate': True}
+        mock_background.call_args[0][1](Results.error, None)
+        assert flusher.retry_interval == 0.2
+        qtbot.waitUntil(lambda: mock_background.call_count == 3, 1000)
+        mock_background.call_args[0][1](Results.error, None)
+        assert flusher.retry_interval == 0.3
+        qtbot.waitUntil(lambda: mock_background.call_count == 4, 1000)
+        mock_background.call_args[0][1](Results.success, {})
+        assert flusher.retry_interval == 0.1
+        assert len(outbox) == 0
+
+    def test_retry_interval(
+        self, outbox: Outbox, mock_background: Mock, make_flusher: Callable
+    ):
+        flusher = make_flusher(retry_interval=0.1)
+        assert flusher.retry_interval == 0.1
+        outbox.add('abc123', ['a'])
+        flusher.flush()
+        mock_background.call_args[0][1](Results.error, None)
+        mock_background.call_args[0][1](Results.error, None)
+        assert flusher.retry_interval == 0.2
@@ -0,0 +1,94 @@
+from multiprocessing import Process
+from pathlib import Path
+
+from py._path.local import LocalPath
+import pytest
+from pytest_mock.plugin import MockFixture
+
+from usc_lr_timer import rate_limit
+
+PATH = 'usc_lr_timer.rate_limit.{}'
+
+
+@pytest.fixture
+def mock_clock(mocker: MockFixture):
+    mock_monotonic = mocker.patch(PATH.format('time.monotonic'))
+    mock_time = mocker.patch(PATH.format('time.time'))
+    mock_monotonic.return_value = mock_time.return_value = 100
+    return mock_monotonic, mock_time
+
+
+def set_clock(mock_clock: tuple, now: float):
+    for mock in mock_clock:
+        mock.return_value = now
+
+
+def test_token_bucket(mocker: MockFixture, mock_clock: tuple):
+    sleep = mocker.Mock()
+    bucket = rate_limit.TokenBucket(rate=2, capacity=2, sleep=sleep)
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0.5
+    sleep.assert_called_once_with(0.5)
+    assert bucket.acquire() == 1.0
+    set_clock(mock_clock, 102)
+    assert bucket.acquire() == 0
+    set_clock(mock_clock, 200)
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0.5
+
+
+def test_file_token_bucket(
+    mocker: MockFixture, mock_clock: tuple, tmpdir: LocalPath
+):
+    path = Path(str(tmpdir.join('abc123.bucket')))
+    first = rate_limit.FileTokenBucket(path, 1, 2, sleep=mocker.Mock())
+    second = rate_limit.FileTokenBucket(path, 1, 2, sleep=mocker.Mock())
+    assert first.path == path
+    assert first.acquire() == 0
+    assert second.acquire() == 0
+    assert first.acquire() == 1
+    assert second.acquire() == 2
+    set_clock(mock_clock, 110)
+    assert second.acquire() == 0
+    path.write_text('garbage')
+    assert first.acquire() == 0
+
+
+def _acquire(path: str):
+    bucket = rate_limit.FileTokenBucket(Path(path), 1, 5, sleep=lambda _: None)
+    for _ in range(5):
+        bucket.acquire()
+
+
+def test_file_token_bucket_processes(tmpdir: LocalPath):
+    path = str(tmpdir.join('abc123.bucket'))
+    processes = [Process(target=_acquire, args=(path,)) for _ in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(10)
+        assert process.exitcode == 0
+    bucket = rate_limit.FileTokenBucket(Path(path), 1, 5, sleep=lambda _: None)
+    # 15 tokens were taken from a bucket of 5, so the next one waits ~11s
+    assert bucket.acquire() > 9
+
+
+def test_rate_limiter(mocker: MockFixture, tmpdir: LocalPath):
+    limiter = rate_limit.RateLimiter(1, 2)
+    assert not limiter.shared
+    bucket = limiter.bucket('abc123')
+    assert type(bucket) is rate_limit.TokenBucket
+    assert limiter.bucket('abc123') is bucket
+    assert limiter.bucket('xyz789') is not bucket
+    mock_acquire = mocker.patch.object(bucket, 'acquire', return_value=0.5)
+    assert limiter.acquire('abc123') == 0.5
+    mock_acquire.assert_called_once_with()
+
+    shared_dir = Path(str(tmpdir.join('buckets')))
+    limiter = rate_limit.RateLimiter(1, 2, shared_dir)
+    assert limiter.shared
+    bucket = limiter.bucket('abc123')
+    assert isinstance(bucket, rate_limit.FileTokenBucket)
+    assert bucket.path == shared_dir / 'abc123.bucket'
@@ -0,0 +1,137 @@
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+import socket
+
+from googleapiclient.errors import HttpError
+import httplib2
+import pytest
+from pytest_mock.plugin import MockFixture
+
+from usc_lr_timer import metrics, retry
+
+PATH = 'usc_lr_timer.retry.{}'
+
+
+def http_error(status: int, **headers) -> HttpError:
+    resp = httplib2.Response(dict(status=status, **headers))
+    return HttpError(resp, b'{}')
+
+
+@pytest.fixture
+def policy(mocker: MockFixture) -> retry.RetryPolicy:
+    mocker.patch(PATH.format('random.uniform'), side_effect=lambda a, b: b)
+    return retry.RetryPolicy(
+        max_attempts=4, base_delay=1, max_delay=5, sleep=mocker.Mock(),
+    )
+
+
+def test_retry_budget(mocker: MockFixture):
+    mock_monotonic = mocker.patch(PATH.format('time.monotonic'))
+    mock_monotonic.return_value = 100
+    budget = retry.RetryBudget(capacity=2, rate=0.5)
+    assert budget.spend()
+    assert budget.spend()
+    assert not budget.spend()
+    mock_monotonic.return_value = 102
+    assert budget.tokens == 1
+    assert budget.spend()
+    mock_monotonic.return_value = 200
+    assert budget.tokens == 2
+
+
+def test_retry_after(mocker: MockFixture):
+    assert retry.retry_after(RuntimeError()) is None
+    assert retry.retry_after(http_error(429)) is None
+    assert retry.retry_after(http_error(429, **{'retry-after': '7'})) == 7
+    assert retry.retry_after(http_error(429, **{'retry-after': '-1'})) == 0
+    date = datetime.now(timezone.utc) + timedelta(seconds=30)
+    error = http_error(503, **{'retry-after': format_datetime(date)})
+    assert 25 < retry.retry_after(error) <= 30
+    assert retry.retry_after(http_error(429, **{'retry-after': 'x'})) is None
+
+
+@pytest.mark.parametrize(
+    'error, idempotent, expected',
+    [
+        (http_error(429), True, True),
+        (http_error(429), False, True),
+        (http_error(503), True, True),
+        (http_error(503), False, False),
+        (http_error(400), True, False),
+        (http_error(403), True, False),
+        (socket.timeout(), True, True),
+        (socket.timeout(), False, False),
+        (ConnectionResetError(), True, True),
+        (ConnectionResetError(), False, False),
+        (ConnectionRefusedError(), False, True),
+        (httplib2.ServerNotFoundError(), False, True),
+        (ValueError(), True, False),
+    ],
+)
+def test_retryable(
+    policy: retry.RetryPolicy,
+    error: Exception,
+    idempotent: bool,
+    expected: bool,
+):
+    assert policy.retryable(error, idempotent) is expected
+
+
+def test_delay(policy: retry.RetryPolicy):
+    assert policy.delay(0, http_error(503)) == 1
+    assert policy.delay(1, http_error(503)) == 2
+    assert policy.delay(2, http_error(503)) == 4
+    assert policy.delay(3, http_error(503)) == 5
+    assert policy.delay(0, http_error(429, **{'retry-after': '3'})) == 3
+    assert policy.delay(0, http_error(429, **{'retry-after': '60'})) is None
+
+
+def test_call(policy: retry.RetryPolicy, mocker: MockFixture):
+    fn = mocker.Mock(side_effect=[http_error(503), socket.timeout(), 'done'])
+    assert policy.call(fn) == 'done'
+    assert fn.call_count == 3
+    assert policy.sleep.call_args_list == [mocker.call(1), mocker.call(2)]
+
+
+def test_call_counts_retries(policy: retry.RetryPolicy, mocker: MockFixture):
+    fn = mocker.Mock(side_effect=[http_error(503), socket.timeout(), 'done'])
+    with metrics.record('get_names') as call:
+        policy.call(fn)
+    assert call.retries == 2
+
+
+def test_call_max_attempts(policy: retry.RetryPolicy, mocker: MockFixture):
+    fn = mocker.Mock(side_effect=http_error(500))
+    with pytest.raises(HttpError):
+        policy.call(fn)
+    assert fn.call_count == 4
+
+
+def test_call_not_retryable(policy: retry.RetryPolicy, mocker: MockFixture):
+    fn = mocker.Mock(side_effect=http_error(503))
+    with pytest.raises(HttpError):
+        policy.call(fn, idempotent=False)
+    assert fn.call_count == 1
+    fn = mocker.Mock(side_effect=[http_error(429), 'done'])
+    assert policy.call(fn, idempotent=False) == 'done'
+
+
+def test_call_retry_after_too_long(
+    policy: retry.RetryPolicy, mocker: MockFixture
+):
+    fn = mocker.Mock(side_effect=http_error(429, **{'retry-after': '600'}))
+    with pytest.raises(HttpError):
+        policy.call(fn)
+    assert fn.call_count == 1
+
+
+def test_call_budget(mocker: MockFixture):
+    budget = retry.RetryBudget(capacity=1, rate=0)
+    policy = retry.RetryPolicy(budget=budget, sleep=mocker.Mock())
+    fn = mocker.Mock(side_effect=http_error(503))
+    with pytest.raises(HttpError):
+        policy.call(fn)
+    assert fn.call_count == 2
+    with pytest.raises(HttpError):
+        policy.call(fn)
+    assert fn.call_count == 3
@@ -1,13 +1,25 @@
+import asyncio
+import threading
+import time
+
 from PySide2 import QtWidgets
 import pytest
 from pytest_mock.plugin import MockFixture
 from pytestqt.qtbot import QtBot
 
-from usc_lr_timer import talk_to_google
+from usc_lr_timer import cancel, metrics, talk_to_google
+from usc_lr_timer.async_sheets import AsyncSheetsClient
 
 PATH = 'usc_lr_timer.talk_to_google.{}'
 
 
+@pytest.fixture
+def client() -> AsyncSheetsClient:
+    client = AsyncSheetsClient(max_workers=1)
+    yield client
+    client.close()
+
+
 def test_worker(qtbot: QtBot):
     def fn(a, b):
         return {'foo': 'bar'}
@@ -102,7 +114,7 @@ def test_talk_to_google_exception():
 
 def test_talk_to_google_cancel(qtbot: QtBot, mocker: MockFixture):
     def fn(a, b):
-        qtbot.wait(600)
+        cancel.sleep(10)
 
     mocker.patch(PATH.format('ALLOWED_METHODS'), [fn])
     progress = QtWidgets.QProgressDialog('test', 'test', 0, 0)
@@ -119,3 +131,285 @@ def test_talk_to_google_cancel(qtbot: QtBot, mocker: MockFixture):
     assert data is None
     mock_exec.assert_called_once_with()
     mock_Progress.assert_called_once_with('Talking to Google...', 'Stop', 0, 0)
+    # The worker is stopped too
+    assert talk_to_google.shutdown_thread_pool(timeout=2000)
+
+
+@pytest.mark.parametrize(
+    'error, expected',
+    [
+        (False, (talk_to_google.Results.success, 3)),
+        (True, (talk_to_google.Results.error, None)),
+    ],
+)
+def test_talk_to_google_in_background(
+    qtbot: QtBot, mocker: MockFixture, error: bool, expected: tuple
+):
+    def fn(a, b):
+        if error:
+            raise RuntimeError('Test Exception')
+        return a + b
+
+    mocker.patch(PATH.format('ALLOWED_METHODS'), [fn])
+    mock_critical = mocker.patch(PATH.format('QtWidgets.QMessageBox.critical'))
+    callback = mocker.Mock()
+    talk_to_google.talk_to_google_in_background(fn, callback, 1, b=2)
+    qtbot.waitUntil(lambda: callback.called, 2000)
+    callback.assert_called_once_with(*expected)
+    mock_critical.assert_not_called()
+    assert not talk_to_google._futures
+    with pytest.raises(ValueError):
+        talk_to_google.talk_to_google_in_background(lambda: None, callback)
+
+
+@pytest.fixture
+def pool(mocker: MockFixture):
+    mocker.patch(PATH.format('_thread_pool_size'), 2)
+
+
+def test_thread_pool(qtbot: QtBot, pool):
+    pool = talk_to_google.thread_pool()
+    assert talk_to_google.thread_pool() is pool
+    assert pool.maxThreadCount() == 2
+    assert pool.expiryTimeout() == -1
+    talk_to_google.configure_thread_pool(3)
+    assert pool.maxThreadCount() == 3
+
+
+def test_thread_pool_names(qtbot: QtBot, mocker: MockFixture, pool):
+    def fn():
+        return threading.current_thread().name
+
+    mocker.patch(PATH.format('ALLOWED_METHODS'), [fn])
+    callback = mocker.Mock()
+    talk_to_google.talk_to_google_in_background(fn, callback)
+    qtbot.waitUntil(lambda: callback.called, 2000)
+    status, name = callback.call_args[0]
+    assert status == talk_to_google.Results.success
+    assert name.startswith(f'{talk_to_google.THREAD_NAME}-')
+
+
+def test_shutdown_thread_pool(qtbot: QtBot, mocker: MockFixture, pool):
+    assert talk_to_google.shutdown_thread_pool()
+    pool = talk_to_google.thread_pool()
+    started = threading.Event()
+    release = threading.Event()
+
+    def fn():
+        started.set()
+        release.wait(2)
+
+    mocker.patch(PATH.format('ALLOWED_METHODS'), [fn])
+    talk_to_google.talk_to_google_in_background(fn, mocker.Mock())
+    started.wait(2)
+    assert not talk_to_google.shutdown_thread_pool(timeout=10)
+    assert talk_to_google._thread_pool is None
+    release.set()
+    assert pool.waitForDone(2000)
+    assert talk_to_google.thread_pool() is not pool
+
+
+def test_shutdown_thread_pool_cancels(qtbot: QtBot, mocker: MockFixture):
+    mocker.patch(PATH.format('_thread_pool_size'), 1)
+    started = threading.Event()
+
+    def fn():
+        started.set()
+        cancel.sleep(30)
+
+    mocker.patch(PATH.format('ALLOWED_METHODS'), [fn])
+    running = talk_to_google.submit(fn)
+    queued = talk_to_google.submit(fn)
+    assert started.wait(2)
+    with qtbot.wait_signal(queued.settled, 1000) as blocker:
+        # Neither call waits out its sleep
+        assert talk_to_google.shutdown_thread_pool(timeout=2000)
+    assert blocker.args == [False]
+    assert queued.status == talk_to_google.Results.canceled
+    assert queued not in talk_to_google._futures
+    assert running.status == talk_to_google.Results.canceled
+    with qtbot.wait_signal(running.settled, 1000):
+        pass
+    assert not talk_to_google._futures
+
+
+def test_submit(qtbot: QtBot, mocker: MockFixture):
+    def fn(a, b):
+        return a + b
+
+    mocker.patch(PATH.format('ALLOWED_METHODS'), [fn])
+    future = talk_to_google.submit(fn, 1, b=2)
+    assert isinstance(future, talk_to_google.Future)
+    assert future in talk_to_google._futures
+    with qtbot.wait_signal(future.finished, 2000) as blocker:
+        pass
+    assert blocker.args == [talk_to_google.Results.success, 3]
+    assert future.done()
+    assert future.status == talk_to_google.Results.success
+    assert future.result == 3
+    assert future.exception is None
+    assert future.landed
+    assert not future.running()
+    assert future not in talk_to_google._futures
+    with pytest.raises(ValueError):
+        talk_to_google.submit(lambda: None)
+
+
+def test_future(mocker: MockFixture):
+    future = talk_to_google.Future()
+    assert not future.done()
+    assert future.status is None
+    callback = mocker.Mock()
+    future.add_done_callback(callback)
+    callback.assert_not_called()
+    error = RuntimeError('Test Exception')
+    future._resolve(talk_to_google.Results.error, None, error)
+    callback.assert_called_once_with(talk_to_google.Results.error, None)
+    assert future.exception is error
+    late = mocker.Mock()
+    future.add_done_callback(late)
+    late.assert_called_once_with(talk_to_google.Results.error, None)
+
+
+def test_worker_canceled(qtbot: QtBot, mocker: MockFixture):
+    fn = mocker.Mock()
+    worker = talk_to_google._Worker(fn)
+    worker.token.cancel()
+    worker.run()
+    fn.assert_not_called()
+    assert isinstance(worker.exception, cancel.Canceled)
+    assert not worker.exception.sent
+
+
+def test_worker_token(mocker: MockFixture):
+    worker = talk_to_google._Worker(cancel.current)
+    worker.run()
+    assert worker.result is worker.token
+    assert cancel.current() is None
+    mock_token = mocker.patch(PATH.format('CancelToken'))
+    talk_to_google._Worker(fn=None)
+    mock_token.assert_called_once_with(talk_to_google.CALL_TIMEOUT)
+
+
+@pytest.mark.parametrize(
+    'write, landed', [('done', True), ('unsent', False), ('sent', None)]
+)
+def test_future_cancel(
+    qtbot: QtBot, mocker: MockFixture, write: str, landed: bool
+):
+    started = threading.Event()
+
+    def fn():
+        started.set()
+        token = cancel.current()
+        while not token.canceled:
+            time.sleep(0.01)
+        if write == 'unsent':
+            token.check()
+        elif write == 'sent':
+            token.check(sent=True)
+        return 'late'
+
+    mocker.patch(PATH.format('ALLOWED_METHODS'), [fn])
+    callback = mocker.Mock()
+    future = talk_to_google.talk_to_google_in_background(fn, callback)
+    assert started.wait(2)
+    assert future.running()
+    assert future.cancel()
+    assert not future.cancel()
+    callback.assert_called_once_with(talk_to_google.Results.canceled, None)
+    assert future in talk_to_google._futures
+    with qtbot.wait_signal(future.settled, 2000) as blocker:
+        pass
+    assert blocker.args == [landed]
+    assert future.landed is landed
+    assert not future.running()
+    # The late result is dropped
+    callback.assert_called_once()
+    assert future.status == talk_to_google.Results.canceled
+    assert future.result is None
+    assert future not in talk_to_google._futures
+
+
+def test_submit_coroutine(
+    client: AsyncSheetsClient, qtbot: QtBot, mocker: MockFixture
+):
+    mocker.patch(
+        'usc_lr_timer.async_sheets.google_sheets.read_sheet',
+        return_value=[['a']],
+    )
+    future = talk_to_google.submit_coroutine(client.get('abc123', 'A1'))
+    with qtbot.wait_signal(future.finished, 2000) as blocker:
+        pass
+    assert blocker.args == [talk_to_google.Results.success, [['a']]]
+    with pytest.raises(TypeError):
+        talk_to_google.submit_coroutine(client.get)
+
+    async def add(a, b):
+        await asyncio.sleep(0)
+        return a + b
+
+    with pytest.raises(ValueError):
+        talk_to_google.submit_coroutine(add(1, 2))
+    with pytest.raises(ValueError):
+        talk_to_google.submit_coroutine(client.append('abc123', 'A', [[1]]))
+
+
+def test_worker_metrics(
+    client: AsyncSheetsClient, qtbot: QtBot, mocker: MockFixture
+):
+    calls = []
+    mocker.patch.object(metrics, '_hooks', [calls.append])
+    mock_monotonic = mocker.patch('usc_lr_timer.talk_to_google.time.monotonic')
+    mock_monotonic.return_value = 100.0
+
+    def get_names():
+        return {}
+
+    worker = talk_to_google._Worker(get_names)
+    mock_monotonic.return_value = 100.5
+    worker.run()
+    canceled = talk_to_google._Worker(get_names)
+    canceled.token.cancel()
+    canceled.run()
+    first, second = calls
+    assert first.method == 'get_names'
+    assert first.status == 'success'
+    assert first.queued == 0.5
+    assert second.status == 'canceled'
+
+    def read_sheet(spreadsheet_id, sheet_range):
+        return []
+
+    mocker.patch(
+        'usc_lr_timer.async_sheets.google_sheets.read_sheet', read_sheet
+    )
+    future = talk_to_google.submit_coroutine(client.get('abc123', 'A1'))
+    with qtbot.wait_signal(future.finished, 2000):
+        pass
+    # Recorded by the client only, not again for the coroutine
+    assert len(calls) == 3
+    assert calls[-1].method == 'read_sheet'
+
+
+def test_submit_coroutine_cancel(
+    client: AsyncSheetsClient, qtbot: QtBot, mocker: MockFixture
+):
+    started = threading.Event()
+
+    def read_sheet(spreadsheet_id, sheet_range):
+        started.set()
+        cancel.sleep(10)
+
+    mocker.patch(
+        'usc_lr_timer.async_sheets.google_sheets.read_sheet',
+        side_effect=read_sheet,
+    )
+    future = talk_to_google.submit_coroutine(client.get('abc123', 'A1'))
+    assert started.wait(2)
+    future.cancel()
+    with qtbot.wait_signal(future.settled, 2000) as blocker:
+        pass
+    # Whatever the coroutine was doing may have reached Google
+    assert blocker.args == [None]
+    assert future.status == talk_to_google.Results.canceled
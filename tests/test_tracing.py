@@ -0,0 +1,93 @@
+import json
+import threading
+
+from py._path.local import LocalPath
+import pytest
+from pytest_mock.plugin import MockFixture
+from pytestqt.qtbot import QtBot
+
+from usc_lr_timer import talk_to_google, tracing
+from usc_lr_timer.tracing import traced, Tracer
+
+PATH = 'usc_lr_timer.tracing.{}'
+
+
+@pytest.fixture
+def mock_register(mocker: MockFixture):
+    mocker.patch(PATH.format('_tracer'), None)
+    return mocker.patch(PATH.format('atexit.register'))
+
+
+def test_span(mocker: MockFixture):
+    mock_perf_counter = mocker.patch(PATH.format('time.perf_counter'))
+    mock_perf_counter.return_value = 10.0
+    tracer = Tracer()
+    mock_perf_counter.side_effect = [10.5, 10.75, 11.0, 12.0]
+    with tracer.span('outer', answer=42):
+        with tracer.span('inner', 'network'):
+            pass
+    inner, thread_name, outer = tracer.events
+    assert inner['name'] == 'inner'
+    assert inner['cat'] == 'network'
+    assert inner['ph'] == 'X'
+    assert inner['ts'] == 0.75e6
+    assert inner['dur'] == 0.25e6
+    assert outer['name'] == 'outer'
+    assert outer['cat'] == 'app'
+    assert outer['ts'] == 0.5e6
+    assert outer['dur'] == 1.5e6
+    assert outer['args'] == {'answer': 42}
+    # Each thread is named once
+    assert thread_name['ph'] == 'M'
+    assert thread_name['tid'] == inner['tid'] == outer['tid']
+    assert thread_name['args'] == {'name': threading.current_thread().name}
+
+
+def test_write(tmpdir: LocalPath):
+    tracer = Tracer()
+    with tracer.span('startup'):
+        pass
+    path = tmpdir.join('trace.json')
+    tracer.write(path)
+    trace = json.loads(path.read())
+    assert trace['traceEvents'] == tracer.events
+    assert trace['displayTimeUnit'] == 'ms'
+
+
+def test_configure_tracing(
+    mock_register, monkeypatch: pytest.MonkeyPatch, tmpdir: LocalPath
+):
+    monkeypatch.delenv(tracing.TRACE_ENV, raising=False)
+    assert tracing.configure_tracing() is None
+    assert tracing.tracer() is None
+    mock_register.assert_not_called()
+    path = tmpdir.join('trace.json')
+    monkeypatch.setenv(tracing.TRACE_ENV, str(path))
+    tracer = tracing.configure_tracing()
+    assert tracing.tracer() is tracer
+    mock_register.assert_called_once_with(tracer.write, path)
+
+
+def test_traced(mock_register, tmpdir: LocalPath):
+    @traced
+    def fn(a, b=1):
+        return a + b
+
+    # Nothing is recorded unless tracing is on
+    assert fn(1, b=2) == 3
+    tracer = tracing.configure_tracing(tmpdir.join('trace.json'))
+    assert fn(1) == 2
+    assert fn.__name__ == 'fn'
+    assert tracer.events[0]['name'] == 'test_traced.<locals>.fn'
+
+
+def test_worker_span(mock_register, tmpdir: LocalPath, qtbot: QtBot):
+    def get_names():
+        return {}
+
+    tracer = tracing.configure_tracing(tmpdir.join('trace.json'))
+    worker = talk_to_google._Worker(get_names)
+    with qtbot.wait_signal(worker.signals.finished, timeout=2000):
+        worker.run()
+    assert tracer.events[0]['name'] == 'get_names'
+    assert tracer.events[0]['cat'] == 'network'
@@ -3,35 +3,87 @@ from unittest.mock import Mock
 
 from pytest_mock.plugin import MockFixture
 
+from usc_lr_timer import cache
 from usc_lr_timer.app import MainWindow
 from usc_lr_timer.model import Model
-from usc_lr_timer.talk_to_google import Results
+from usc_lr_timer.talk_to_google import Future, Results
 from usc_lr_timer.view import View
 
 
-def test_start_timer(view: View, window: MainWindow):
+def test_start_timer(view: View, window: MainWindow, model: Model):
     window.start_button.setEnabled(True)
     view.start_timer()
     assert not window.start_button.isEnabled()
+    assert model.running
 
 
-def test_pause_timer(view: View, window: MainWindow):
-    window.start_button.setEnabled(False)
+def test_pause_timer(view: View, window: MainWindow, model: Model):
+    view.start_timer()
     view.pause_timer()
     assert window.start_button.isEnabled()
+    assert not model.running
 
 
 def test_set_categories(
-    view: View, window: MainWindow, model: Model, model_mock_ttg: Mock
+    view: View,
+    window: MainWindow,
+    model: Model,
+    model_mock_submit: Mock,
+    mocker: MockFixture,
+):
+    mocker.patch('usc_lr_timer.model.cache.load', return_value=(None, False))
+    future = model_mock_submit.return_value = Future()
+    view.set_categories()
+    assert window.categories_cb.count() == 0
+    assert not window.categories_cb.isEnabled()
+    future._resolve(Results.success, {'names': {}, 'categories': ['a', 'b']})
+    assert window.categories_cb.count() == 3
+    assert window.categories_cb.isEnabled()
+    assert model.categories == ['', 'a', 'b']
+
+
+def test_set_categories_error(
+    view: View,
+    window: MainWindow,
+    model: Model,
+    model_mock_submit: Mock,
+    mocker: MockFixture,
 ):
-    model_mock_ttg.return_value = Results.error, []
+    mock_critical = mocker.patch('usc_lr_timer.view.QMessageBox.critical')
+    mocker.patch('usc_lr_timer.model.cache.load', return_value=(None, False))
+    future = model_mock_submit.return_value = Future()
     view.set_categories()
+    future._resolve(Results.error, None, RuntimeError('Offline'))
     assert window.categories_cb.count() == 0
+    assert window.categories_cb.isEnabled()
     assert model.categories == []
-    model_mock_ttg.return_value = Results.success, ['a', 'b']
+    mock_critical.assert_called_once_with(window, 'Error', 'Offline')
+
+
+def test_set_categories_stale(
+    view: View, window: MainWindow, model: Model, mocker: MockFixture
+):
+    cache.save('abc123', {'names': {}, 'categories': ['a', 'b']})
+    mocker.patch('usc_lr_timer.cache.CACHE_TTL', -1)
+    mock_refresh = mocker.patch.object(model, 'refresh_categories')
     view.set_categories()
     assert window.categories_cb.count() == 3
-    assert model.categories == ['', 'a', 'b']
+    mock_refresh.assert_called_once_with(view.categories_refreshed)
+
+
+def test_categories_refreshed(view: View, window: MainWindow, model: Model):
+    view.categories_refreshed(False)
+    assert window.categories_cb.count() == 2
+    model._categories = ['', 'x', 'testing']
+    model.set_category_index(2)
+    view.categories_refreshed(True)
+    cats = [
+        window.categories_cb.itemText(i)
+        for i in range(window.categories_cb.count())
+    ]
+    assert cats == ['', 'x', 'testing']
+    assert window.categories_cb.currentIndex() == 2
+    assert model.category == 'testing'
 
 
 def test_semester_index(view: View, window: MainWindow, model: Model):
@@ -77,9 +129,9 @@ def test_set_manual_seconds(view: View, window: MainWindow, model: Model):
 
 
 def test_sync(
-    view: View, window: MainWindow, model: Model, model_mock_ttg: Mock
+    view: View, window: MainWindow, model: Model, model_mock_submit: Mock
 ):
-    model_mock_ttg.return_value = Results.success, ['a', 'b']
+    cache.save('abc123', {'names': {}, 'categories': ['a', 'b']})
     model._semesters = ['Summer', 'Darkness']
     model.set_manual_hours(1)
     model.set_manual_minutes(2)
@@ -101,10 +153,14 @@ def test_sync(
     assert window.duration_field.text() == '00:00:00'
 
 
-def test_increment_duration(view: View, window: MainWindow):
-    view.increment_duration(1)
-    assert window.duration_field.text() == '00:00:01'
-    view.increment_duration(60)
+def test_pause_timer_duration(
+    view: View, window: MainWindow, model: Model, mocker: MockFixture
+):
+    mock_monotonic = mocker.patch('usc_lr_timer.model.time.monotonic')
+    mock_monotonic.return_value = 100.0
+    view.start_timer()
+    mock_monotonic.return_value = 161.0
+    view.pause_timer()
     assert window.duration_field.text() == '00:01:01'
 
 
@@ -135,3 +191,17 @@ def test_reset_timer(view: View, model: Model, window: MainWindow):
     view.reset_timer()
     model.duration == timedelta()
     assert window.duration_field.text() == '00:00:00'
+
+
+def test_set_duration_field_same_second(
+    view: View, window: MainWindow, model: Model, mocker: MockFixture
+):
+    model._duration = timedelta(seconds=5.2)
+    view.set_duration_field()
+    mock_set_text = mocker.patch.object(window.duration_field, 'setText')
+    model._duration = timedelta(seconds=5.9)
+    view.set_duration_field()
+    mock_set_text.assert_not_called()
+    model._duration = timedelta(seconds=6)
+    view.set_duration_field()
+    mock_set_text.assert_called_once_with('00:00:06')
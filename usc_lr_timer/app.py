@@ -1,17 +1,31 @@
 from __future__ import annotations
 
+import argparse
+import os
+from pathlib import Path
 import sys
+from typing import Optional
 
 from PySide2 import QtCore, QtGui, QtWidgets
 
-from usc_lr_timer import talk_to_google
+from usc_lr_timer import google_sheets, talk_to_google
+from usc_lr_timer.checkpoint import Checkpointer
 from usc_lr_timer.constants import RESOURCES
 from usc_lr_timer.login import login
+from usc_lr_timer.metrics import configure_metrics, METRICS_ENV
 from usc_lr_timer.model import Model
+from usc_lr_timer.outbox import OutboxFlusher
+from usc_lr_timer.rate_limit import SHARED_ENV
+from usc_lr_timer.tracing import configure_tracing, TRACE_ENV, traced
 from usc_lr_timer.view import View
 
+# The display is refreshed this many milliseconds after the shown second
+# changes so a timer firing a little early doesn't need a second wakeup
+DISPLAY_SLACK = 5
+
 
 class MainWindow(QtWidgets.QMainWindow):
+    @traced
     def __init__(self, model: Model, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._central_widget = QtWidgets.QWidget()
@@ -92,8 +106,11 @@ class MainWindow(QtWidgets.QMainWindow):
             self._submit_button, alignment=QtCore.Qt.AlignRight,
         )
 
-        # Create 1 second timer
+        # Refreshes the duration when the shown second changes, the time
+        # itself comes from the model's clock
         self._timer = QtCore.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setTimerType(QtCore.Qt.PreciseTimer)
         self._timer.timeout.connect(self.update_duration)
 
     def init_controller(self):
@@ -106,21 +123,33 @@ class MainWindow(QtWidgets.QMainWindow):
         self.hours_input.textEdited.connect(self.set_manual_hours)
         self.minutes_input.textEdited.connect(self.set_manual_minutes)
         self.seconds_input.textEdited.connect(self.set_manual_seconds)
+        self._tab_widget.currentChanged.connect(self.update_duration)
 
     def init_view(self, model: Model):
         self.view = View(model, self)
+        # Time left on the clock when the app last closed or died
+        self._checkpointer = Checkpointer(model, self)
+        restored = self._checkpointer.restore()
         self.view.sync()
+        self._flusher = OutboxFlusher(model.outbox, self)
+        self._flusher.pending_changed.connect(self.show_pending)
+        self._flusher.flush()
+        if restored:
+            message = f'Restored {self.duration_field.text()} from last time'
+            self.statusBar().showMessage(message, 10000)
 
     def start_timer(self):
         self.view.start_timer()
-        self._timer.start(1000)
+        self._checkpointer.start()
+        self.schedule_duration_update()
 
     def pause_timer(self):
         self.view.pause_timer()
+        self._checkpointer.stop()
         self._timer.stop()
 
     def submit(self):
-        if self._timer.isActive():
+        if self.view.model.running:
             was_active = True
             self.pause_timer()
         else:
@@ -131,8 +160,15 @@ class MainWindow(QtWidgets.QMainWindow):
             if was_active:
                 self.start_timer()
         elif result.result == talk_to_google.Results.success:
-            QtWidgets.QMessageBox.information(None, 'Success', 'Updated!')
+            self._flusher.schedule()
+            # The row is only queued, the outbox sends it in the background
+            QtWidgets.QMessageBox.information(
+                None,
+                'Saved',
+                'Your time was saved and will be sent to the sheet.',
+            )
             self.view.reset_timer()
+            self._checkpointer.checkpoint(sync=True)
             self.view.set_manual_hours(0)
             self.view.set_manual_minutes(0)
             self.view.set_manual_seconds(0)
@@ -144,6 +180,7 @@ class MainWindow(QtWidgets.QMainWindow):
         if res == QtWidgets.QMessageBox.Yes:
             self.pause_timer()
             self.view.reset_timer()
+            self._checkpointer.checkpoint(sync=True)
 
     def set_semester(self, index: int):
         self.view.set_semester_index(index)
@@ -160,18 +197,83 @@ class MainWindow(QtWidgets.QMainWindow):
     def set_manual_seconds(self, seconds: str):
         self.view.set_manual_seconds(seconds)
 
+    def show_pending(self, count: int):
+        if count:
+            message = f'{count} submission(s) waiting to be sent'
+            self.statusBar().showMessage(message)
+        else:
+            self.statusBar().clearMessage()
+
+    def duration_visible(self) -> bool:
+        return self.duration_field.isVisible() and not self.isMinimized()
+
+    def schedule_duration_update(self):
+        # Sleep until the shown second changes, and not at all while the
+        # duration can't be seen
+        if not self.view.model.running or not self.duration_visible():
+            self._timer.stop()
+            return
+        milliseconds = int(self.view.model.duration.total_seconds() * 1000)
+        self._timer.start(1000 - milliseconds % 1000 + DISPLAY_SLACK)
+
     def update_duration(self):
-        self.view.increment_duration(1)
+        self.view.set_duration_field()
+        self.schedule_duration_update()
 
+    def showEvent(self, event: QtGui.QShowEvent):
+        super().showEvent(event)
+        self.update_duration()
+
+    def hideEvent(self, event: QtGui.QHideEvent):
+        super().hideEvent(event)
+        self._timer.stop()
+
+    def closeEvent(self, event: QtGui.QCloseEvent):
+        self._checkpointer.stop()
+        self._flusher.stop()
+        super().closeEvent(event)
+
+    def changeEvent(self, event: QtCore.QEvent):
+        super().changeEvent(event)
+        if event.type() == QtCore.QEvent.WindowStateChange:
+            self.update_duration()
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(prog='usc_lr_timer')
+    parser.add_argument(
+        '--trace',
+        type=Path,
+        metavar='FILE',
+        help=f'write a Chrome trace of startup to FILE, same as {TRACE_ENV}',
+    )
+    parser.add_argument(
+        '--metrics',
+        type=Path,
+        metavar='FILE',
+        help=f'write metrics of calls to Google to FILE, same as {METRICS_ENV}',
+    )
+    args, _ = parser.parse_known_args(argv)
+    configure_tracing(args.trace)
+    configure_metrics(args.metrics)
 
-def main():
     app = QtWidgets.QApplication([])
 
-    success, journal, spreadsheet_id, name = login()
+    if os.environ.get(SHARED_ENV):
+        # Kiosks running several instances share one rate limit
+        google_sheets.configure_rate_limit(shared=True)
+    if os.environ.get(google_sheets.ENDPOINT_ENV):
+        # Talk to a local emulator instead of Google
+        google_sheets.configure_endpoint(os.environ[google_sheets.ENDPOINT_ENV])
+
+    # Load the Google client while the login dialog is up
+    talk_to_google.submit(google_sheets.warm_up)
+
+    success, journal, spreadsheet_id, name, categories = login()
 
     if success:
 
-        model = Model(journal, spreadsheet_id, name)
+        model = Model(journal, spreadsheet_id, name, categories)
 
         window = MainWindow(model)
         window.show()
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import asyncio
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+import time
+from typing import Any, Optional, Union
+
+from usc_lr_timer import google_sheets, metrics
+from usc_lr_timer.cancel import bind, CancelToken
+
+THREAD_NAME = 'async_sheets'
+
+
+class AsyncSheetsClient(object):
+    # asyncio front end to google_sheets for tools that talk to many
+    # spreadsheets at once. googleapiclient blocks, so every call runs on an
+    # executor thread and shares the rate limiter and retry policy with the
+    # rest of the app. The client has max_workers connections of its own,
+    # made like the shared pool's, so that many requests run at once.
+    # Cancelling the awaiting task cancels the request.
+    def __init__(self, max_workers: Optional[int] = None):
+        if max_workers is None:
+            max_workers = google_sheets.HTTP_POOL_SIZE
+        self._executor = ThreadPoolExecutor(
+            max_workers, thread_name_prefix=THREAD_NAME
+        )
+        shared = google_sheets.http_pool()
+        self._http_pool = google_sheets.HttpPool(
+            shared.factory, max_workers, shared.idle_timeout
+        )
+
+    @property
+    def max_workers(self) -> int:
+        return self._http_pool.size
+
+    async def __aenter__(self) -> AsyncSheetsClient:
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self._http_pool.clear()
+
+    async def _run(self, fn: Callable, *args) -> Any:
+        token = CancelToken()
+        name = metrics.method_name(fn)
+        created = time.monotonic()
+
+        def call():
+            queued = time.monotonic() - created
+            with bind(token), google_sheets.bind_http_pool(
+                self._http_pool
+            ), metrics.record(name, queued):
+                token.check()
+                return fn(*args)
+
+        loop = asyncio.get_event_loop()
+        try:
+            return await loop.run_in_executor(self._executor, call)
+        except asyncio.CancelledError:
+            token.cancel()
+            raise
+
+    async def get(self, spreadsheet_id: str, sheet_range: str) -> list[list]:
+        return await self._run(
+            google_sheets.read_sheet, spreadsheet_id, sheet_range
+        )
+
+    async def batch_get(
+        self, spreadsheet_id: str, sheet_ranges: list[str]
+    ) -> list[list]:
+        return await self._run(
+            google_sheets.read_sheets, spreadsheet_id, sheet_ranges
+        )
+
+    async def append(
+        self, spreadsheet_id: str, name: str, rows: list[list]
+    ) -> dict:
+        return await self._run(
+            google_sheets.add_rows, spreadsheet_id, name, rows
+        )
+
+    async def bootstrap(self, spreadsheet_id: str) -> dict:
+        return await self._run(google_sheets.get_bootstrap, spreadsheet_id)
+
+    async def bootstraps(
+        self, spreadsheet_ids: list[str]
+    ) -> dict[str, Union[dict, Exception]]:
+        # One spreadsheet failing does not stop the others, its entry is the
+        # exception instead
+        results = await asyncio.gather(
+            *[self.bootstrap(sid) for sid in spreadsheet_ids],
+            return_exceptions=True,
+        )
+        return dict(zip(spreadsheet_ids, results))
@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+import time
+from typing import Optional
+
+from usc_lr_timer.constants import data_dir
+
+# Names and categories rarely change, so a cached copy is good enough to show
+# right away. Entries older than the TTL are still served but the caller is
+# told to refresh them in the background.
+CACHE_TTL = 12 * 60 * 60
+# The bootstrap holds every editor's PIN, so only the OS user may read the
+# cache, also on shared machines
+CACHE_DIR_MODE = 0o700
+CACHE_FILE_MODE = 0o600
+
+
+def _cache_file(spreadsheet_id: str) -> Path:
+    cache_dir = data_dir() / 'cache'
+    cache_dir.mkdir(mode=CACHE_DIR_MODE, exist_ok=True)
+    # Caches from before the modes were set
+    cache_dir.chmod(CACHE_DIR_MODE)
+    return cache_dir / f'{spreadsheet_id}.json'
+
+
+def load(
+    spreadsheet_id: str, ttl: Optional[float] = None
+) -> tuple(Optional[dict], bool):
+    if ttl is None:
+        ttl = CACHE_TTL
+    try:
+        with open(_cache_file(spreadsheet_id), encoding='utf-8') as stream:
+            entry = json.load(stream)
+        saved, data = entry['saved'], entry['data']
+    except (OSError, ValueError, KeyError, TypeError):
+        return None, False
+    return data, time.time() - saved < ttl
+
+
+def save(spreadsheet_id: str, data: dict):
+    path = _cache_file(spreadsheet_id)
+    tmp_path = path.with_suffix('.tmp')
+    fd = os.open(
+        tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, CACHE_FILE_MODE
+    )
+    with open(fd, 'w', encoding='utf-8') as stream:
+        json.dump({'saved': time.time(), 'data': data}, stream)
+    os.replace(tmp_path, path)
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+from collections.abc import Callable
+from contextlib import contextmanager
+import threading
+import time
+from typing import Optional
+
+
+class Canceled(Exception):
+    # sent is True when the request was on the wire when it was canceled, so
+    # Google may still have handled it
+    def __init__(self, sent: bool = False):
+        super().__init__('Canceled')
+        self.sent = sent
+
+
+class CancelToken(object):
+    # Cooperative cancellation for one background call. The call checks the
+    # token between steps and registers callbacks that abort blocking work,
+    # like a request waiting on a socket. With a timeout the token cancels
+    # itself once the deadline has passed.
+    def __init__(self, timeout: Optional[float] = None):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        if timeout is None:
+            self._deadline = None
+        else:
+            self._deadline = time.monotonic() + timeout
+
+    @property
+    def canceled(self) -> bool:
+        if self._event.is_set():
+            return True
+        if self._deadline is not None and time.monotonic() >= self._deadline:
+            self.cancel()
+            return True
+        return False
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def check(self, sent: bool = False):
+        if self.canceled:
+            raise Canceled(sent)
+
+    def sleep(self, seconds: float):
+        # Wakes up as soon as the token is canceled
+        if self._deadline is not None:
+            seconds = min(seconds, max(self._deadline - time.monotonic(), 0.0))
+        self._event.wait(seconds)
+        self.check()
+
+    @contextmanager
+    def on_cancel(self, callback: Callable):
+        # callback is called from the canceling thread if the token is
+        # canceled while the block runs
+        self.check()
+        with self._lock:
+            if self._event.is_set():
+                raise Canceled()
+            self._callbacks.append(callback)
+        try:
+            yield
+        finally:
+            with self._lock:
+                if callback in self._callbacks:
+                    self._callbacks.remove(callback)
+
+
+_local = threading.local()
+
+
+def current() -> Optional[CancelToken]:
+    return getattr(_local, 'token', None)
+
+
+@contextmanager
+def bind(token: CancelToken):
+    # Make token the one checked by code running in this thread
+    previous = current()
+    _local.token = token
+    try:
+        yield token
+    finally:
+        _local.token = previous
+
+
+def check(sent: bool = False):
+    token = current()
+    if token is not None:
+        token.check(sent)
+
+
+def sleep(seconds: float):
+    token = current()
+    if token is None:
+        time.sleep(seconds)
+    else:
+        token.sleep(seconds)
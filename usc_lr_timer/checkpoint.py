@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from pathlib import Path
+import time
+from typing import Optional
+
+from PySide2 import QtCore
+
+from usc_lr_timer.constants import data_dir
+from usc_lr_timer.model import Model
+
+CHECKPOINT_DIR = 'checkpoints'
+# Seconds between checkpoints while the timer runs. At most this much time is
+# lost if the app dies.
+CHECKPOINT_INTERVAL = 30
+# Checkpoints of a running timer are flushed to disk at most this often,
+# pausing, resetting and closing always flush
+SYNC_INTERVAL = 5 * 60
+
+
+def _checkpoint_file(spreadsheet_id: str, name: str) -> Path:
+    # One file per user and journal, so people sharing a machine never
+    # overwrite or clear each other's checkpoint
+    checkpoint_dir = data_dir() / CHECKPOINT_DIR
+    checkpoint_dir.mkdir(exist_ok=True)
+    key = f'{spreadsheet_id}\n{name}'.encode('utf-8')
+    return checkpoint_dir / f'{hashlib.sha256(key).hexdigest()[:32]}.json'
+
+
+def load(spreadsheet_id: str, name: str) -> Optional[dict]:
+    # Only the same user on the same journal gets their time back
+    try:
+        path = _checkpoint_file(spreadsheet_id, name)
+        with open(path, encoding='utf-8') as stream:
+            state = json.load(stream)
+        if (state['spreadsheet_id'], state['name']) != (spreadsheet_id, name):
+            return None
+        state['duration'] = float(state['duration'])
+        if state.get('running'):
+            # The timer was running when the app died. Count it up to the
+            # last checkpoint, nothing after that is known.
+            ran = float(state['saved']) - float(state['started'])
+            state['duration'] += max(ran, 0.0)
+            state['running'] = False
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    return state
+
+
+def save(state: dict, sync: bool = False):
+    path = _checkpoint_file(state['spreadsheet_id'], state['name'])
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as stream:
+        json.dump(dict(state, saved=time.time()), stream)
+        if sync:
+            stream.flush()
+            os.fsync(stream.fileno())
+    os.replace(tmp_path, path)
+
+
+def clear(spreadsheet_id: str, name: str):
+    try:
+        os.remove(_checkpoint_file(spreadsheet_id, name))
+    except FileNotFoundError:
+        pass
+
+
+class Checkpointer(QtCore.QObject):
+    # Saves the model's timer state every CHECKPOINT_INTERVAL seconds while
+    # it runs so a crash or power loss doesn't lose the session
+    def __init__(self, model: Model, parent: QtCore.QObject = None):
+        super().__init__(parent)
+        self._model = model
+        self._last_sync = 0.0
+        self._timer = QtCore.QTimer(self)
+        self._timer.setTimerType(QtCore.Qt.VeryCoarseTimer)
+        self._timer.setInterval(CHECKPOINT_INTERVAL * 1000)
+        self._timer.timeout.connect(self.checkpoint)
+
+    @property
+    def active(self) -> bool:
+        return self._timer.isActive()
+
+    def restore(self) -> bool:
+        state = load(self._model.sheet_id, self._model.name)
+        if state is None:
+            return False
+        self._model.restore(state)
+        return True
+
+    def start(self):
+        self.checkpoint(sync=True)
+        self._timer.start()
+
+    def stop(self):
+        self._timer.stop()
+        self.checkpoint(sync=True)
+
+    @QtCore.Slot()
+    def checkpoint(self, sync: bool = False):
+        state = self._model.checkpoint()
+        if not state['duration'] and not state['running']:
+            clear(state['spreadsheet_id'], state['name'])
+            return
+        # Replacing the file is cheap, flushing it to disk is not
+        now = time.monotonic()
+        sync = sync or now - self._last_sync >= SYNC_INTERVAL
+        save(state, sync)
+        if sync:
+            self._last_sync = now
@@ -1,3 +1,11 @@
+import os
 from pathlib import Path
 
 RESOURCES = (Path(__file__) / '..' / 'resources').resolve().absolute()
+DATA_DIR_ENV = 'USC_LR_TIMER_DATA_DIR'
+
+
+def data_dir() -> Path:
+    path = Path(os.environ.get(DATA_DIR_ENV, Path.home() / '.usc_lr_timer'))
+    path.mkdir(parents=True, exist_ok=True)
+    return path
@@ -0,0 +1,598 @@
+from __future__ import annotations
+
+import argparse
+from collections import deque, namedtuple
+import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import re
+import threading
+import time
+from typing import Optional
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from usc_lr_timer.constants import RESOURCES
+
+# In memory stand in for the Sheets v4 values.get, values.batchGet and
+# values.append endpoints. Point google_sheets at it with configure_endpoint
+# or the USC_LR_TIMER_SHEETS_ENDPOINT environment variable.
+HOST = '127.0.0.1'
+PORT = 8080
+NAMES_SHEET = 'Names'
+CATEGORIES_SHEET = 'Categories'
+SUBMISSIONS_SHEET = 'Submissions'
+# First row of each sheet in the journal spreadsheets
+HEADERS = {
+    NAMES_SHEET: ['Name', 'Pin'],
+    CATEGORIES_SHEET: ['Category'],
+    SUBMISSIONS_SHEET: [
+        'Name',
+        'Semester',
+        'Duration',
+        'Date',
+        'Category',
+        'Submission ID',
+    ],
+}
+# Seconds over which the request quota is counted, like Google's per minute
+# quotas
+QUOTA_WINDOW = 60.0
+STATUSES = {
+    400: 'INVALID_ARGUMENT',
+    404: 'NOT_FOUND',
+    429: 'RESOURCE_EXHAUSTED',
+    503: 'UNAVAILABLE',
+}
+
+Range = namedtuple('Range', ['sheet', 'top', 'left', 'bottom', 'right'])
+
+_CELLS = re.compile(r'^([A-Z]*)(\d*)$')
+_BATCH_GET = re.compile(r'^/v4/spreadsheets/([^/]+)/values:batchGet$')
+_APPEND = re.compile(r'^/v4/spreadsheets/([^/]+)/values/(.+):append$')
+_GET = re.compile(r'^/v4/spreadsheets/([^/]+)/values/(.+)$')
+
+
+class SheetsError(Exception):
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+    def to_json(self) -> dict:
+        return {
+            'error': {
+                'code': self.code,
+                'message': self.message,
+                'status': STATUSES[self.code],
+            }
+        }
+
+
+def _column(letters: str) -> int:
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index - 1
+
+
+def _letters(column: int) -> str:
+    letters = ''
+    column += 1
+    while column:
+        column, remainder = divmod(column - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def _cell(text: str, sheet_range: str) -> tuple[Optional[int], Optional[int]]:
+    match = _CELLS.match(text.upper())
+    if match is None or not text:
+        raise SheetsError(400, f'Unable to parse range: {sheet_range}')
+    letters, digits = match.groups()
+    column = _column(letters) if letters else None
+    row = int(digits) - 1 if digits else None
+    return row, column
+
+
+def parse_range(sheet_range: str) -> Range:
+    # Zero based, bottom and right are exclusive and None when the range is
+    # open ended
+    sheet, _, cells = sheet_range.partition('!')
+    if sheet.startswith("'") and sheet.endswith("'"):
+        sheet = sheet[1:-1].replace("''", "'")
+    if not cells:
+        return Range(sheet, 0, 0, None, None)
+    start, _, end = cells.partition(':')
+    top, left = _cell(start, sheet_range)
+    if end:
+        bottom, right = _cell(end, sheet_range)
+    else:
+        bottom, right = top, left
+    return Range(
+        sheet,
+        top or 0,
+        left or 0,
+        None if bottom is None else bottom + 1,
+        None if right is None else right + 1,
+    )
+
+
+def _field_paths(fields: str) -> list[str]:
+    # 'a/b,c(d,e)' selects a/b, c/d and c/e
+    parts = []
+    depth = start = 0
+    for i, char in enumerate(fields):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and not depth:
+            parts.append(fields[start:i])
+            start = i + 1
+    parts.append(fields[start:])
+    paths = []
+    for part in parts:
+        part = part.strip()
+        if '(' in part:
+            prefix, _, inner = part.partition('(')
+            if not inner.endswith(')'):
+                raise SheetsError(400, f'Invalid field selection {fields}')
+            paths += [f'{prefix}/{path}' for path in _field_paths(inner[:-1])]
+        elif part:
+            paths.append(part)
+    return paths
+
+
+def _select(value: object, tree: dict) -> object:
+    if not tree:
+        return value
+    if isinstance(value, list):
+        return [_select(item, tree) for item in value]
+    if isinstance(value, dict):
+        return {
+            key: _select(value[key], subtree)
+            for key, subtree in tree.items()
+            if key in value
+        }
+    return value
+
+
+def mask(result: dict, fields: str) -> dict:
+    # Keeps only the selected fields, like the fields parameter of Google's
+    # APIs
+    tree = {}
+    for path in _field_paths(fields):
+        node = tree
+        for key in path.split('/'):
+            node = node.setdefault(key, {})
+    return _select(result, tree)
+
+
+def _trim(cells: list) -> list:
+    # Google leaves out trailing empty cells and rows
+    end = len(cells)
+    while end and cells[end - 1] in ('', None, []):
+        end -= 1
+    return cells[:end]
+
+
+class SheetsBackend(object):
+    # The spreadsheets, each a dict of sheet name to rows of cells
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spreadsheets = {}
+
+    @property
+    def spreadsheet_ids(self) -> list[str]:
+        with self._lock:
+            return list(self._spreadsheets)
+
+    def create(
+        self,
+        spreadsheet_id: str,
+        names: Optional[dict[str, str]] = None,
+        categories: Optional[list[str]] = None,
+        submissions: Optional[list[list]] = None,
+    ):
+        # Laid out like the journal template
+        names = names or {}
+        sheets = {
+            NAMES_SHEET: [HEADERS[NAMES_SHEET]]
+            + [[name, pin] for name, pin in names.items()],
+            CATEGORIES_SHEET: [HEADERS[CATEGORIES_SHEET]]
+            + [[category] for category in categories or []],
+            SUBMISSIONS_SHEET: [HEADERS[SUBMISSIONS_SHEET]]
+            + [list(row) for row in submissions or []],
+        }
+        with self._lock:
+            self._spreadsheets[spreadsheet_id] = sheets
+
+    def rows(self, spreadsheet_id: str, sheet: str) -> list[list]:
+        with self._lock:
+            return [row[:] for row in self._sheet(spreadsheet_id, sheet)]
+
+    def _sheet(self, spreadsheet_id: str, sheet: str) -> list[list]:
+        spreadsheet = self._spreadsheets.get(spreadsheet_id)
+        if spreadsheet is None:
+            raise SheetsError(404, 'Requested entity was not found.')
+        if sheet not in spreadsheet:
+            raise SheetsError(400, f'Unable to parse range: {sheet}')
+        return spreadsheet[sheet]
+
+    def get(
+        self,
+        spreadsheet_id: str,
+        sheet_range: str,
+        major_dimension: str = 'ROWS',
+    ) -> dict:
+        sheet, top, left, bottom, right = parse_range(sheet_range)
+        with self._lock:
+            rows = self._sheet(spreadsheet_id, sheet)[top:bottom]
+            values = _trim([_trim(row[left:right]) for row in rows])
+        if major_dimension == 'COLUMNS':
+            width = max([len(row) for row in values], default=0)
+            values = [
+                _trim([row[i] if i < len(row) else '' for row in values])
+                for i in range(width)
+            ]
+        elif major_dimension != 'ROWS':
+            raise SheetsError(400, f'Invalid majorDimension: {major_dimension}')
+        value_range = {'range': sheet_range, 'majorDimension': major_dimension}
+        # Like Google, an empty range has no values key
+        if values:
+            value_range['values'] = values
+        return value_range
+
+    def batch_get(
+        self,
+        spreadsheet_id: str,
+        sheet_ranges: list[str],
+        major_dimension: str = 'ROWS',
+    ) -> dict:
+        return {
+            'spreadsheetId': spreadsheet_id,
+            'valueRanges': [
+                self.get(spreadsheet_id, sheet_range, major_dimension)
+                for sheet_range in sheet_ranges
+            ],
+        }
+
+    def append(
+        self, spreadsheet_id: str, sheet_range: str, values: list[list]
+    ) -> dict:
+        # Rows go after the last row with anything in it
+        cells = parse_range(sheet_range)
+        with self._lock:
+            rows = self._sheet(spreadsheet_id, cells.sheet)
+            top = len(rows)
+            while top and not _trim(rows[top - 1]):
+                top -= 1
+            del rows[top:]
+            for row in values:
+                rows.append([''] * cells.left + list(row))
+        width = max([len(row) for row in values], default=0)
+        first = f'{_letters(cells.left)}{top + 1}'
+        last = f'{_letters(cells.left + max(width, 1) - 1)}{top + len(values)}'
+        return {
+            'spreadsheetId': spreadsheet_id,
+            'updates': {
+                'spreadsheetId': spreadsheet_id,
+                'updatedRange': f'{cells.sheet}!{first}:{last}',
+                'updatedRows': len(values),
+                'updatedColumns': width,
+                'updatedCells': sum(len(row) for row in values),
+            },
+        }
+
+
+class Faults(object):
+    # What goes wrong and how slowly. error_rate requests fail with a 503
+    # before touching the spreadsheet, late_error_rate ones fail after an
+    # append has been applied, like a response lost on the way back. More
+    # than quota requests in QUOTA_WINDOW seconds get a 429.
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        late_error_rate: float = 0.0,
+        quota: Optional[int] = None,
+        seed: Optional[int] = None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.late_error_rate = late_error_rate
+        self.quota = quota
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._requests = deque()
+
+    def delay(self) -> float:
+        with self._lock:
+            jitter = self._random.uniform(0, self.jitter)
+        return self.latency + jitter
+
+    def _chance(self, rate: float) -> bool:
+        with self._lock:
+            return self._random.random() < rate
+
+    def fail(self) -> bool:
+        return self._chance(self.error_rate)
+
+    def fail_late(self) -> bool:
+        return self._chance(self.late_error_rate)
+
+    def throttled(self, now: Optional[float] = None) -> bool:
+        if self.quota is None:
+            return False
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            while self._requests and self._requests[0] <= now - QUOTA_WINDOW:
+                self._requests.popleft()
+            if len(self._requests) >= self.quota:
+                return True
+            self._requests.append(now)
+            return False
+
+
+class Emulator(object):
+    def __init__(
+        self,
+        backend: Optional[SheetsBackend] = None,
+        faults: Optional[Faults] = None,
+        host: str = HOST,
+        port: int = 0,
+    ):
+        # port 0 picks a free port. The socket is only opened by bind, start
+        # or serve_forever, EmulatorHttp talks to the emulator without it.
+        self.backend = backend if backend is not None else SheetsBackend()
+        self.faults = faults if faults is not None else Faults()
+        self._address = (host, port)
+        self._stats_lock = threading.Lock()
+        self._stats = {'requests': 0, 'throttled': 0, 'errors': 0}
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        if self._server is None:
+            raise RuntimeError('The emulator is not bound')
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    @property
+    def stats(self) -> dict[str, int]:
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def _count(self, stat: str):
+        with self._stats_lock:
+            self._stats[stat] += 1
+
+    def __enter__(self) -> Emulator:
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def bind(self):
+        # Opens the socket, after which url is known. start and
+        # serve_forever bind if it hasn't been done yet.
+        if self._server is not None:
+            return
+        self._server = ThreadingHTTPServer(self._address, _Handler)
+        self._server.daemon_threads = True
+        self._server.emulator = self
+
+    def start(self):
+        self.bind()
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name='emulator', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        if self._server is None:
+            return
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+        self._server = None
+
+    def serve_forever(self):
+        self.bind()
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            self._server = None
+
+    def handle(
+        self, method: str, path: str, query: dict[str, list[str]], body: bytes
+    ) -> tuple[int, dict]:
+        # Returns the status and JSON body of the response
+        self._count('requests')
+        time.sleep(self.faults.delay())
+        try:
+            if self.faults.throttled():
+                self._count('throttled')
+                raise SheetsError(429, 'Quota exceeded for quota metric.')
+            if self.faults.fail():
+                self._count('errors')
+                raise SheetsError(503, 'The service is currently unavailable.')
+            result = self._route(method, unquote(path), query, body)
+            if query.get('fields'):
+                result = mask(result, query['fields'][0])
+            if method == 'POST' and self.faults.fail_late():
+                self._count('errors')
+                raise SheetsError(503, 'The service is currently unavailable.')
+        except SheetsError as error:
+            return error.code, error.to_json()
+        return 200, result
+
+    def _route(
+        self, method: str, path: str, query: dict[str, list[str]], body: bytes
+    ) -> dict:
+        major_dimension = query.get('majorDimension', ['ROWS'])[0]
+        match = _BATCH_GET.match(path)
+        if match and method == 'GET':
+            return self.backend.batch_get(
+                match.group(1), query.get('ranges', []), major_dimension
+            )
+        match = _APPEND.match(path)
+        if match and method == 'POST':
+            if 'valueInputOption' not in query:
+                raise SheetsError(400, "'valueInputOption' is required")
+            try:
+                values = json.loads(body or b'{}').get('values', [])
+            except ValueError:
+                raise SheetsError(400, 'Invalid JSON payload received.')
+            return self.backend.append(match.group(1), match.group(2), values)
+        match = _GET.match(path)
+        if match and method == 'GET':
+            return self.backend.get(
+                match.group(1), match.group(2), major_dimension
+            )
+        raise SheetsError(404, f'Method not found: {method} {path}')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep alive, like Google, so the client's pooled connections are reused
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format: str, *args):
+        pass
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def _handle(self, method: str):
+        url = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        status, result = self.server.emulator.handle(
+            method, url.path, parse_qs(url.query), body
+        )
+        content = json.dumps(result).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            content = gzip.compress(content)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        try:
+            self.wfile.write(content)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client aborted the request
+            pass
+
+
+class EmulatorHttp(object):
+    # Stand in for httplib2.Http that hands requests straight to an emulator
+    # without a socket, for benchmarks that should only measure the client.
+    # Use it as the google_sheets http pool factory.
+    def __init__(self, emulator: Emulator):
+        self._emulator = emulator
+        self.connections = {}
+
+    def request(
+        self,
+        uri: str,
+        method: str = 'GET',
+        body: Optional[str] = None,
+        headers: Optional[dict] = None,
+        **kwargs,
+    ) -> tuple:
+        import httplib2
+
+        url = urlsplit(uri)
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        status, result = self._emulator.handle(
+            method, url.path, parse_qs(url.query), body or b''
+        )
+        content = json.dumps(result).encode('utf-8')
+        response = httplib2.Response(
+            {
+                'status': status,
+                'content-type': 'application/json; charset=UTF-8',
+                'content-length': str(len(content)),
+            }
+        )
+        return response, content
+
+
+def _journal_ids() -> list[str]:
+    try:
+        with open(RESOURCES / 'journal_mapping.json') as stream:
+            return list(json.load(stream).values())
+    except OSError:
+        return []
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog='python -m usc_lr_timer.emulator',
+        description='Serve in memory journal spreadsheets over the Sheets API',
+    )
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument(
+        '--spreadsheet',
+        action='append',
+        metavar='ID',
+        help='spreadsheet to serve, defaults to the journals in the mapping',
+    )
+    parser.add_argument(
+        '--name',
+        action='append',
+        default=[],
+        metavar='NAME:PIN',
+        help='user in every spreadsheet',
+    )
+    parser.add_argument(
+        '--category',
+        action='append',
+        default=[],
+        help='category in every spreadsheet',
+    )
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--late-error-rate', type=float, default=0.0)
+    parser.add_argument(
+        '--quota', type=int, help=f'requests per {QUOTA_WINDOW:g} seconds'
+    )
+    args = parser.parse_args(argv)
+
+    backend = SheetsBackend()
+    names = dict(name.split(':', 1) for name in args.name)
+    for spreadsheet_id in args.spreadsheet or _journal_ids():
+        backend.create(spreadsheet_id, names, args.category)
+    faults = Faults(
+        args.latency,
+        args.jitter,
+        args.error_rate,
+        args.late_error_rate,
+        args.quota,
+    )
+    emulator = Emulator(backend, faults, args.host, args.port)
+    emulator.bind()
+    print(f'Serving {", ".join(backend.spreadsheet_ids)} at {emulator.url}')
+    try:
+        emulator.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,75 +1,567 @@
 from __future__ import annotations
 
+from collections.abc import Callable
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from functools import lru_cache, reduce
+from functools import lru_cache
+from itertools import chain
+import json
+import socket
+from threading import BoundedSemaphore, local, Lock
+import time
+from typing import Optional, TYPE_CHECKING
+from urllib.request import urlopen
+from uuid import uuid4
 
-from google.oauth2 import service_account
-from googleapiclient.discovery import build, Resource
+from usc_lr_timer import cancel, metrics
+from usc_lr_timer.constants import data_dir, RESOURCES
+from usc_lr_timer.rate_limit import CAPACITY, RATE, RateLimiter
+from usc_lr_timer.retry import RetryPolicy
 
-from usc_lr_timer.constants import RESOURCES
+# The Google client libraries take longer to import than the rest of the app
+# put together, so they are imported where they are first used, on a pool
+# thread, and the login dialog doesn't wait for them
+if TYPE_CHECKING:
+    from google.oauth2 import service_account
+    from google_auth_httplib2 import AuthorizedHttp
+    from googleapiclient.discovery import Resource
+    from googleapiclient.http import HttpRequest
+    import httplib2
 
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
 SERVICE_ACCOUNT_FILE = RESOURCES / 'svc.json'
 DATE_FMT = '%m/%d/%Y %H:%M:%S'
+# Pinned copy of the Sheets v4 discovery document so building a service never
+# has to fetch it. Use check_discovery_document (inv check-discovery) to find
+# out whether Google has published a newer revision.
+DISCOVERY_FILE = RESOURCES / 'sheets_v4_discovery.json'
+DISCOVERY_URL = 'https://sheets.googleapis.com/$discovery/rest?version=v4'
+NAMES_RANGE = 'Names!A2:B'
+CATEGORIES_RANGE = 'Categories!A2:A'
+SUBMISSIONS_SHEET = 'Submissions'
+# Every submission carries a client generated id in column F so a retried
+# append can be checked against what already reached the sheet
+SUBMISSION_ID_COLUMN = 5
+SUBMISSION_IDS_RANGE = 'Submissions!F2:F'
+# One column ranges are read as COLUMNS, a single list of values is smaller
+# to send and parse than a one value list per row
+ROWS = 'ROWS'
+COLUMNS = 'COLUMNS'
+# Values as the sheet shows them, pins like 0042 would lose their zeros
+# unformatted
+FORMATTED_VALUE = 'FORMATTED_VALUE'
+UNFORMATTED_VALUE = 'UNFORMATTED_VALUE'
+# Field masks so responses only carry what is read. Nothing reads an
+# append's response past it succeeding.
+READ_FIELDS = 'values'
+BATCH_READ_FIELDS = 'valueRanges/values'
+APPEND_FIELDS = 'updates/updatedRows'
+HTTP_POOL_SIZE = 4
+HTTP_IDLE_TIMEOUT = 60.0
+# Seconds a request may wait on the socket before it fails
+REQUEST_TIMEOUT = 30.0
+# Root url of a Sheets API stand in, like usc_lr_timer.emulator, to send
+# every request to instead of Google
+ENDPOINT_ENV = 'USC_LR_TIMER_SHEETS_ENDPOINT'
+_endpoint: Optional[str] = None
+
+# Building a service parses the discovery document and creates a new http
+# client, so services are built once per credentials/spreadsheet and reused.
+_services: dict[tuple, Resource] = {}
+# Building a resource generates every method and its docstring, tens of
+# milliseconds, so each service's values resource is built once too
+_values: dict[Resource, Resource] = {}
+_services_lock = Lock()
+
+
+def _refuse_connect():
+    raise cancel.Canceled(sent=True)
+
+
+class HttpPool(object):
+    # httplib2 keeps connections alive per Http object but is not thread
+    # safe, so each worker checks out its own transport and returns it when
+    # the request is done. Transports idle longer than idle_timeout are
+    # closed instead of being reused.
+    def __init__(self, factory: Callable, size: int, idle_timeout: float):
+        if size < 1:
+            raise ValueError('Pool size must be at least 1')
+        self._factory = factory
+        self._size = size
+        self._idle_timeout = idle_timeout
+        self._idle = []
+        self._lock = Lock()
+        self._slots = BoundedSemaphore(size)
+
+    @property
+    def factory(self) -> Callable:
+        return self._factory
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def idle_timeout(self) -> float:
+        return self._idle_timeout
+
+    @property
+    def idle_count(self) -> int:
+        with self._lock:
+            return len(self._idle)
+
+    @staticmethod
+    def _close(http):
+        connections, http.connections = http.connections, {}
+        for connection in connections.values():
+            connection.close()
+
+    @staticmethod
+    def abort(http):
+        # Unblock a request waiting on one of http's sockets from another
+        # thread. The request fails and the transport has to be closed.
+        # httplib2 takes the closed socket for a stale connection and sends
+        # the request again on a new one, so the connections are made to
+        # refuse that first.
+        for connection in list(http.connections.values()):
+            connection.connect = _refuse_connect
+            sock = getattr(connection, 'sock', None)
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def _checkout(self):
+        now = time.monotonic()
+        with self._lock:
+            while self._idle:
+                http, last_used = self._idle.pop()
+                if now - last_used < self._idle_timeout:
+                    return http
+                self._close(http)
+        return self._factory()
+
+    def _checkin(self, http):
+        with self._lock:
+            self._idle.append((http, time.monotonic()))
+
+    @contextmanager
+    def connection(self):
+        with self._slots:
+            http = self._checkout()
+            aborted = False
+            try:
+                yield http
+            except cancel.Canceled:
+                aborted = True
+                raise
+            finally:
+                if aborted:
+                    self._close(http)
+                else:
+                    self._checkin(http)
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for http, _ in idle:
+            self._close(http)
 
 
 @lru_cache(1)
 def get_credentials() -> service_account.Credentials:
+    from google.oauth2 import service_account
+
     return service_account.Credentials.from_service_account_file(
         str(SERVICE_ACCOUNT_FILE), scopes=SCOPES,
     )
 
 
-def get_spreadsheets_values() -> Resource:
+class SubmissionIndex(object):
+    # Ids known to be in each spreadsheet. Only that an id is in the sheet
+    # can be cached: an append that failed, another app instance or an
+    # instance taking over rows may have written any id since, so an id
+    # missing from the cache reloads the ids from the sheet.
+    def __init__(self):
+        self._lock = Lock()
+        self._ids = {}
+
+    def known(self, spreadsheet_id: str, ids: list[str]) -> set[str]:
+        with self._lock:
+            cached = self._ids.get(spreadsheet_id)
+            if cached is not None and cached.issuperset(ids):
+                return set(ids)
+        cached = get_submission_ids(spreadsheet_id)
+        with self._lock:
+            self._ids[spreadsheet_id] = cached
+        return cached.intersection(ids)
+
+    def add(self, spreadsheet_id: str, ids: list[str]):
+        with self._lock:
+            if spreadsheet_id in self._ids:
+                self._ids[spreadsheet_id].update(ids)
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+
+
+_submission_index = SubmissionIndex()
+
+
+def _authorized_http() -> AuthorizedHttp:
+    from google_auth_httplib2 import AuthorizedHttp
+    import httplib2
+
+    return AuthorizedHttp(
+        get_credentials(), http=httplib2.Http(timeout=REQUEST_TIMEOUT)
+    )
+
+
+def _new_http() -> httplib2.Http:
+    if _endpoint is None:
+        return _authorized_http()
+    # The stand in doesn't check credentials
+    import httplib2
+
+    return httplib2.Http(timeout=REQUEST_TIMEOUT)
+
+
+_http_pool = HttpPool(_new_http, HTTP_POOL_SIZE, HTTP_IDLE_TIMEOUT)
+_local = local()
+
+
+def http_pool() -> HttpPool:
+    # The pool bound to this thread, or else the shared one
+    return getattr(_local, 'http_pool', None) or _http_pool
+
+
+@contextmanager
+def bind_http_pool(pool: HttpPool):
+    # Make requests sent from this thread use pool
+    previous = getattr(_local, 'http_pool', None)
+    _local.http_pool = pool
+    try:
+        yield pool
+    finally:
+        _local.http_pool = previous
+
+
+def configure_http_pool(
+    size: int = HTTP_POOL_SIZE,
+    idle_timeout: float = HTTP_IDLE_TIMEOUT,
+    factory: Optional[Callable] = None,
+) -> HttpPool:
+    # factory makes the transports, by default authorized httplib2 clients
+    global _http_pool
+    old_pool = _http_pool
+    _http_pool = HttpPool(factory or _new_http, size, idle_timeout)
+    old_pool.clear()
+    return _http_pool
+
+
+_retry_policy = RetryPolicy()
+_rate_limiter = RateLimiter()
+
+
+def configure_retry(policy: RetryPolicy) -> RetryPolicy:
+    global _retry_policy
+    _retry_policy = policy
+    return _retry_policy
+
+
+def configure_rate_limit(
+    rate: float = RATE, capacity: float = CAPACITY, shared: bool = False
+) -> RateLimiter:
+    # shared makes every app instance on this machine use the same buckets
+    global _rate_limiter
+    shared_dir = data_dir() / 'rate_limit' if shared else None
+    _rate_limiter = RateLimiter(rate, capacity, shared_dir)
+    return _rate_limiter
+
+
+@lru_cache(1)
+def get_discovery_document() -> dict:
+    with open(DISCOVERY_FILE, encoding='utf-8') as stream:
+        return json.load(stream)
+
+
+def check_discovery_document(timeout: float = 10) -> tuple(bool, str, str):
+    with urlopen(DISCOVERY_URL, timeout=timeout) as response:
+        latest = json.load(response)['revision']
+    pinned = get_discovery_document()['revision']
+    return latest == pinned, pinned, latest
+
+
+def get_service(spreadsheet_id: Optional[str] = None) -> Resource:
+    from googleapiclient.discovery import build_from_document
+
+    if _endpoint is not None:
+        return _get_emulated_service(spreadsheet_id)
     creds = get_credentials()
-    service = build('sheets', 'v4', credentials=creds)
-    sheet = service.spreadsheets()
-    values = sheet.values()
+    key = (creds, spreadsheet_id)
+    with _services_lock:
+        service = _services.get(key)
+        if service is None:
+            service = build_from_document(
+                get_discovery_document(), credentials=creds,
+            )
+            _services[key] = service
+    return service
+
+
+def _get_emulated_service(spreadsheet_id: Optional[str] = None) -> Resource:
+    from googleapiclient.discovery import build_from_document
+    import httplib2
+
+    key = (_endpoint, spreadsheet_id)
+    with _services_lock:
+        service = _services.get(key)
+        if service is None:
+            # Requests are sent with a transport from the pool, this http is
+            # only there so no credentials are looked up
+            service = build_from_document(
+                get_discovery_document(),
+                http=httplib2.Http(timeout=REQUEST_TIMEOUT),
+                client_options={'api_endpoint': _endpoint},
+            )
+            _services[key] = service
+    return service
+
+
+def configure_endpoint(endpoint: Optional[str] = None) -> Optional[str]:
+    # Sends requests to endpoint instead of Google, None switches back
+    global _endpoint
+    if endpoint is not None and not endpoint.endswith('/'):
+        endpoint += '/'
+    _endpoint = endpoint
+    invalidate_services()
+    return _endpoint
+
+
+def warm_up():
+    # Imports the client libraries and builds the default service ahead of
+    # the first request
+    get_service()
+
+
+def invalidate_services(spreadsheet_id: Optional[str] = None):
+    with _services_lock:
+        if spreadsheet_id is None:
+            _services.clear()
+            _values.clear()
+            _http_pool.clear()
+        else:
+            for key in [k for k in _services if k[1] == spreadsheet_id]:
+                _values.pop(_services.pop(key), None)
+
+
+def get_spreadsheets_values(spreadsheet_id: Optional[str] = None) -> Resource:
+    service = get_service(spreadsheet_id)
+    with _services_lock:
+        values = _values.get(service)
+        if values is None:
+            values = service.spreadsheets().values()
+            _values[service] = values
     return values
 
 
-def read_sheet(spreadsheet_id: str, sheet_range: str) -> list[list]:
-    values = get_spreadsheets_values()
-    result = values.get(
-        spreadsheetId=spreadsheet_id, range=sheet_range,
-    ).execute()
-    return result['values']
+def _execute_once(request: HttpRequest, spreadsheet_id: str) -> dict:
+    # Checks the calling thread's cancel token before sending and aborts the
+    # request if the token is canceled while it is in flight
+    cancel.check()
+    throttled = _rate_limiter.acquire(spreadsheet_id)
+    metrics.count_request(spreadsheet_id, request.body, throttled)
+    token = cancel.current()
+    try:
+        with http_pool().connection() as http:
+            if token is None:
+                return request.execute(http=http)
+            with token.on_cancel(lambda: HttpPool.abort(http)):
+                try:
+                    return request.execute(http=http)
+                except Exception as error:
+                    if token.canceled:
+                        raise cancel.Canceled(sent=True) from error
+                    raise
+    except Exception as error:
+        from googleapiclient.errors import HttpError
 
+        # Error responses never reach postproc
+        if isinstance(error, HttpError):
+            metrics.count_received(error.content)
+        raise
 
-def add_row(spreadsheet_id: str, name: str, values: list) -> dict:
-    body = {'values': [values]}
-    values = get_spreadsheets_values()
-    result = values.append(
+
+def _execute(
+    request: HttpRequest, spreadsheet_id: str, idempotent: bool = True
+) -> dict:
+    # postproc parses the response body, only the attempt that succeeds gets
+    # that far. Failed attempts are counted by _execute_once.
+    postproc = request.postproc
+
+    def measured(resp: httplib2.Response, content: bytes) -> dict:
+        metrics.count_received(content)
+        return postproc(resp, content)
+
+    request.postproc = measured
+    return _retry_policy.call(
+        lambda: _execute_once(request, spreadsheet_id), idempotent
+    )
+
+
+def read_sheet(
+    spreadsheet_id: str,
+    sheet_range: str,
+    major_dimension: str = ROWS,
+    value_render_option: str = FORMATTED_VALUE,
+    fields: Optional[str] = READ_FIELDS,
+) -> list[list]:
+    # fields None asks for the whole response
+    values = get_spreadsheets_values(spreadsheet_id)
+    request = values.get(
+        spreadsheetId=spreadsheet_id,
+        range=sheet_range,
+        majorDimension=major_dimension,
+        valueRenderOption=value_render_option,
+        fields=fields,
+    )
+    result = _execute(request, spreadsheet_id)
+    # An empty range comes back without a values key
+    return result.get('values', [])
+
+
+def read_sheets(
+    spreadsheet_id: str,
+    sheet_ranges: list[str],
+    major_dimension: str = ROWS,
+    value_render_option: str = FORMATTED_VALUE,
+    fields: Optional[str] = BATCH_READ_FIELDS,
+) -> list[list]:
+    values = get_spreadsheets_values(spreadsheet_id)
+    request = values.batchGet(
+        spreadsheetId=spreadsheet_id,
+        ranges=sheet_ranges,
+        majorDimension=major_dimension,
+        valueRenderOption=value_render_option,
+        fields=fields,
+    )
+    result = _execute(request, spreadsheet_id)
+    # Empty ranges come back without a values key
+    return [
+        value_range.get('values', []) for value_range in result['valueRanges']
+    ]
+
+
+def add_rows(
+    spreadsheet_id: str,
+    name: str,
+    rows: list[list],
+    fields: Optional[str] = APPEND_FIELDS,
+) -> dict:
+    body = {'values': rows}
+    values = get_spreadsheets_values(spreadsheet_id)
+    request = values.append(
         spreadsheetId=spreadsheet_id,
         range=name,
         valueInputOption='RAW',
+        includeValuesInResponse=False,
+        fields=fields,
         body=body,
-    ).execute()
+    )
+    result = _execute(request, spreadsheet_id, idempotent=False)
     return result
 
 
+def add_row(spreadsheet_id: str, name: str, values: list) -> dict:
+    return add_rows(spreadsheet_id, name, [values])
+
+
+def _flatten(rows: list[list]) -> list:
+    return list(chain.from_iterable(rows))
+
+
+def _column(columns: list[list]) -> list:
+    # The values of a one column range read as COLUMNS. Blank cells between
+    # values come back as empty strings, read as ROWS they were left out.
+    if not columns:
+        return []
+    return [value for value in columns[0] if value != '']
+
+
 def get_names(spreadsheet_id: str) -> dict[str, str]:
-    return dict(read_sheet(spreadsheet_id, 'Names!A2:B'))
+    return dict(read_sheet(spreadsheet_id, NAMES_RANGE))
 
 
 def get_categories(spreadsheet_id: str) -> list[str]:
-    return reduce(
-        lambda a, b: a + b, read_sheet(spreadsheet_id, 'Categories!A2:A')
-    )
+    return _column(read_sheet(spreadsheet_id, CATEGORIES_RANGE, COLUMNS))
 
 
-def add_time(
-    spreadspreadsheet_id: str,
+def get_bootstrap(
+    spreadsheet_id: str, extra_ranges: Optional[dict[str, str]] = None
+) -> dict:
+    extra_ranges = extra_ranges or {}
+    sheet_ranges = [NAMES_RANGE, CATEGORIES_RANGE] + list(extra_ranges.values())
+    names, categories, *extras = read_sheets(spreadsheet_id, sheet_ranges)
+    bootstrap = dict(zip(extra_ranges.keys(), extras))
+    bootstrap['names'] = dict(names)
+    bootstrap['categories'] = _flatten(categories)
+    return bootstrap
+
+
+def get_submission_ids(spreadsheet_id: str) -> set[str]:
+    (columns,) = read_sheets(spreadsheet_id, [SUBMISSION_IDS_RANGE], COLUMNS)
+    return set(_column(columns))
+
+
+def time_row(
     name: str,
     semester: str,
     duration: timedelta,
     category: str,
-) -> dict[str, str]:
-    values = [
+    submission_id: Optional[str] = None,
+) -> list:
+    if submission_id is None:
+        submission_id = uuid4().hex
+    return [
         name,
         semester,
         duration.total_seconds() / 60.0 / 60.0 / 24.0,
         datetime.now().strftime(DATE_FMT),
         category,
+        submission_id,
     ]
-    return add_row(spreadspreadsheet_id, 'Submissions', values)
+
+
+def add_submission(spreadsheet_id: str, values: list) -> dict:
+    return add_submissions(spreadsheet_id, [values])
+
+
+def add_submissions(
+    spreadsheet_id: str, rows: list[list], deduplicate: bool = False
+) -> dict:
+    # deduplicate drops rows whose id is already in the sheet, use it when
+    # resending rows that may have been written by an earlier attempt
+    ids = [row[SUBMISSION_ID_COLUMN] for row in rows]
+    if deduplicate:
+        known = _submission_index.known(spreadsheet_id, ids)
+        rows = [row for row in rows if row[SUBMISSION_ID_COLUMN] not in known]
+        ids = [row[SUBMISSION_ID_COLUMN] for row in rows]
+        if not rows:
+            return {}
+    result = add_rows(spreadsheet_id, SUBMISSIONS_SHEET, rows)
+    _submission_index.add(spreadsheet_id, ids)
+    return result
+
+
+def add_time(
+    spreadsheet_id: str,
+    name: str,
+    semester: str,
+    duration: timedelta,
+    category: str,
+    submission_id: Optional[str] = None,
+) -> dict[str, str]:
+    values = time_row(name, semester, duration, category, submission_id)
+    return add_submission(spreadsheet_id, values)
@@ -1,12 +1,15 @@
 from __future__ import annotations
 
+from collections.abc import Callable
+from functools import partial
 import json
 from typing import Union
 
 from PySide2 import QtGui, QtWidgets
 
-from usc_lr_timer import google_sheets, talk_to_google
+from usc_lr_timer import cache, google_sheets, talk_to_google
 from usc_lr_timer.constants import RESOURCES
+from usc_lr_timer.tracing import traced
 
 JOURNALS = RESOURCES / 'journal_mapping.json'
 
@@ -19,6 +22,7 @@ class Model(object):
         self._journals = []
         self._journal_index = 0
         self._journal_mapping = {}
+        self._categories = []
         self._pin = ''
 
     @property
@@ -29,6 +33,10 @@ class Model(object):
     def journals(self) -> list[str]:
         return self._journals[:]
 
+    @property
+    def name_index(self) -> int:
+        return self._name_index
+
     @property
     def name(self) -> Union[str, None]:
         if self._name_index == 0:
@@ -50,22 +58,68 @@ class Model(object):
         else:
             return self._journal_mapping[self.journal]
 
+    @property
+    def categories(self) -> list[str]:
+        return self._categories[:]
+
     @property
     def pin(self) -> str:
         return self._pin
 
-    def set_names(self):
-        if self.sheet_id is not None:
-            status, result = talk_to_google.talk_to_google(
-                google_sheets.get_names, self.sheet_id,
-            )
-            if status == talk_to_google.Results.success:
-                self._name_mapping = dict(result)
-                self._names = [''] + list(self._name_mapping.keys())
-                return
+    def _set_bootstrap(self, bootstrap: dict):
+        self._name_mapping = dict(bootstrap['names'])
+        self._names = [''] + list(self._name_mapping.keys())
+        self._categories = list(bootstrap['categories'])
 
+    def set_names(self) -> bool:
+        # Names and categories are fetched together so the timer window does
+        # not need its own round trip for categories. Returns False when the
+        # names came from a stale cache, or there are none yet, and should be
+        # refreshed.
         self._name_mapping = {}
         self._names = []
+        self._categories = []
+        if self.sheet_id is None:
+            return True
+        cached, fresh = cache.load(self.sheet_id)
+        if cached is None:
+            return False
+        self._set_bootstrap(cached)
+        return fresh
+
+    def refresh_names(self, callback: Callable) -> talk_to_google.Future:
+        future = talk_to_google.submit(
+            google_sheets.get_bootstrap, self.sheet_id,
+        )
+        future.add_done_callback(
+            partial(self._names_refreshed, self.sheet_id, callback)
+        )
+        return future
+
+    def _names_refreshed(
+        self,
+        sheet_id: str,
+        callback: Callable,
+        status: talk_to_google.Results,
+        result: dict,
+    ):
+        if status != talk_to_google.Results.success:
+            return
+        cache.save(sheet_id, result)
+        if sheet_id != self.sheet_id:
+            return
+        name = self.name
+        changed = (
+            list(result['names'].items()) != list(self._name_mapping.items())
+            or result['categories'] != self._categories
+        )
+        if changed:
+            self._set_bootstrap(result)
+            if name in self._names:
+                self._name_index = self._names.index(name)
+            else:
+                self._name_index = 0
+        callback(changed)
 
     def set_journals(self):
         with open(JOURNALS) as stream:
@@ -91,13 +145,49 @@ class View(object):
     def __init__(self, model: Model, widget: LoginDialog):
         self.model = model
         self.widget = widget
+        self._loading = None
 
+    @traced
     def set_names(self):
-        self.model.set_names()
+        fresh = self.model.set_names()
         self.widget.names_cb.clear()
+        self.widget.names_cb.setEnabled(True)
+        if self._loading is not None:
+            # The names for the journal that was picked before are not needed
+            loading, self._loading = self._loading, None
+            loading.cancel()
         if self.model.journal:
             self.widget.names_cb.addItems(self.model.names)
+        if not fresh:
+            future = self.model.refresh_names(self.names_refreshed)
+            if not self.model.names:
+                # Nothing to choose from until Google answers
+                self.widget.names_cb.setEnabled(False)
+                self._loading = future
+                future.add_done_callback(lambda *_: self.names_loaded(future))
+
+    def names_loaded(self, future: talk_to_google.Future):
+        # A journal picked while loading has its own request
+        if future is not self._loading:
+            return
+        self._loading = None
+        self.widget.names_cb.setEnabled(True)
+        if future.status == talk_to_google.Results.error:
+            QtWidgets.QMessageBox.critical(
+                self.widget, 'Error', str(future.exception)
+            )
 
+    def names_refreshed(self, changed: bool):
+        if not changed:
+            return
+        names_cb = self.widget.names_cb
+        blocked = names_cb.blockSignals(True)
+        names_cb.clear()
+        names_cb.addItems(self.model.names)
+        names_cb.setCurrentIndex(self.model.name_index)
+        names_cb.blockSignals(blocked)
+
+    @traced
     def set_journals(self):
         self.model.set_journals()
         self.widget.journals_cb.addItems(self.model.journals)
@@ -124,6 +214,7 @@ class View(object):
 
 
 class LoginDialog(QtWidgets.QDialog):
+    @traced
     def __init__(self, model: Model):
         super().__init__(None)
         self._layout = QtWidgets.QVBoxLayout()
@@ -178,9 +269,10 @@ class LoginDialog(QtWidgets.QDialog):
             QtWidgets.QMessageBox.critical(self, 'Failed', 'Incorrect Pin')
 
 
-def login() -> tuple(bool, str, str, str):
+@traced
+def login() -> tuple(bool, str, str, str, list[str]):
     model = Model()
     dialog = LoginDialog(model)
     dialog.exec_()
     success = dialog.result() == dialog.Accepted
-    return success, model.journal, model.sheet_id, model.name
+    return success, model.journal, model.sheet_id, model.name, model.categories
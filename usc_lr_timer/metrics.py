@@ -0,0 +1,279 @@
+from __future__ import annotations
+
+import atexit
+from bisect import bisect_left
+from collections.abc import Callable
+from contextlib import contextmanager
+import json
+import os
+from pathlib import Path
+import threading
+import time
+from typing import Optional
+
+from usc_lr_timer.cancel import Canceled
+
+# Set to a file name to write the metrics there when the app exits. Files
+# ending in .json get JSON, anything else the Prometheus text format.
+METRICS_ENV = 'USC_LR_TIMER_METRICS'
+PREFIX = 'usc_lr_timer'
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNTERS = {
+    'calls_total': 'Calls to Google by method and how they ended',
+    'requests_total': 'HTTP requests sent, retries included',
+    'retries_total': 'Requests sent again after a failure',
+    'sent_bytes_total': 'Request body bytes sent',
+    # httplib2 hands over bodies already decompressed, the bytes on the wire
+    # are fewer when the response was gzipped
+    'received_decoded_bytes_total': 'Response body bytes received, decoded',
+    'throttled_seconds_total': 'Time spent waiting on the rate limiter',
+}
+HISTOGRAMS = {
+    'call_seconds': 'Time from a call starting to it finishing',
+    'queue_wait_seconds': 'Time a call waited for a pool thread',
+    'spreadsheet_call_seconds': 'Call time by spreadsheet',
+}
+
+
+class Call(object):
+    # What one call to Google cost. The worker running the call binds it to
+    # its thread, the requests the call makes add to it and once it is done
+    # it is handed to every hook.
+    def __init__(self, method: str, queued: float = 0.0):
+        self.method = method
+        self.queued = queued
+        self.status = None
+        self.duration = 0.0
+        self.requests = 0
+        self.retries = 0
+        self.bytes_sent = 0
+        self.decoded_bytes_received = 0
+        self.throttled = 0.0
+        self.spreadsheet_ids = set()
+
+
+class Histogram(object):
+    def __init__(self, buckets: tuple[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # The last count is for values above every bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        bounds = [str(bucket) for bucket in self.buckets] + ['+Inf']
+        total = 0
+        cumulative = []
+        for bound, count in zip(bounds, self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return cumulative
+
+
+def _labels(labels: tuple[tuple[str, str]]) -> str:
+    pairs = ','.join(f'{key}="{value}"' for key, value in labels)
+    return f'{{{pairs}}}' if pairs else ''
+
+
+class Metrics(object):
+    # Totals and latency histograms of every call, by method. Is a hook, so
+    # it sees the calls once they are done.
+    def __init__(self, buckets: tuple[float] = LATENCY_BUCKETS):
+        self._buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = {name: {} for name in COUNTERS}
+        self._histograms = {name: {} for name in HISTOGRAMS}
+
+    def __call__(self, call: Call):
+        method = (('method', call.method),)
+        with self._lock:
+            self._add('calls_total', method + (('status', call.status),), 1)
+            self._add('requests_total', method, call.requests)
+            self._add('retries_total', method, call.retries)
+            self._add('sent_bytes_total', method, call.bytes_sent)
+            self._add(
+                'received_decoded_bytes_total',
+                method,
+                call.decoded_bytes_received,
+            )
+            self._add('throttled_seconds_total', method, call.throttled)
+            self._observe('call_seconds', method, call.duration)
+            self._observe('queue_wait_seconds', method, call.queued)
+            for spreadsheet_id in call.spreadsheet_ids:
+                labels = (('spreadsheet_id', spreadsheet_id),)
+                self._observe('spreadsheet_call_seconds', labels, call.duration)
+
+    def _add(self, name: str, labels: tuple, value: float):
+        counter = self._counters[name]
+        counter[labels] = counter.get(labels, 0) + value
+
+    def _observe(self, name: str, labels: tuple, value: float):
+        histograms = self._histograms[name]
+        if labels not in histograms:
+            histograms[labels] = Histogram(self._buckets)
+        histograms[labels].observe(value)
+
+    def counter(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters[name].get(tuple(labels.items()), 0)
+
+    def histogram(self, name: str, **labels) -> Optional[Histogram]:
+        with self._lock:
+            return self._histograms[name].get(tuple(labels.items()))
+
+    def clear(self):
+        with self._lock:
+            for values in self._counters.values():
+                values.clear()
+            for values in self._histograms.values():
+                values.clear()
+
+    def to_json(self) -> dict:
+        with self._lock:
+            counters = {
+                name: [
+                    {'labels': dict(labels), 'value': value}
+                    for labels, value in values.items()
+                ]
+                for name, values in self._counters.items()
+            }
+            histograms = {
+                name: [
+                    {
+                        'labels': dict(labels),
+                        'buckets': dict(histogram.cumulative()),
+                        'sum': histogram.sum,
+                        'count': histogram.count,
+                    }
+                    for labels, histogram in values.items()
+                ]
+                for name, values in self._histograms.items()
+            }
+        return {'counters': counters, 'histograms': histograms}
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for name, values in self._counters.items():
+                full_name = f'{PREFIX}_{name}'
+                lines.append(f'# HELP {full_name} {COUNTERS[name]}')
+                lines.append(f'# TYPE {full_name} counter')
+                for labels, value in values.items():
+                    lines.append(f'{full_name}{_labels(labels)} {value}')
+            for name, values in self._histograms.items():
+                full_name = f'{PREFIX}_{name}'
+                lines.append(f'# HELP {full_name} {HISTOGRAMS[name]}')
+                lines.append(f'# TYPE {full_name} histogram')
+                for labels, histogram in values.items():
+                    for bound, count in histogram.cumulative():
+                        bucket = _labels(labels + (('le', bound),))
+                        lines.append(f'{full_name}_bucket{bucket} {count}')
+                    suffix = _labels(labels)
+                    lines.append(f'{full_name}_sum{suffix} {histogram.sum}')
+                    lines.append(f'{full_name}_count{suffix} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: Path):
+        path = Path(path)
+        if path.suffix == '.json':
+            text = json.dumps(self.to_json(), indent=2)
+        else:
+            text = self.to_prometheus()
+        tmp_path = path.with_suffix(path.suffix + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as stream:
+            stream.write(text)
+        os.replace(tmp_path, path)
+
+
+_metrics = Metrics()
+_hooks = [_metrics]
+_local = threading.local()
+
+
+def registry() -> Metrics:
+    return _metrics
+
+
+def add_hook(hook: Callable):
+    # hook is called with every finished Call, on the thread that ran it
+    _hooks.append(hook)
+
+
+def remove_hook(hook: Callable):
+    _hooks.remove(hook)
+
+
+def configure_metrics(path: Optional[Path] = None) -> Optional[Path]:
+    # Writes the metrics to path when the app exits. Without a path the
+    # METRICS_ENV environment variable is used, if set.
+    if path is None:
+        path = os.environ.get(METRICS_ENV)
+        if not path:
+            return None
+    path = Path(path)
+    atexit.register(_metrics.write, path)
+    return path
+
+
+def method_name(fn: Callable) -> str:
+    # partials and other callables without a name are labeled by type
+    return getattr(fn, '__name__', type(fn).__name__)
+
+
+def current() -> Optional[Call]:
+    return getattr(_local, 'call', None)
+
+
+@contextmanager
+def record(method: str, queued: float = 0.0):
+    # Binds a Call to this thread for the duration of the block
+    call = Call(method, queued)
+    previous = current()
+    _local.call = call
+    start = time.monotonic()
+    try:
+        yield call
+    except Canceled:
+        call.status = 'canceled'
+        raise
+    except Exception:
+        call.status = 'error'
+        raise
+    else:
+        call.status = 'success'
+    finally:
+        call.duration = time.monotonic() - start
+        _local.call = previous
+        for hook in _hooks[:]:
+            hook(call)
+
+
+def count_retry():
+    call = current()
+    if call is not None:
+        call.retries += 1
+
+
+def count_request(spreadsheet_id: str, body: Optional[str], throttled: float):
+    call = current()
+    if call is not None:
+        call.requests += 1
+        call.spreadsheet_ids.add(spreadsheet_id)
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        if isinstance(body, bytes):
+            call.bytes_sent += len(body)
+        call.throttled += throttled
+
+
+def count_received(content: bytes):
+    # content is the decoded body
+    call = current()
+    if call is not None:
+        call.decoded_bytes_received += len(content)
@@ -1,20 +1,36 @@
 from __future__ import annotations
 
 from collections import namedtuple
+from collections.abc import Callable
 from datetime import timedelta
-from typing import Union
+from functools import partial
+import time
+from typing import Optional, Union
 
-from usc_lr_timer import google_sheets, talk_to_google
+from usc_lr_timer import cache, google_sheets, talk_to_google
+from usc_lr_timer.outbox import Outbox
+from usc_lr_timer.tracing import traced
 
 SubmitResult = namedtuple('SubmitResult', ('result', 'error'))
 
 
 class Model(object):
-    def __init__(self, journal: str, sheet_id: str, name: str):
+    def __init__(
+        self,
+        journal: str,
+        sheet_id: str,
+        name: str,
+        categories: Optional[list[str]] = None,
+        outbox: Optional[Outbox] = None,
+    ):
         self._journal = journal
         self._sheet_id = sheet_id
         self._name = name
+        # Time from finished runs of the timer plus, while it is running, the
+        # monotonic clock reading it was started at. The duration is worked
+        # out from the clock so late or missed ticks don't lose time.
         self._duration = timedelta()
+        self._started = None
         self._manual_hours = 0
         self._manual_minutes = 0
         self._manual_seconds = 0
@@ -22,16 +38,72 @@ class Model(object):
         self._semesters = ['Fall', 'Spring']
         self._categories = []
         self._category_index = 0
+        self._restored_category = None
+        self._preloaded_categories = categories
+        self._outbox = outbox if outbox is not None else Outbox()
+
+    @property
+    def outbox(self) -> Outbox:
+        return self._outbox
 
     @property
     def duration(self) -> timedelta:
-        return self._duration
+        if self._started is None:
+            return self._duration
+        elapsed = timedelta(seconds=time.monotonic() - self._started)
+        return self._duration + elapsed
+
+    @property
+    def running(self) -> bool:
+        return self._started is not None
 
-    def increment_duration(self, seconds: int):
-        self._duration = self._duration + timedelta(seconds=seconds)
+    def start_timer(self):
+        if self._started is None:
+            self._started = time.monotonic()
+
+    def pause_timer(self):
+        if self._started is not None:
+            self._duration = self.duration
+            self._started = None
 
     def reset_duration(self):
         self._duration = timedelta()
+        if self._started is not None:
+            self._started = time.monotonic()
+
+    def checkpoint(self) -> dict:
+        # Wall clock time is used so the state still means something after
+        # a restart
+        if self._started is None:
+            started = None
+        else:
+            started = time.time() - (time.monotonic() - self._started)
+        return {
+            'spreadsheet_id': self._sheet_id,
+            'name': self._name,
+            'duration': self._duration.total_seconds(),
+            'running': self._started is not None,
+            'started': started,
+            'semester': self.semester,
+            'category': self.category,
+        }
+
+    def restore(self, state: dict):
+        # The timer comes back paused
+        self._duration = timedelta(seconds=state['duration'])
+        self._started = None
+        if state.get('semester') in self._semesters:
+            self._semester_index = self._semesters.index(state['semester'])
+        # Categories may not be loaded yet
+        self._restored_category = state.get('category')
+        self._select_category(self._restored_category)
+
+    def _select_category(self, category: Optional[str]):
+        if category and category in self._categories:
+            self._category_index = self._categories.index(category)
+            self._restored_category = None
+        else:
+            self._category_index = 0
 
     @property
     def semesters(self) -> list[str]:
@@ -49,10 +121,22 @@ class Model(object):
     def journal(self) -> str:
         return self._journal
 
+    @property
+    def sheet_id(self) -> str:
+        return self._sheet_id
+
     @property
     def semester(self) -> str:
         return self._semesters[self._semester_index]
 
+    @property
+    def semester_index(self) -> int:
+        return self._semester_index
+
+    @property
+    def category_index(self) -> int:
+        return self._category_index
+
     @property
     def category(self) -> Union[None, str]:
         if self._category_index == 0:
@@ -89,20 +173,52 @@ class Model(object):
     def set_manual_seconds(self, seconds: int):
         self._manual_seconds = seconds
 
-    def set_categories(self):
-        status, result = talk_to_google.talk_to_google(
-            google_sheets.get_categories, self._sheet_id,
-        )
-        if status == talk_to_google.Results.success:
-            self._categories = [''] + result
+    @traced
+    def set_categories(self) -> bool:
+        # Returns False when the categories came from a stale cache, or there
+        # are none yet, and should be refreshed
+        cached, fresh = cache.load(self._sheet_id)
+        if cached is not None:
+            self._categories = [''] + cached['categories']
+            self._preloaded_categories = None
+        elif self._preloaded_categories is not None:
+            # Categories fetched at login are only used once, later calls
+            # ask Google again
+            self._categories = [''] + self._preloaded_categories
+            self._preloaded_categories = None
+            fresh = True
         else:
             self._categories = []
+        self._select_category(self._restored_category)
+        return fresh
+
+    def refresh_categories(self, callback: Callable) -> talk_to_google.Future:
+        future = talk_to_google.submit(
+            google_sheets.get_bootstrap, self._sheet_id,
+        )
+        future.add_done_callback(partial(self._categories_refreshed, callback))
+        return future
+
+    def _categories_refreshed(
+        self, callback: Callable, status: talk_to_google.Results, result: dict,
+    ):
+        if status != talk_to_google.Results.success:
+            return
+        cache.save(self._sheet_id, result)
+        categories = [''] + result['categories']
+        changed = categories != self._categories
+        if changed:
+            category = self.category if self._categories else None
+            self._categories = categories
+            self._select_category(self._restored_category or category)
+        callback(changed)
 
     def set_semester_index(self, index: int):
         self._semester_index = index
 
     def set_category_index(self, index: int):
         self._category_index = index
+        self._restored_category = None
 
     def submit(self, manual: bool) -> SubmitResult:
         if self.name is None:
@@ -122,12 +238,10 @@ class Model(object):
         if seconds == 0:
             return SubmitResult(None, 'No time recorded')
 
-        status, _ = talk_to_google.talk_to_google(
-            google_sheets.add_time,
-            spreadsheet_id=self._sheet_id,
-            name=self.name,
-            semester=self.semester,
-            duration=duration,
-            category=self.category,
+        # The row is stored locally and sent by the OutboxFlusher, so submit
+        # never waits on the network
+        row = google_sheets.time_row(
+            self.name, self.semester, duration, self.category,
         )
-        return SubmitResult(status, None)
+        self._outbox.add(self._sheet_id, row)
+        return SubmitResult(talk_to_google.Results.success, None)
@@ -0,0 +1,270 @@
+from __future__ import annotations
+
+from collections import namedtuple
+import json
+from pathlib import Path
+import sqlite3
+import time
+from typing import Optional
+from uuid import uuid4
+
+from PySide2 import QtCore
+
+from usc_lr_timer import google_sheets, talk_to_google
+from usc_lr_timer.constants import data_dir
+
+OUTBOX_FILE = 'outbox.sqlite3'
+# Failed flushes are retried after RETRY_INTERVAL seconds, doubling on every
+# consecutive failure up to MAX_RETRY_INTERVAL
+RETRY_INTERVAL = 15
+MAX_RETRY_INTERVAL = 10 * 60
+# Rows queued within LINGER seconds of each other are sent in one append of
+# at most MAX_BATCH_SIZE rows
+MAX_BATCH_SIZE = 50
+LINGER = 2.0
+# Rows claimed by an app instance longer ago than this are taken to belong
+# to an instance that died while sending them. Sending, retries included,
+# takes a few minutes at most.
+CLAIM_TIMEOUT = 15 * 60
+
+Entry = namedtuple('Entry', ('id', 'spreadsheet_id', 'row', 'attempts'))
+
+
+class Outbox(object):
+    # Submissions are written here first so they survive the app closing or
+    # the network being down, and are removed once Google has them. Every
+    # app instance of the OS user shares the file, so rows are claimed
+    # before they are sent and no two instances send the same row. Only use
+    # an Outbox from the thread that created it.
+    def __init__(self, path: Optional[Path] = None):
+        if path is None:
+            path = data_dir() / OUTBOX_FILE
+        self._path = path
+        self._connection = sqlite3.connect(str(path))
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS submissions ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'spreadsheet_id TEXT NOT NULL, '
+                'row TEXT NOT NULL, '
+                'attempts INTEGER NOT NULL DEFAULT 0, '
+                'created REAL NOT NULL, '
+                'claim TEXT, '
+                'claimed_at REAL)'
+            )
+            columns = {
+                column[1]
+                for column in self._connection.execute(
+                    'PRAGMA table_info(submissions)'
+                )
+            }
+            # Outboxes from before rows were claimed
+            if 'claim' not in columns:
+                self._connection.execute(
+                    'ALTER TABLE submissions ADD COLUMN claim TEXT'
+                )
+                self._connection.execute(
+                    'ALTER TABLE submissions ADD COLUMN claimed_at REAL'
+                )
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def __len__(self) -> int:
+        cursor = self._connection.execute('SELECT COUNT(*) FROM submissions')
+        return cursor.fetchone()[0]
+
+    def add(self, spreadsheet_id: str, row: list) -> int:
+        with self._connection:
+            cursor = self._connection.execute(
+                'INSERT INTO submissions (spreadsheet_id, row, created) '
+                'VALUES (?, ?, ?)',
+                (spreadsheet_id, json.dumps(row), time.time()),
+            )
+        return cursor.lastrowid
+
+    def pending(
+        self, limit: int = -1, spreadsheet_id: Optional[str] = None
+    ) -> list[Entry]:
+        if spreadsheet_id is None:
+            cursor = self._connection.execute(
+                'SELECT id, spreadsheet_id, row, attempts FROM submissions '
+                'ORDER BY id LIMIT ?',
+                (limit,),
+            )
+        else:
+            cursor = self._connection.execute(
+                'SELECT id, spreadsheet_id, row, attempts FROM submissions '
+                'WHERE spreadsheet_id = ? ORDER BY id LIMIT ?',
+                (spreadsheet_id, limit),
+            )
+        return [
+            Entry(id_, spreadsheet_id, json.loads(row), attempts)
+            for id_, spreadsheet_id, row, attempts in cursor
+        ]
+
+    def claim(self, limit: int = -1) -> list[Entry]:
+        # The oldest unclaimed rows of one spreadsheet, claimed for this
+        # instance to send. A row whose claim timed out counts as attempted
+        # since the instance that claimed it may have sent it.
+        now = time.time()
+        claimable = '(claim IS NULL OR claimed_at < ?)'
+        expired = now - CLAIM_TIMEOUT
+        with self._connection:
+            # Takes the write lock now so no other instance claims the same
+            # rows in between
+            self._connection.execute('BEGIN IMMEDIATE')
+            oldest = self._connection.execute(
+                f'SELECT spreadsheet_id FROM submissions WHERE {claimable} '
+                'ORDER BY id LIMIT 1',
+                (expired,),
+            ).fetchone()
+            if oldest is None:
+                return []
+            rows = self._connection.execute(
+                'SELECT id, spreadsheet_id, row, attempts, claim '
+                f'FROM submissions WHERE spreadsheet_id = ? AND {claimable} '
+                'ORDER BY id LIMIT ?',
+                (oldest[0], expired, limit),
+            ).fetchall()
+            entries = []
+            for id_, spreadsheet_id, row, attempts, previous in rows:
+                if previous is not None:
+                    attempts += 1
+                entries.append(
+                    Entry(id_, spreadsheet_id, json.loads(row), attempts)
+                )
+            claim = uuid4().hex
+            self._connection.executemany(
+                'UPDATE submissions SET claim = ?, claimed_at = ?, '
+                'attempts = ? WHERE id = ?',
+                [(claim, now, entry.attempts, entry.id) for entry in entries],
+            )
+        return entries
+
+    def mark_attempted(self, ids: list[int]):
+        # Also gives up the claim on the rows so they can be sent again
+        with self._connection:
+            self._connection.executemany(
+                'UPDATE submissions SET attempts = attempts + 1, '
+                'claim = NULL, claimed_at = NULL WHERE id = ?',
+                [(id_,) for id_ in ids],
+            )
+
+    def remove(self, ids: list[int]):
+        with self._connection:
+            self._connection.executemany(
+                'DELETE FROM submissions WHERE id = ?', [(id_,) for id_ in ids],
+            )
+
+    def close(self):
+        self._connection.close()
+
+
+class OutboxFlusher(QtCore.QObject):
+
+    pending_changed = QtCore.Signal(int)
+
+    def __init__(
+        self,
+        outbox: Outbox,
+        parent: QtCore.QObject = None,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        linger: float = LINGER,
+        retry_interval: Optional[float] = None,
+    ):
+        super().__init__(parent)
+        self._outbox = outbox
+        self._max_batch_size = max_batch_size
+        # RETRY_INTERVAL unless given
+        self._first_retry_interval = retry_interval
+        self._busy = False
+        self._future = None
+        self._failures = 0
+        self._retry_timer = QtCore.QTimer(self)
+        self._retry_timer.setSingleShot(True)
+        self._retry_timer.timeout.connect(self.flush)
+        self._linger_timer = QtCore.QTimer(self)
+        self._linger_timer.setSingleShot(True)
+        self._linger_timer.setInterval(int(linger * 1000))
+        self._linger_timer.timeout.connect(self.flush)
+
+    @property
+    def busy(self) -> bool:
+        return self._busy
+
+    @property
+    def retry_interval(self) -> float:
+        first = self._first_retry_interval
+        if first is None:
+            first = RETRY_INTERVAL
+        return min(
+            first * 2 ** max(self._failures - 1, 0),
+            MAX_RETRY_INTERVAL,
+        )
+
+    @property
+    def max_batch_size(self) -> int:
+        return self._max_batch_size
+
+    @property
+    def linger(self) -> float:
+        return self._linger_timer.interval() / 1000
+
+    @QtCore.Slot()
+    def schedule(self):
+        # Wait for more rows unless a full batch is already queued
+        pending = len(self._outbox)
+        self.pending_changed.emit(pending)
+        if pending >= self._max_batch_size:
+            self.flush()
+        elif not self._linger_timer.isActive():
+            self._linger_timer.start()
+
+    @QtCore.Slot()
+    def flush(self):
+        if self._busy:
+            return
+        self._linger_timer.stop()
+        pending = len(self._outbox)
+        self.pending_changed.emit(pending)
+        entries = self._outbox.claim(self._max_batch_size)
+        if not entries:
+            # The rows left are claimed by another instance, or by one that
+            # died while sending them and can be taken over later
+            if pending and not self._retry_timer.isActive():
+                self._retry_timer.start(int(self.retry_interval * 1000))
+            return
+        self._busy = True
+        self._retry_timer.stop()
+        # Rows that were attempted before may already be in the sheet
+        self._future = talk_to_google.talk_to_google_in_background(
+            google_sheets.add_submissions,
+            lambda status, _: self._sent(entries, status),
+            entries[0].spreadsheet_id,
+            [entry.row for entry in entries],
+            deduplicate=any(entry.attempts for entry in entries),
+        )
+
+    def stop(self):
+        # Cancels the rows being sent, which gives up their claim so the
+        # next app instance sends them without waiting out CLAIM_TIMEOUT
+        if self._busy:
+            self._future.cancel()
+        self._linger_timer.stop()
+        self._retry_timer.stop()
+
+    def _sent(self, entries: list[Entry], status: talk_to_google.Results):
+        self._busy = False
+        self._future = None
+        ids = [entry.id for entry in entries]
+        if status == talk_to_google.Results.success:
+            self._failures = 0
+            self._outbox.remove(ids)
+            self.flush()
+        else:
+            self._failures += 1
+            self._outbox.mark_attempted(ids)
+            self.pending_changed.emit(len(self._outbox))
+            self._retry_timer.start(int(self.retry_interval * 1000))
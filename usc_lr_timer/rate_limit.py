@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+from collections.abc import Callable
+from contextlib import contextmanager
+import json
+import os
+from pathlib import Path
+from threading import Lock
+import time
+from typing import Optional
+
+from usc_lr_timer import cancel
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+# Google allows a service account about 60 requests per minute, so by default
+# each spreadsheet gets a request per second with bursts of up to 10
+RATE = 1.0
+CAPACITY = 10
+SHARED_ENV = 'USC_LR_TIMER_SHARED_RATE_LIMIT'
+
+
+class TokenBucket(object):
+    # Every request takes a token, tokens come back at `rate` per second up to
+    # `capacity`. A request that finds the bucket empty still reserves its
+    # token and sleeps until the token would have been there.
+    def __init__(
+        self,
+        rate: float = RATE,
+        capacity: float = CAPACITY,
+        sleep: Callable = cancel.sleep,
+    ):
+        self._rate = rate
+        self._capacity = capacity
+        self._sleep = sleep
+        self._lock = Lock()
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _reserve(self, tokens: float, updated: float, now: float):
+        tokens = min(self._capacity, tokens + (now - updated) * self._rate) - 1
+        wait = max(-tokens / self._rate, 0.0)
+        return tokens, wait
+
+    def acquire(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens, wait = self._reserve(self._tokens, self._updated, now)
+            self._updated = now
+        if wait:
+            self._sleep(wait)
+        return wait
+
+
+@contextmanager
+def _locked(path: Path):
+    with open(path, 'a+') as stream:
+        if os.name == 'nt':
+            stream.seek(0)
+            msvcrt.locking(stream.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            fcntl.flock(stream.fileno(), fcntl.LOCK_EX)
+        try:
+            yield stream
+        finally:
+            if os.name == 'nt':
+                stream.seek(0)
+                msvcrt.locking(stream.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(stream.fileno(), fcntl.LOCK_UN)
+
+
+class FileTokenBucket(TokenBucket):
+    # Same bucket, but the state lives in a file guarded by an OS file lock so
+    # every app instance on the machine draws from it
+    def __init__(
+        self,
+        path: Path,
+        rate: float = RATE,
+        capacity: float = CAPACITY,
+        sleep: Callable = cancel.sleep,
+    ):
+        super().__init__(rate, capacity, sleep)
+        self._path = path
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def acquire(self) -> float:
+        with self._lock, _locked(self._path) as stream:
+            now = time.time()
+            stream.seek(0)
+            try:
+                state = json.loads(stream.read())
+                tokens, updated = state['tokens'], state['updated']
+            except (ValueError, KeyError, TypeError):
+                tokens, updated = self._capacity, now
+            tokens, wait = self._reserve(tokens, min(updated, now), now)
+            stream.seek(0)
+            stream.truncate()
+            stream.write(json.dumps({'tokens': tokens, 'updated': now}))
+            stream.flush()
+        if wait:
+            self._sleep(wait)
+        return wait
+
+
+class RateLimiter(object):
+    # One bucket per spreadsheet. With shared_dir set the buckets are files in
+    # that directory and are shared with other processes.
+    def __init__(
+        self,
+        rate: float = RATE,
+        capacity: float = CAPACITY,
+        shared_dir: Optional[Path] = None,
+        sleep: Callable = cancel.sleep,
+    ):
+        self._rate = rate
+        self._capacity = capacity
+        self._shared_dir = shared_dir
+        self._sleep = sleep
+        self._buckets = {}
+        self._lock = Lock()
+
+    @property
+    def shared(self) -> bool:
+        return self._shared_dir is not None
+
+    def bucket(self, spreadsheet_id: str) -> TokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(spreadsheet_id)
+            if bucket is None:
+                if self._shared_dir is None:
+                    bucket = TokenBucket(
+                        self._rate, self._capacity, self._sleep,
+                    )
+                else:
+                    self._shared_dir.mkdir(parents=True, exist_ok=True)
+                    bucket = FileTokenBucket(
+                        self._shared_dir / f'{spreadsheet_id}.bucket',
+                        self._rate,
+                        self._capacity,
+                        self._sleep,
+                    )
+                self._buckets[spreadsheet_id] = bucket
+        return bucket
+
+    def acquire(self, spreadsheet_id: str) -> float:
+        return self.bucket(spreadsheet_id).acquire()
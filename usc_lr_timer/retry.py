@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+from collections.abc import Callable
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import random
+import socket
+from threading import Lock
+import time
+from typing import Any, Optional
+
+from usc_lr_timer import cancel, metrics
+
+# Statuses that mean Google did not handle the request and it can be sent
+# again. A request that may have changed the sheet (an append) is only
+# retried on 429, where the request is rejected before it is processed.
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+UNPROCESSED_STATUSES = frozenset([429])
+MAX_ATTEMPTS = 5
+BASE_DELAY = 0.5
+MAX_DELAY = 32.0
+BUDGET_CAPACITY = 20
+BUDGET_RATE = 0.5
+
+
+class RetryBudget(object):
+    # Every retry spends a token and tokens come back at `rate` per second,
+    # so a burst of failures cannot turn into a storm of retries
+    def __init__(
+        self, capacity: float = BUDGET_CAPACITY, rate: float = BUDGET_RATE
+    ):
+        self._capacity = capacity
+        self._rate = rate
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = Lock()
+
+    @property
+    def tokens(self) -> float:
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self._capacity, self._tokens + (now - self._updated) * self._rate
+        )
+        self._updated = now
+
+    def spend(self) -> bool:
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+def _status(error: Exception) -> Optional[int]:
+    # Imported here so the client libraries load with the first request
+    from googleapiclient.errors import HttpError
+
+    if isinstance(error, HttpError):
+        return int(error.resp.status)
+    return None
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    from googleapiclient.errors import HttpError
+
+    if not isinstance(error, HttpError):
+        return None
+    value = error.resp.get('retry-after')
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((date - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class RetryPolicy(object):
+    def __init__(
+        self,
+        max_attempts: int = MAX_ATTEMPTS,
+        base_delay: float = BASE_DELAY,
+        max_delay: float = MAX_DELAY,
+        budget: Optional[RetryBudget] = None,
+        sleep: Callable = cancel.sleep,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget if budget is not None else RetryBudget()
+        self.sleep = sleep
+
+    def retryable(self, error: Exception, idempotent: bool = True) -> bool:
+        from httplib2 import ServerNotFoundError
+
+        status = _status(error)
+        if status is not None:
+            if idempotent:
+                return status in RETRY_STATUSES
+            return status in UNPROCESSED_STATUSES
+        if isinstance(error, (ConnectionRefusedError, ServerNotFoundError)):
+            # Nothing was sent
+            return True
+        if idempotent:
+            return isinstance(
+                error, (socket.timeout, TimeoutError, ConnectionError)
+            )
+        return False
+
+    def delay(self, attempt: int, error: Exception) -> Optional[float]:
+        # Full jitter exponential backoff unless Google said how long to wait.
+        # None means the wait would be longer than max_delay.
+        wait = retry_after(error)
+        if wait is None:
+            cap = min(self.max_delay, self.base_delay * 2 ** attempt)
+            return random.uniform(0, cap)
+        if wait > self.max_delay:
+            return None
+        return wait
+
+    def call(self, fn: Callable, idempotent: bool = True) -> Any:
+        attempt = 0
+        while True:
+            try:
+                return fn()
+            except Exception as error:
+                attempt += 1
+                if attempt >= self.max_attempts:
+                    raise
+                if not self.retryable(error, idempotent):
+                    raise
+                wait = self.delay(attempt - 1, error)
+                if wait is None or not self.budget.spend():
+                    raise
+                metrics.count_retry()
+                self.sleep(wait)
@@ -1,15 +1,55 @@
 from __future__ import annotations
 
-from collections.abc import Callable
+import asyncio
+from collections.abc import Callable, Coroutine
+from contextlib import nullcontext
 from enum import IntEnum
-from typing import Any
+from itertools import count
+import threading
+import time
+from typing import Any, Optional
 
 from PySide2 import QtCore, QtGui, QtWidgets
 
+from usc_lr_timer import metrics, tracing
+from usc_lr_timer.async_sheets import AsyncSheetsClient
+from usc_lr_timer.cancel import bind, Canceled, CancelToken, current
 from usc_lr_timer.constants import RESOURCES
-from usc_lr_timer.google_sheets import add_time, get_categories, get_names
+from usc_lr_timer.google_sheets import (
+    add_submission,
+    add_submissions,
+    add_time,
+    get_bootstrap,
+    get_categories,
+    get_names,
+    warm_up,
+)
 
-ALLOWED_METHODS = [add_time, get_categories, get_names]
+ALLOWED_METHODS = [
+    add_submission,
+    add_submissions,
+    add_time,
+    get_bootstrap,
+    get_categories,
+    get_names,
+    warm_up,
+]
+# Coroutines of these methods may run on the pool too. Like the methods
+# above, they only write through add_submission(s) and add_time.
+ALLOWED_COROUTINES = [
+    AsyncSheetsClient.batch_get,
+    AsyncSheetsClient.bootstrap,
+    AsyncSheetsClient.bootstraps,
+    AsyncSheetsClient.get,
+]
+# All network work runs on one pool so the number of threads talking to
+# Google is bounded and threads are reused instead of spawned per call
+THREAD_POOL_SIZE = 4
+THREAD_NAME = 'talk_to_google'
+# Milliseconds to wait for running requests when the app quits
+SHUTDOWN_TIMEOUT = 5000
+# Seconds a call, retries included, may take before it is canceled
+CALL_TIMEOUT = 120.0
 
 
 class Results(IntEnum):
@@ -27,23 +67,41 @@ class _Worker(QtCore.QRunnable):
 
     def __init__(self, fn: Callable, *args, **kwargs):
         super().__init__()
+        # Kept alive by its Future rather than deleted by the pool once it
+        # ran, shutdown_thread_pool may still look at it after that
+        self.setAutoDelete(False)
 
         self.fn = fn
+        self.name = metrics.method_name(fn)
+        # Whether the call is recorded in metrics
+        self.metered = True
         self.args = args
         self.kwargs = kwargs
+        self.created = time.monotonic()
         self.signals = self.Signals()
+        self.token = CancelToken(CALL_TIMEOUT)
         self.result = None
         self.done = False
         self.exception = None
 
     @QtCore.Slot()
     def run(self):
+        _name_thread()
         self.signals.started.emit()
         self.done = False
         self.result = None
         self.exception = None
+        queued = time.monotonic() - self.created
         try:
-            self.result = self.fn(*self.args, **self.kwargs)
+            if self.metered:
+                record = metrics.record(self.name, queued)
+            else:
+                record = nullcontext()
+            with bind(self.token), record:
+                # Canceled before it got a thread
+                self.token.check()
+                with tracing.span(self.name, 'network'):
+                    self.result = self.fn(*self.args, **self.kwargs)
         except Exception as exception:
             self.exception = exception
         finally:
@@ -51,24 +109,249 @@ class _Worker(QtCore.QRunnable):
             self.signals.finished.emit()
 
 
-def talk_to_google(fn: Callable, *args, **kwargs) -> tuple(Results, Any):
+class Future(QtCore.QObject):
+    # Handle for a request running on the thread pool. Lives in the GUI thread
+    # so the worker's finished signal is queued and finished is emitted, with
+    # the status and result, on the GUI thread. settled is emitted once the
+    # worker has actually stopped, which after a cancel can be later.
+
+    finished = QtCore.Signal(object, object)
+    settled = QtCore.Signal(object)
+
+    def __init__(self, worker: Optional[_Worker] = None):
+        super().__init__()
+        self._status = None
+        self._result = None
+        self._exception = None
+        self._landed = None
+        self._settled = worker is None
+        self._worker = worker
+        if worker is not None:
+            worker.signals.finished.connect(self._finish)
+
+    @property
+    def status(self) -> Optional[Results]:
+        return self._status
+
+    @property
+    def result(self) -> Any:
+        return self._result
+
+    @property
+    def exception(self) -> Optional[Exception]:
+        return self._exception
+
+    @property
+    def landed(self) -> Optional[bool]:
+        # Whether the call went through once the worker has settled. None
+        # until then, and also when it was aborted while on the wire and
+        # nobody can tell.
+        return self._landed
+
+    def done(self) -> bool:
+        return self._status is not None
+
+    def running(self) -> bool:
+        return not self._settled
+
+    def add_done_callback(self, callback: Callable):
+        # callback(status, result), called right away if already finished
+        if self.done():
+            callback(self._status, self._result)
+        else:
+            self.finished.connect(callback)
+
+    def cancel(self) -> bool:
+        # Stops the call as soon as it checks its token or aborts the request
+        # it is waiting on. The future finishes as canceled right away and a
+        # late result is dropped; check landed after settled to find out if a
+        # write reached Google anyway.
+        if self.done():
+            return False
+        if self._worker is not None:
+            self._worker.token.cancel()
+        self._resolve(Results.canceled)
+        return True
+
+    @QtCore.Slot()
+    def _finish(self):
+        worker, self._worker = self._worker, None
+        exception = worker.exception
+        if exception is None:
+            self._landed = True
+        elif isinstance(exception, Canceled) and exception.sent:
+            self._landed = None
+        else:
+            self._landed = False
+        self._settled = True
+        _futures.discard(self)
+        if not self.done():
+            if exception is not None:
+                self._resolve(Results.error, None, exception)
+            else:
+                self._resolve(Results.success, worker.result)
+        self.settled.emit(self._landed)
+
+    def _drop(self):
+        # The worker was taken off the queue before it ran
+        self._worker = None
+        self._landed = False
+        self._settled = True
+        _futures.discard(self)
+        if not self.done():
+            self._resolve(Results.canceled)
+        self.settled.emit(self._landed)
+
+    def _resolve(
+        self,
+        status: Results,
+        result: Any = None,
+        exception: Optional[Exception] = None,
+    ):
+        if self._settled:
+            _futures.discard(self)
+        self._status = status
+        self._result = result
+        self._exception = exception
+        self.finished.emit(status, result)
+
+
+# Futures are kept alive until their worker stops
+_futures = set()
+_thread_pool = None
+_thread_pool_size = THREAD_POOL_SIZE
+_thread_ids = count(1)
+
+
+def _name_thread():
+    thread = QtCore.QThread.currentThread()
+    if not thread.objectName().startswith(THREAD_NAME):
+        name = f'{THREAD_NAME}-{next(_thread_ids)}'
+        thread.setObjectName(name)
+        threading.current_thread().name = name
+
+
+def thread_pool() -> QtCore.QThreadPool:
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = QtCore.QThreadPool()
+        _thread_pool.setMaxThreadCount(_thread_pool_size)
+        # Idle threads are kept instead of being torn down and respawned
+        _thread_pool.setExpiryTimeout(-1)
+        app = QtCore.QCoreApplication.instance()
+        if app is not None:
+            app.aboutToQuit.connect(shutdown_thread_pool)
+    return _thread_pool
+
+
+def configure_thread_pool(size: int = THREAD_POOL_SIZE):
+    global _thread_pool_size
+    _thread_pool_size = size
+    if _thread_pool is not None:
+        _thread_pool.setMaxThreadCount(size)
+
+
+def shutdown_thread_pool(timeout: Optional[int] = SHUTDOWN_TIMEOUT) -> bool:
+    # Drop work that has not started and cancel running requests, which
+    # then stop at their next check or have their request aborted. Every
+    # future finishes as canceled right away. Returns False if some were
+    # still running after the timeout.
+    global _thread_pool
+    if _thread_pool is None:
+        return True
+    pool, _thread_pool = _thread_pool, None
+    for future in list(_futures):
+        worker = future._worker
+        if worker is not None and pool.tryTake(worker):
+            future._drop()
+        else:
+            future.cancel()
+    pool.clear()
+    return pool.waitForDone(-1 if timeout is None else timeout)
+
+
+def _check_method(fn: Callable):
     if not callable(fn):
         raise TypeError(f'{fn} is not a callabe')
     if fn not in ALLOWED_METHODS:
         names = ", ".join([m.__name__ for m in ALLOWED_METHODS])
         raise ValueError(f'{fn.__name__} not in {names}')
 
-    worker = _Worker(fn, *args, **kwargs)
+
+def _check_coroutine(coro: Coroutine):
+    if not asyncio.iscoroutine(coro):
+        raise TypeError(f'{coro} is not a coroutine')
+    if coro.cr_code not in [method.__code__ for method in ALLOWED_COROUTINES]:
+        # Never awaited, close it so Python doesn't warn about that
+        coro.close()
+        names = ", ".join([m.__qualname__ for m in ALLOWED_COROUTINES])
+        raise ValueError(f'{coro.__qualname__} not in {names}')
+
+
+def _start(worker: _Worker) -> Future:
+    future = Future(worker)
+    _futures.add(future)
+    thread_pool().start(worker)
+    return future
+
+
+def submit(fn: Callable, *args, **kwargs) -> Future:
+    # Run fn on the thread pool without blocking the GUI thread
+    _check_method(fn)
+    return _start(_Worker(fn, *args, **kwargs))
+
+
+def _run_coroutine(coro: Coroutine) -> Any:
+    # Runs on a pool thread with its own event loop. Canceling the worker's
+    # token cancels the coroutine.
+    token = current()
+
+    async def main():
+        loop = asyncio.get_event_loop()
+        task = loop.create_task(coro)
+        with token.on_cancel(lambda: loop.call_soon_threadsafe(task.cancel)):
+            try:
+                return await task
+            except asyncio.CancelledError:
+                raise Canceled(sent=True)
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(main())
+    finally:
+        loop.close()
+
+
+def submit_coroutine(coro: Coroutine) -> Future:
+    # Bridge from asyncio to Qt: runs coro, a call on an AsyncSheetsClient,
+    # off the GUI thread and finishes the Future on it
+    _check_coroutine(coro)
+    worker = _Worker(_run_coroutine, coro)
+    worker.name = coro.__qualname__
+    # The client records every call the coroutine makes
+    worker.metered = False
+    return _start(worker)
+
+
+def talk_to_google_in_background(
+    fn: Callable, callback: Callable, *args, **kwargs
+) -> Future:
+    future = submit(fn, *args, **kwargs)
+    future.add_done_callback(callback)
+    return future
+
+
+def talk_to_google(fn: Callable, *args, **kwargs) -> tuple(Results, Any):
+    future = submit(fn, *args, **kwargs)
     progress = QtWidgets.QProgressDialog('Talking to Google...', 'Stop', 0, 0)
     progress.setWindowIcon(QtGui.QIcon(str(RESOURCES / 'icon.ico')))
-    worker.signals.finished.connect(progress.accept)
-    threadpool = QtCore.QThreadPool()
-    threadpool.start(worker)
+    future.add_done_callback(lambda *_: progress.accept())
     progress.exec_()
     if progress.wasCanceled():
+        future.cancel()
         return Results.canceled, None
-    elif worker.exception is not None:
-        QtWidgets.QMessageBox.critical(None, 'Error', str(worker.exception))
+    elif future.status == Results.error:
+        QtWidgets.QMessageBox.critical(None, 'Error', str(future.exception))
         return Results.error, None
     else:
-        return Results.success, worker.result
+        return Results.success, future.result
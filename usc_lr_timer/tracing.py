@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import atexit
+from collections.abc import Callable
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+import json
+import os
+from pathlib import Path
+import threading
+import time
+from typing import Optional
+
+# Set to a file name to record a trace of this run. The file is in the Chrome
+# trace format, open it in chrome://tracing or https://ui.perfetto.dev
+TRACE_ENV = 'USC_LR_TIMER_TRACE'
+
+
+class Tracer(object):
+    # Collects wall clock spans from every thread. Timestamps are
+    # microseconds since the tracer was created.
+    def __init__(self):
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._events = []
+        self._threads = set()
+
+    @property
+    def events(self) -> list[dict]:
+        with self._lock:
+            return self._events[:]
+
+    def _now(self) -> float:
+        return (time.perf_counter() - self._start) * 1e6
+
+    @contextmanager
+    def span(self, name: str, category: str = 'app', **args):
+        thread = threading.current_thread()
+        start = self._now()
+        try:
+            yield
+        finally:
+            event = {
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': start,
+                'dur': self._now() - start,
+                'pid': os.getpid(),
+                'tid': thread.ident,
+                'args': args,
+            }
+            with self._lock:
+                self._events.append(event)
+                if thread.ident not in self._threads:
+                    self._threads.add(thread.ident)
+                    self._events.append(self._thread_name(thread))
+
+    @staticmethod
+    def _thread_name(thread: threading.Thread) -> dict:
+        return {
+            'name': 'thread_name',
+            'ph': 'M',
+            'pid': os.getpid(),
+            'tid': thread.ident,
+            'args': {'name': thread.name},
+        }
+
+    def write(self, path: Path):
+        trace = {'traceEvents': self.events, 'displayTimeUnit': 'ms'}
+        with open(path, 'w', encoding='utf-8') as stream:
+            json.dump(trace, stream)
+
+
+_tracer: Optional[Tracer] = None
+
+
+def configure_tracing(path: Optional[Path] = None) -> Optional[Tracer]:
+    # Starts recording and writes the trace to path when the app exits.
+    # Without a path the TRACE_ENV environment variable is used, if set.
+    global _tracer
+    if path is None:
+        path = os.environ.get(TRACE_ENV)
+        if not path:
+            return None
+    _tracer = Tracer()
+    atexit.register(_tracer.write, Path(path))
+    return _tracer
+
+
+def tracer() -> Optional[Tracer]:
+    return _tracer
+
+
+def span(name: str, category: str = 'app', **args):
+    if _tracer is None:
+        return nullcontext()
+    return _tracer.span(name, category, **args)
+
+
+def traced(fn: Callable) -> Callable:
+    # Records a span named after the function every time it is called
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        with span(fn.__qualname__):
+            return fn(*args, **kwargs)
+
+    return wrapper
@@ -1,25 +1,57 @@
 from __future__ import annotations
 
-from PySide2.QtWidgets import QWidget
+from PySide2.QtWidgets import QMessageBox, QWidget
 
 from usc_lr_timer.model import Model, SubmitResult
+from usc_lr_timer.talk_to_google import Future, Results
 
 
 class View(object):
     def __init__(self, model: Model, widget: QWidget):
         self.model = model
         self.widget = widget
+        self._shown_seconds = None
 
     def start_timer(self):
+        self.model.start_timer()
         self.widget.start_button.setEnabled(False)
 
     def pause_timer(self):
+        self.model.pause_timer()
         self.widget.start_button.setEnabled(True)
+        self.set_duration_field()
 
     def set_categories(self):
-        self.model.set_categories()
-        self.widget.categories_cb.clear()
-        self.widget.categories_cb.addItems(self.model.categories)
+        fresh = self.model.set_categories()
+        categories_cb = self.widget.categories_cb
+        blocked = categories_cb.blockSignals(True)
+        categories_cb.clear()
+        categories_cb.addItems(self.model.categories)
+        categories_cb.setCurrentIndex(self.model.category_index)
+        categories_cb.blockSignals(blocked)
+        if not fresh:
+            future = self.model.refresh_categories(self.categories_refreshed)
+            if not self.model.categories:
+                # Nothing to choose from until Google answers
+                self.widget.categories_cb.setEnabled(False)
+                future.add_done_callback(
+                    lambda *_: self.categories_loaded(future)
+                )
+
+    def categories_loaded(self, future: Future):
+        self.widget.categories_cb.setEnabled(True)
+        if future.status == Results.error:
+            QMessageBox.critical(self.widget, 'Error', str(future.exception))
+
+    def categories_refreshed(self, changed: bool):
+        if not changed:
+            return
+        categories_cb = self.widget.categories_cb
+        blocked = categories_cb.blockSignals(True)
+        categories_cb.clear()
+        categories_cb.addItems(self.model.categories)
+        categories_cb.setCurrentIndex(self.model.category_index)
+        categories_cb.blockSignals(blocked)
 
     def set_semester_index(self, index: int):
         self.model.set_semester_index(index)
@@ -64,22 +96,27 @@ class View(object):
 
     def sync(self):
         self.set_categories()
-        self.widget.semesters_cb.clear()
-        self.widget.semesters_cb.addItems(self.model.semesters)
+        semesters_cb = self.widget.semesters_cb
+        blocked = semesters_cb.blockSignals(True)
+        semesters_cb.clear()
+        semesters_cb.addItems(self.model.semesters)
+        semesters_cb.setCurrentIndex(self.model.semester_index)
+        semesters_cb.blockSignals(blocked)
         self.set_manual_hours(self.model.manual_hours)
         self.set_manual_seconds(self.model.manual_seconds)
         self.set_manual_minutes(self.model.manual_minutes)
         self.set_duration_field()
 
-    def increment_duration(self, seconds: int):
-        self.model.increment_duration(seconds)
-        self.set_duration_field()
-
     def set_duration_field(self):
-        minutes, seconds = divmod(self.model.duration.total_seconds(), 60)
+        # Only touch the widget when the shown second changes
+        total = int(self.model.duration.total_seconds())
+        if total == self._shown_seconds:
+            return
+        self._shown_seconds = total
+        minutes, seconds = divmod(total, 60)
         hours, minutes = divmod(minutes, 60)
         self.widget.duration_field.setText(
-            f'{int(hours):02d}:{int(minutes):02d}:{int(seconds):02d}'
+            f'{hours:02d}:{minutes:02d}:{seconds:02d}'
         )
 
     def submit(self) -> SubmitResult: